@@ -0,0 +1,110 @@
+import logging
+from datetime import timedelta
+from threading import Lock, RLock, Thread
+from time import sleep
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple
+
+import boto3
+
+if TYPE_CHECKING:
+    from taskcat._cfn.stack import Stack  # noqa: F401
+    from taskcat._dataclasses import RegionObj  # noqa: F401
+
+LOG = logging.getLogger(__name__)
+
+
+class StackPoller:
+    """Refreshes every registered stack in a single profile/region on one schedule,
+    using one paginated describe_stacks call per interval rather than a call (and a
+    timer thread) per stack."""
+
+    POLL_INTERVAL = timedelta(seconds=60)
+
+    _pollers: Dict[Tuple[str, str], "StackPoller"] = {}
+    _pollers_lock = Lock()
+
+    def __init__(self, client: boto3.client, interval: timedelta = POLL_INTERVAL):
+        self.client = client
+        self.interval = interval
+        self._stacks: Dict[str, "Stack"] = {}
+        self._subscribers: List[Callable[[List["Stack"]], None]] = []
+        self._lock = RLock()
+        self._thread: Optional[Thread] = None
+
+    def __repr__(self):
+        return f"<StackPoller {len(self._stacks)} stacks at {hex(id(self))}>"
+
+    @classmethod
+    def for_region(cls, region: "RegionObj") -> "StackPoller":
+        key = (region.profile, region.name)
+        with cls._pollers_lock:
+            if key not in cls._pollers:
+                cls._pollers[key] = cls(region.client("cloudformation"))
+            return cls._pollers[key]
+
+    @property
+    def active(self) -> bool:
+        return bool(self._stacks)
+
+    def register(self, stack: "Stack") -> None:
+        with self._lock:
+            self._stacks[stack.id] = stack
+            if not self._thread or not self._thread.is_alive():
+                self._thread = Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def unregister(self, stack: "Stack") -> None:
+        with self._lock:
+            self._stacks.pop(stack.id, None)
+
+    def subscribe(self, callback: Callable[[List["Stack"]], None]) -> None:
+        with self._lock:
+            if callback not in self._subscribers:
+                self._subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[List["Stack"]], None]) -> None:
+        with self._lock:
+            if callback in self._subscribers:
+                self._subscribers.remove(callback)
+
+    def _run(self) -> None:
+        while True:
+            sleep(self.interval.total_seconds())
+            with self._lock:
+                if not self._stacks:
+                    self._thread = None
+                    break
+            try:
+                self.poll()
+            except Exception as e:  # pylint: disable=broad-except
+                LOG.warning(f"Failed to refresh stacks {type(e)} {e}")
+                LOG.debug("Traceback:", exc_info=True)
+        # waiters that subscribed after the last poll would otherwise wait for one
+        # that never happens
+        self._notify([])
+
+    def poll(self) -> List["Stack"]:
+        with self._lock:
+            stacks = dict(self._stacks)
+        if not stacks:
+            self._notify([])
+            return []
+        found = set()
+        for page in self.client.get_paginator("describe_stacks").paginate():
+            for stack_props in page["Stacks"]:
+                stack = stacks.get(stack_props["StackId"])
+                if stack:
+                    stack.set_stack_properties(stack_props)
+                    found.add(stack.id)
+        # deleted stacks are only returned when described by id
+        for stack_id, stack in stacks.items():
+            if stack_id not in found:
+                stack.set_stack_properties()
+        self._notify(list(stacks.values()))
+        return list(stacks.values())
+
+    def _notify(self, stacks: List["Stack"]) -> None:
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for callback in subscribers:
+            callback(stacks)
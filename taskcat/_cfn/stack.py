@@ -6,38 +6,65 @@ import re
 import string
 from datetime import datetime, timedelta
 from pathlib import Path
-from threading import Timer
-from typing import Callable, List, Optional, Tuple
+from sys import intern
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
 from uuid import UUID, uuid4
 
 import boto3
 import yaml
 
+from taskcat._cfn.poller import StackPoller
 from taskcat._cfn.template import Template
 from taskcat._common_utils import ordered_dump, pascal_to_snake, s3_url_maker
 from taskcat._dataclasses import TestRegion
 
 LOG = logging.getLogger(__name__)
 
+EPOCH = datetime.fromtimestamp(0)
+
 GENERIC_ERROR_PATTERNS = [
     r"(The following resource\(s\) failed to create: )",
     r"(^Resource creation cancelled$)",
 ]
 
 
-def criteria_matches(criteria: dict, instance):
+def _properties(instance) -> set:
+    properties = set(getattr(instance, "__dict__", {}))
+    properties.update(
+        s for s in getattr(type(instance), "__slots__", ()) if not s.startswith("_")
+    )
+    return properties
+
+
+def _validate_criteria(criteria: dict, instance):
     # fail if criteria includes an invalid property
+    properties = _properties(instance)
     for k in criteria:
-        if k not in instance.__dict__:
+        if k not in properties:
             raise ValueError(f"{k} is not a valid property of {type(instance)}")
+
+
+def _value_matches(value, expected) -> bool:
+    # set valued criteria match any of the values in the set
+    if isinstance(expected, (set, frozenset)):
+        return value in expected
+    return value == expected
+
+
+def _criteria_matches(criteria: dict, instance) -> bool:
     for k, v in criteria.items():
         # matching is AND for multiple criteria, so as soon as one fails,
         # it's not a match
-        if getattr(instance, k) != v:
+        if not _value_matches(getattr(instance, k), v):
             return False
     return True
 
 
+def criteria_matches(criteria: dict, instance):
+    _validate_criteria(criteria, instance)
+    return _criteria_matches(criteria, instance)
+
+
 class StackStatus:
     COMPLETE = ["CREATE_COMPLETE", "UPDATE_COMPLETE", "DELETE_COMPLETE"]
     IN_PROGRESS = [
@@ -67,24 +94,39 @@ class Capabilities:
 
 
 class Event:
+    __slots__ = (
+        "event_id",
+        "stack_name",
+        "logical_id",
+        "type",
+        "status",
+        "physical_id",
+        "timestamp",
+        "status_reason",
+        "_raw_properties",
+        "_properties",
+    )
+
     def __init__(self, event_dict: dict):
         self.event_id: str = event_dict["EventId"]
-        self.stack_name: str = event_dict["StackName"]
-        self.logical_id: str = event_dict["LogicalResourceId"]
-        self.type: str = event_dict["ResourceType"]
-        self.status: str = event_dict["ResourceStatus"]
-        self.physical_id: str = ""
-        self.timestamp: datetime = datetime.fromtimestamp(0)
-        self.status_reason: str = ""
-        self.properties: dict = {}
-        if "PhysicalResourceId" in event_dict.keys():
-            self.physical_id = event_dict["PhysicalResourceId"]
-        if "Timestamp" in event_dict.keys():
-            self.timestamp = event_dict["Timestamp"]
-        if "ResourceStatusReason" in event_dict.keys():
-            self.status_reason = event_dict["ResourceStatusReason"]
-        if "ResourceProperties" in event_dict.keys():
-            self.properties = json.loads(event_dict["ResourceProperties"])
+        self.stack_name: str = intern(event_dict["StackName"])
+        self.logical_id: str = intern(event_dict["LogicalResourceId"])
+        self.type: str = intern(event_dict["ResourceType"])
+        self.status: str = intern(event_dict["ResourceStatus"])
+        self.physical_id: str = event_dict.get("PhysicalResourceId", "")
+        self.timestamp: datetime = event_dict.get("Timestamp", EPOCH)
+        self.status_reason: str = event_dict.get("ResourceStatusReason", "")
+        # decoded on first access, as only nested stack events are ever inspected
+        self._raw_properties: str = event_dict.get("ResourceProperties", "")
+        self._properties: Optional[dict] = None
+
+    @property
+    def properties(self) -> dict:
+        if self._properties is None:
+            raw = self._raw_properties
+            self._properties = json.loads(raw) if raw else {}
+            self._raw_properties = ""
+        return self._properties
 
     def __str__(self):
         return "{} {} {}".format(self.timestamp, self.logical_id, self.status)
@@ -94,6 +136,18 @@ class Event:
 
 
 class Resource:
+    __slots__ = (
+        "stack_id",
+        "test_name",
+        "uuid",
+        "logical_id",
+        "type",
+        "status",
+        "physical_id",
+        "last_updated_timestamp",
+        "status_reason",
+    )
+
     def __init__(
         self, stack_id: str, resource_dict: dict, test_name: str = "", uuid: UUID = None
     ):
@@ -101,24 +155,22 @@ class Resource:
         self.stack_id: str = stack_id
         self.test_name: str = test_name
         self.uuid: UUID = uuid
-        self.logical_id: str = resource_dict["LogicalResourceId"]
-        self.type: str = resource_dict["ResourceType"]
-        self.status: str = resource_dict["ResourceStatus"]
-        self.physical_id: str = ""
-        self.last_updated_timestamp: datetime = datetime.fromtimestamp(0)
-        self.status_reason: str = ""
-        if "PhysicalResourceId" in resource_dict.keys():
-            self.physical_id = resource_dict["PhysicalResourceId"]
-        if "LastUpdatedTimestamp" in resource_dict.keys():
-            self.last_updated_timestamp = resource_dict["LastUpdatedTimestamp"]
-        if "ResourceStatusReason" in resource_dict.keys():
-            self.status_reason = resource_dict["ResourceStatusReason"]
+        self.logical_id: str = intern(resource_dict["LogicalResourceId"])
+        self.type: str = intern(resource_dict["ResourceType"])
+        self.status: str = intern(resource_dict["ResourceStatus"])
+        self.physical_id: str = resource_dict.get("PhysicalResourceId", "")
+        self.last_updated_timestamp: datetime = resource_dict.get(
+            "LastUpdatedTimestamp", EPOCH
+        )
+        self.status_reason: str = resource_dict.get("ResourceStatusReason", "")
 
     def __str__(self):
         return "<Resource {} {}>".format(self.logical_id, self.status)
 
 
 class Parameter:
+    __slots__ = ("key", "value", "raw_value", "use_previous_value", "resolved_value")
+
     def __init__(self, param_dict: dict):
         self.key: str = param_dict["ParameterKey"]
         self.value: str = ""
@@ -144,6 +196,8 @@ class Parameter:
 
 
 class Output:
+    __slots__ = ("key", "value", "description", "export_name")
+
     def __init__(self, output_dict: dict):
         self.key: str = output_dict["OutputKey"]
         self.value: str = output_dict["OutputValue"]
@@ -156,6 +210,8 @@ class Output:
 
 
 class Tag:
+    __slots__ = ("key", "value")
+
     def __init__(self, tag_dict: dict):
         if isinstance(tag_dict, Tag):
             tag_dict = {"Key": tag_dict.key, "Value": tag_dict.value}
@@ -168,32 +224,121 @@ class Tag:
 
 
 class FilterableList(list):
+    """list that can be filtered by item properties. Properties named in
+    INDEXED_PROPERTIES are looked up in hash indexes that are built the first time
+    they are filtered on, and discarded when the list is modified, so they should
+    only name properties that do not change after an item is added"""
+
+    INDEXED_PROPERTIES: Tuple[str, ...] = ()
+
+    def _invalidate(self):
+        self.__dict__.pop("_indexes", None)
+
+    def append(self, item):
+        self._invalidate()
+        super().append(item)
+
+    def extend(self, items):
+        self._invalidate()
+        super().extend(items)
+
+    def insert(self, position, item):
+        self._invalidate()
+        super().insert(position, item)
+
+    def remove(self, item):
+        self._invalidate()
+        super().remove(item)
+
+    def pop(self, *args):
+        self._invalidate()
+        return super().pop(*args)
+
+    def clear(self):
+        self._invalidate()
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        self._invalidate()
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        self._invalidate()
+        super().reverse()
+
+    def __setitem__(self, key, value):
+        self._invalidate()
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        self._invalidate()
+        super().__delitem__(key)
+
+    def __iadd__(self, items):
+        self._invalidate()
+        return super().__iadd__(items)
+
+    def __imul__(self, count):
+        self._invalidate()
+        return super().__imul__(count)
+
+    def _index(self, prop: str) -> Dict[Any, List[int]]:
+        indexes = self.__dict__.setdefault("_indexes", {})
+        if prop not in indexes:
+            index: Dict[Any, List[int]] = {}
+            for position, item in enumerate(self):
+                index.setdefault(getattr(item, prop), []).append(position)
+            indexes[prop] = index
+        return indexes[prop]
+
+    def _indexed_positions(self, criteria: dict) -> Optional[List[int]]:
+        positions: Optional[List[int]] = None
+        for prop in self.INDEXED_PROPERTIES:
+            if prop not in criteria:
+                continue
+            value = criteria[prop]
+            values = value if isinstance(value, (set, frozenset)) else [value]
+            try:
+                index = self._index(prop)
+                matches = [p for v in values for p in index.get(v, [])]
+            except TypeError:  # unhashable value, fall back to a scan
+                continue
+            if positions is None or len(matches) < len(positions):
+                positions = sorted(matches)
+        return positions
+
     def filter(self, criteria: Optional[dict] = None, **kwargs):
         if not criteria and not kwargs:
             return self
         if not criteria:
             criteria = kwargs
-        flist = FilterableList()
-        for item in self:
-            if criteria_matches(criteria, item):
+        flist = type(self)()
+        if not self:
+            return flist
+        _validate_criteria(criteria, self[0])
+        positions = self._indexed_positions(criteria)
+        items = self if positions is None else [self[p] for p in positions]
+        for item in items:
+            if _criteria_matches(criteria, item):
                 flist.append(item)
         return flist
 
 
 class Stacks(FilterableList):
-    pass
+    # status is updated in place by the poller, so is not indexed
+    INDEXED_PROPERTIES = ("id", "test_name", "region_name")
 
 
 class Resources(FilterableList):
-    pass
+    INDEXED_PROPERTIES = ("status", "logical_id", "type", "test_name")
 
 
 class Events(FilterableList):
-    pass
+    INDEXED_PROPERTIES = ("status", "logical_id", "physical_id")
 
 
 class Tags(FilterableList):
-    pass
+    INDEXED_PROPERTIES = ("key",)
 
 
 class Stack:  # pylint: disable=too-many-instance-attributes
@@ -241,8 +386,8 @@ class Stack:  # pylint: disable=too-many-instance-attributes
         self._last_event_refresh: datetime = datetime.fromtimestamp(0)
         self._last_resource_refresh: datetime = datetime.fromtimestamp(0)
         self._last_child_refresh: datetime = datetime.fromtimestamp(0)
-        self._timer = Timer(self._auto_refresh_interval.total_seconds(), self.refresh)
-        self._timer.start()
+        self._children_settled: bool = False
+        self._poller: StackPoller = StackPoller.for_region(region)
 
     def __str__(self):
         return self.id
@@ -276,16 +421,13 @@ class Stack:  # pylint: disable=too-many-instance-attributes
         uuid = uuid if uuid else uuid4()
         cfn_client = region.client("cloudformation")
         tags = [t.dump() for t in tags] if tags else []
-        template = Template(
-            template_path=template.template_path,
-            project_root=template.project_root,
-            s3_key_prefix=template.s3_key_prefix,
-            url=s3_url_maker(
+        template = template.with_url(
+            s3_url_maker(
                 region.s3_bucket.name,
                 template.s3_key,
                 region.client("s3"),
                 region.s3_bucket.auto_generated,
-            ),
+            )
         )
         stack_id = cfn_client.create_stack(
             StackName=stack_name,
@@ -309,8 +451,10 @@ class Stack:  # pylint: disable=too-many-instance-attributes
         cls, stack_properties: dict, parent_stack: "Stack"
     ) -> Optional["Stack"]:
         url = ""
-        for event in parent_stack.events():
-            if event.physical_id == stack_properties["StackId"] and event.properties:
+        for event in parent_stack.events().filter(
+            physical_id=stack_properties["StackId"]
+        ):
+            if event.properties:
                 url = event.properties["TemplateURL"]
         if url.startswith(parent_stack.template.url_prefix()):
             # Template is part of the project, discovering path
@@ -397,7 +541,6 @@ class Stack:  # pylint: disable=too-many-instance-attributes
     def set_stack_properties(self, stack_properties: Optional[dict] = None) -> None:
         # TODO: get time to complete for complete stacks and % complete
         props: dict = stack_properties if stack_properties else {}
-        self._timer.cancel()
         if not props:
             describe_stacks = self.client.describe_stacks
             props = describe_stacks(StackName=self.id)["Stacks"][0]
@@ -416,10 +559,9 @@ class Stack:  # pylint: disable=too-many-instance-attributes
             key = pascal_to_snake(key).replace("stack_", "")
             setattr(self, key, value)
         if self.status in StackStatus.IN_PROGRESS:
-            self._timer = Timer(
-                self._auto_refresh_interval.total_seconds(), self.refresh
-            )
-            self._timer.start()
+            self._poller.register(self)
+        else:
+            self._poller.unregister(self)
 
     @staticmethod
     def _merge_props(existing_props, new):
@@ -431,14 +573,36 @@ class Stack:  # pylint: disable=too-many-instance-attributes
         if not added:
             existing_props.append(new)
 
-    def events(self, refresh: bool = False, include_generic: bool = True) -> Events:
+    def events(
+        self,
+        refresh: bool = False,
+        include_generic: bool = True,
+        since: Optional[str] = None,
+    ) -> Events:
+        """returns stack events, newest first. If since is an event id (see
+        event_cursor) only events newer than that event are returned"""
         if refresh or not self._events or self._auto_refresh(self._last_event_refresh):
             self._fetch_stack_events()
         events = self._events
+        if since:
+            events = self._events_since(events, since)
         if not include_generic:
             events = Events([event for event in events if not self._is_generic(event)])
         return events
 
+    @property
+    def event_cursor(self) -> str:
+        """id of the newest event fetched so far, can be passed to events(since=)"""
+        events = self._events
+        return events[0].event_id if events else ""
+
+    @staticmethod
+    def _events_since(events: Events, event_id: str) -> Events:
+        for index, event in enumerate(events):
+            if event.event_id == event_id:
+                return Events(events[:index])
+        return events
+
     @staticmethod
     def _is_generic(event: Event) -> bool:
         generic = False
@@ -449,13 +613,21 @@ class Stack:  # pylint: disable=too-many-instance-attributes
 
     def _fetch_stack_events(self) -> None:
         self._last_event_refresh = datetime.now()
-        events = Events()
+        new_events = Events(self._new_events(self.event_cursor))
+        if new_events:
+            self._events = Events(new_events + self._events)
+
+    def _new_events(self, cursor: str) -> Iterator[Event]:
+        # events are returned newest first, so we only need to page until we reach
+        # the newest event we already have
         for page in self.client.get_paginator("describe_stack_events").paginate(
             StackName=self.id
         ):
-            for event in page["StackEvents"]:
-                events.append(Event(event))
-        self._events = events
+            for event_dict in page["StackEvents"]:
+                event = Event(event_dict)
+                if cursor and event.event_id == cursor:
+                    return
+                yield event
 
     def resources(self, refresh: bool = False) -> Resources:
         if (
@@ -486,38 +658,44 @@ class Stack:  # pylint: disable=too-many-instance-attributes
 
     def _fetch_children(self) -> None:
         self._last_child_refresh = datetime.now()
-        for page in self.client.get_paginator("describe_stacks").paginate():
-            for stack in page["Stacks"]:
-                if self._children.filter(id=stack["StackId"]):
-                    continue
-                if "ParentId" in stack.keys():
-                    if self.id == stack["ParentId"]:
-                        stack_obj = Stack._import_child(stack, self)
-                        if stack_obj:
-                            self._children.append(stack_obj)
+        # once a stack has settled no further nested stacks can be added to it
+        self._children_settled = bool(self.status) and (
+            self.status not in StackStatus.IN_PROGRESS
+        )
+        self._fetch_stack_resources()
+        known_ids = {child.id for child in self._children}
+        for resource in self._resources.filter(type="AWS::CloudFormation::Stack"):
+            child_id = resource.physical_id
+            if not child_id or child_id in known_ids:
+                continue
+            stack_properties = self.client.describe_stacks(StackName=child_id)[
+                "Stacks"
+            ][0]
+            stack_obj = Stack._import_child(stack_properties, self)
+            if stack_obj:
+                self._children.append(stack_obj)
+                known_ids.add(child_id)
+
+    def _children_stale(self) -> bool:
+        if self._last_child_refresh == datetime.fromtimestamp(0):
+            return True
+        if self._children_settled:
+            return False
+        return self._auto_refresh(self._last_child_refresh)
 
     def children(self, refresh=False) -> Stacks:
-        if (
-            refresh
-            or not self._children
-            or self._auto_refresh(self._last_child_refresh)
-        ):
+        if refresh or self._children_stale():
             self._fetch_children()
         return self._children
 
     def descendants(self, refresh=False) -> Stacks:
-        if refresh or not self._children:
-            self._fetch_children()
-
-        def recurse(stack: Stack, descendants: Stacks = None) -> Stacks:
-            descendants = descendants if descendants else Stacks()
-            if stack.children(refresh=refresh):
-                descendants += stack.children()
-                for child in stack.children():
-                    descendants = recurse(child, descendants)
+        def recurse(stack: Stack, descendants: Stacks) -> Stacks:
+            for child in stack.children(refresh=refresh):
+                descendants.append(child)
+                recurse(child, descendants)
             return descendants
 
-        return recurse(self)
+        return recurse(self, Stacks())
 
     def error_events(
         self, recurse: bool = True, include_generic: bool = False, refresh=False
@@ -527,8 +705,7 @@ class Stack:  # pylint: disable=too-many-instance-attributes
         if recurse:
             stacks += self.descendants()
         for stack in stacks:
-            for status in StackStatus.FAILED:
-                errors += stack.events(
-                    refresh=refresh, include_generic=include_generic
-                ).filter({"status": status})
+            errors += stack.events(
+                refresh=refresh, include_generic=include_generic
+            ).filter({"status": frozenset(StackStatus.FAILED)})
         return errors
@@ -1,12 +1,378 @@
+import base64
+import copy
+import hashlib
+import json
 import logging
+import os
+from datetime import date, datetime, timedelta, timezone
 from pathlib import Path
-from typing import Dict, List, Union
+from threading import Lock, RLock
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+from yaml.error import Mark
 
 import cfnlint
+from cfnlint.decode import node as cfn_node
+from cfnlint.decode.node import dict_node, list_node, str_node
+from cfnlint.version import __version__ as cfnlint_version
 from taskcat.exceptions import TaskCatException
 
 LOG = logging.getLogger(__name__)
 
+CACHE_DIR = Path(".taskcat/template_cache")
+# cfn-lint builds its node classes with factory functions, so their __name__ is not
+# the name they are exported as
+NODE_CLASS_NAMES = {
+    cls: name for name, cls in vars(cfn_node).items() if isinstance(cls, type)
+}
+
+
+class _CacheEntry(NamedTuple):
+    stat: Tuple[int, int]
+    digest: str
+    raw_template: str
+    template: Any
+    children: Dict[str, List[str]]
+
+
+def _encode_marks(node) -> Optional[List[int]]:
+    if not hasattr(node, "start_mark"):
+        return None
+    return [
+        node.start_mark.index,
+        node.start_mark.line,
+        node.start_mark.column,
+        node.end_mark.index,
+        node.end_mark.line,
+        node.end_mark.column,
+    ]
+
+
+def _decode_marks(marks: List[int], name: str) -> Tuple[Mark, Mark]:
+    start = Mark(name, marks[0], marks[1], marks[2], None, None)
+    end = Mark(name, marks[3], marks[4], marks[5], None, None)
+    return start, end
+
+
+def _node_class_name(value: Any, base: type) -> Optional[str]:
+    """the name of a cfn-lint node class (eg. dict_node, or a subclass such as
+    sub_node), so that the same class is restored from the cache"""
+    cls = type(value)
+    if cls is base:
+        return None
+    if cls in NODE_CLASS_NAMES:
+        return NODE_CLASS_NAMES[cls]
+    raise TypeError(f"cannot cache values of type {cls}")
+
+
+def _encode_datetime(value: datetime) -> List[Any]:
+    offset = value.utcoffset()
+    return [
+        value.year,
+        value.month,
+        value.day,
+        value.hour,
+        value.minute,
+        value.second,
+        value.microsecond,
+        None if offset is None else offset.total_seconds(),
+    ]
+
+
+def _decode_datetime(items: List[Any], _name: str) -> datetime:
+    *fields, offset = items
+    tzinfo = None if offset is None else timezone(timedelta(seconds=offset))
+    return datetime(*fields).replace(tzinfo=tzinfo)
+
+
+# (type, kind, encoder) in the order they are tried, so datetime comes before its
+# base class date
+_ENCODERS: List[Tuple[type, str, Callable[[Any], Any]]] = [
+    (dict, "d", lambda value: [[_encode(k), _encode(v)] for k, v in value.items()]),
+    (list, "l", lambda value: [_encode(v) for v in value]),
+    (str, "s", str),
+    (datetime, "datetime", _encode_datetime),
+    (date, "date", lambda value: [value.year, value.month, value.day]),
+    (bytes, "bytes", lambda value: base64.b64encode(value).decode("ascii")),
+    (set, "set", lambda value: [_encode(v) for v in value]),
+    (frozenset, "set", lambda value: [_encode(v) for v in value]),
+]
+
+_DECODERS: Dict[str, Callable[[Any, str], Any]] = {
+    "d": lambda items, name: {_decode(k, name): _decode(v, name) for k, v in items},
+    "l": lambda items, name: [_decode(v, name) for v in items],
+    "s": lambda items, _name: items,
+    "datetime": _decode_datetime,
+    "date": lambda items, _name: date(*items),
+    "bytes": lambda items, _name: base64.b64decode(items),
+    "set": lambda items, name: {_decode(v, name) for v in items},
+}
+
+_NODE_CLASSES = {"s": str_node, "d": dict_node, "l": list_node}
+
+
+def _encode(value: Any) -> Any:
+    """converts a decoded template into json serializable lists, keeping the class
+    and line marks of cfn-lint's node types, and yaml scalars that json does not
+    have (eg. unquoted dates)"""
+    # pylint: disable=unidiomatic-typecheck
+    if value is None or isinstance(value, (bool, int, float)) or type(value) is str:
+        return value
+    for base, kind, encoder in _ENCODERS:
+        if isinstance(value, base):
+            return [
+                kind,
+                _encode_marks(value),
+                encoder(value),
+                _node_class_name(value, base),
+            ]
+    raise TypeError(f"cannot cache values of type {type(value)}")
+
+
+def _decode(value: Any, name: str) -> Any:
+    if not isinstance(value, list):
+        return value
+    kind, marks, items, class_name = value
+    decoded = _DECODERS[kind](items, name)
+    if class_name:
+        node_class = getattr(cfn_node, class_name)
+    elif marks is not None:
+        node_class = _NODE_CLASSES[kind]
+    else:
+        return decoded
+    return node_class(decoded, *_decode_marks(marks, name))
+
+
+class TemplateCache:
+    """process wide cache of decoded templates. A cached template is re-used while
+    the file's mtime and size are unchanged, or if its content hash still matches.
+    Decoded templates are shared between Template instances, so must not be modified
+    in place.
+
+    If persist() has been called, decoded templates and the paths of their child
+    templates are also written to disk, keyed by content hash and cfn-lint version,
+    so that unchanged templates are not re-parsed on the next run. The least
+    recently used entries are evicted once the directory grows beyond max_size
+    bytes."""
+
+    MAX_SIZE = 64 * 1024 * 1024
+    # changes whenever the encoding of cached templates does
+    FORMAT = 2
+
+    def __init__(self):
+        self._lock = Lock()
+        self._entries: Dict[Path, _CacheEntry] = {}
+        self.cache_dir: Optional[Path] = None
+        self.max_size = self.MAX_SIZE
+
+    def persist(self, cache_dir: Union[str, Path], max_size: int = MAX_SIZE) -> None:
+        self.cache_dir = Path(cache_dir).expanduser().resolve()
+        self.max_size = max_size
+
+    def load(self, template_path: Path, verify: bool = False) -> Tuple[str, Any]:
+        """returns the raw and decoded template, if verify is set the content hash
+        is always checked, rather than trusting an unchanged mtime and size"""
+        stat = template_path.stat()
+        stat_key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            entry = self._entries.get(template_path)
+        if entry and entry.stat == stat_key and not verify:
+            return entry.raw_template, entry.template
+        with open(str(template_path), "r") as file_handle:
+            raw_template = file_handle.read()
+        digest = hashlib.sha256(raw_template.encode("utf-8")).hexdigest()
+        if entry and entry.digest == digest:
+            template, children = entry.template, entry.children
+        else:
+            template, children = self._read(digest, str(template_path))
+            if template is None:
+                template = cfnlint.decode.cfn_yaml.loads(
+                    raw_template, str(template_path)
+                )
+                self._write(digest, template, children)
+        with self._lock:
+            self._entries[template_path] = _CacheEntry(
+                stat_key, digest, raw_template, template, children
+            )
+        return raw_template, template
+
+    def children(self, template_path: Path, project_root: Path) -> Optional[List[str]]:
+        """returns the cached child template paths (relative to project_root), or
+        None if they have not been discovered yet"""
+        with self._lock:
+            entry = self._entries.get(template_path)
+        if not entry:
+            return None
+        return entry.children.get(str(project_root))
+
+    def set_children(
+        self, template_path: Path, project_root: Path, children: List[str]
+    ) -> None:
+        with self._lock:
+            entry = self._entries.get(template_path)
+        if not entry or entry.children.get(str(project_root)) == children:
+            return
+        entry.children[str(project_root)] = children
+        self._write(entry.digest, entry.template, entry.children)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def _entry_path(self, cache_dir: Path, digest: str) -> Path:
+        return cache_dir / f"{cfnlint_version}-{self.FORMAT}" / f"{digest}.json"
+
+    def _read(self, digest: str, name: str) -> Tuple[Any, Dict[str, List[str]]]:
+        if not self.cache_dir:
+            return None, {}
+        path = self._entry_path(self.cache_dir, digest)
+        try:
+            with open(str(path), "r") as file_handle:
+                cached = json.load(file_handle)
+            template = _decode(cached["template"], name)
+            # mark as recently used
+            os.utime(str(path))
+        except FileNotFoundError:
+            return None, {}
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.debug(f"ignoring unreadable template cache {path} {type(e)} {e}")
+            return None, {}
+        return template, cached["children"]
+
+    def _write(self, digest: str, template: Any, children: Dict[str, List[str]]):
+        if not self.cache_dir:
+            return
+        path = self._entry_path(self.cache_dir, digest)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            cached = json.dumps({"template": _encode(template), "children": children})
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(tmp_path), "w") as file_handle:
+                file_handle.write(cached)
+            os.replace(str(tmp_path), str(path))
+            self._evict(self.cache_dir)
+        except Exception as e:  # pylint: disable=broad-except
+            LOG.warning(f"failed to write template cache {path} {type(e)} {e}")
+            LOG.debug("Traceback:", exc_info=True)
+
+    def _evict(self, cache_dir: Path) -> None:
+        entries = []
+        for path in cache_dir.glob("*/*.json"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, path))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, path in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            size -= entry_size
+
+
+TEMPLATE_CACHE = TemplateCache()
+
+
+class TemplateGraph:
+    """templates (keyed by path) and the nested stacks they reference. Templates
+    that share a graph share child instances, descendant and topological queries
+    are cached until the graph is modified"""
+
+    def __init__(self):
+        self._lock = RLock()
+        self._nodes: Dict[Path, "Template"] = {}
+        self._edges: Dict[Path, List[Path]] = {}
+        self._queries: Dict[Tuple[str, Path], List["Template"]] = {}
+
+    def __repr__(self):
+        return f"<TemplateGraph {len(self._nodes)} templates at {hex(id(self))}>"
+
+    def __contains__(self, template_path: Union[str, Path]) -> bool:
+        return self.get(template_path) is not None
+
+    def __len__(self) -> int:
+        return len(self._nodes)
+
+    def get(self, template_path: Union[str, Path]) -> Optional["Template"]:
+        return self._nodes.get(Path(template_path).expanduser().resolve())
+
+    def add(self, template: "Template") -> None:
+        with self._lock:
+            self._nodes[template.template_path] = template
+            self._edges.setdefault(template.template_path, [])
+            self._queries.clear()
+
+    def discard(self, template_path: Union[str, Path]) -> None:
+        template_path = Path(template_path).expanduser().resolve()
+        with self._lock:
+            self._nodes.pop(template_path, None)
+            self._edges.pop(template_path, None)
+            for children in self._edges.values():
+                if template_path in children:
+                    children.remove(template_path)
+            self._queries.clear()
+
+    def set_children(self, template: "Template", children: List["Template"]) -> None:
+        with self._lock:
+            self._edges[template.template_path] = [c.template_path for c in children]
+            self._queries.clear()
+
+    def children(self, template: "Template") -> List["Template"]:
+        with self._lock:
+            edges = self._edges.get(template.template_path, [])
+            return [self._nodes[path] for path in edges if path in self._nodes]
+
+    def parents(self, template: "Template") -> List["Template"]:
+        with self._lock:
+            return [
+                self._nodes[path]
+                for path, children in self._edges.items()
+                if template.template_path in children
+            ]
+
+    def descendants(self, template: "Template") -> List["Template"]:
+        """all templates nested (at any depth) below template, in depth first
+        order"""
+        return self._query("descendants", template, preorder=True)
+
+    def topological(self, template: "Template") -> List["Template"]:
+        """template and its descendants, ordered so that every template comes after
+        all of the templates it nests"""
+        return self._query("topological", template, preorder=False)
+
+    def _query(
+        self, name: str, template: "Template", preorder: bool
+    ) -> List["Template"]:
+        key = (name, template.template_path)
+        with self._lock:
+            if key not in self._queries:
+                self._queries[key] = self._walk(template.template_path, preorder)
+            return list(self._queries[key])
+
+    def _walk(self, root: Path, preorder: bool) -> List["Template"]:
+        visited = {root}
+        ordered: List[Path] = []
+
+        def recurse(path):
+            for child in self._edges.get(path, []):
+                if child in visited or child not in self._nodes:
+                    continue
+                visited.add(child)
+                if preorder:
+                    ordered.append(child)
+                recurse(child)
+                if not preorder:
+                    ordered.append(child)
+
+        recurse(root)
+        if not preorder and root in self._nodes:
+            ordered.append(root)
+        return [self._nodes[path] for path in ordered]
+
 
 class Template:
     def __init__(
@@ -15,18 +381,18 @@ class Template:
         project_root: Union[str, Path] = "",
         url: str = "",
         s3_key_prefix: str = "",
+        graph: Optional[TemplateGraph] = None,
     ):
         self.template_path: Path = Path(template_path).expanduser().resolve()
-        self.template = cfnlint.decode.cfn_yaml.load(str(self.template_path))
-        with open(template_path, "r") as file_handle:
-            self.raw_template = file_handle.read()
+        self.raw_template, self.template = TEMPLATE_CACHE.load(self.template_path)
         project_root = (
             project_root if project_root else self.template_path.parent.parent
         )
         self.project_root = Path(project_root).expanduser().resolve()
         self.url = url
         self._s3_key_prefix = s3_key_prefix
-        self.children: List[Template] = []
+        self.graph = graph if graph is not None else TemplateGraph()
+        self.graph.add(self)
         self._find_children()
 
     def __str__(self):
@@ -44,6 +410,10 @@ class Template:
     def s3_key_prefix(self):
         return self._s3_key_prefix
 
+    @property
+    def children(self) -> List["Template"]:
+        return self.graph.children(self)
+
     @property
     def linesplit(self):
         return self.raw_template.split("\n")
@@ -53,9 +423,32 @@ class Template:
         the template has been modified"""
         with open(str(self.template_path), "w") as file_handle:
             file_handle.write(self.raw_template)
-        self.template = cfnlint.decode.cfn_yaml.load(self.template_path)
+        self.raw_template, self.template = TEMPLATE_CACHE.load(
+            self.template_path, verify=True
+        )
         self._find_children()
 
+    def with_url(self, url: str, graph: Optional[TemplateGraph] = None) -> "Template":
+        """returns a view of this template (and its children) with a different url,
+        without re-parsing anything"""
+        graph = graph if graph is not None else TemplateGraph()
+        view = graph.get(self.template_path)
+        if view:
+            return view
+        view = copy.copy(self)
+        view.url = url
+        view.graph = graph
+        graph.add(view)
+        # pylint: disable=protected-access
+        graph.set_children(
+            view,
+            [
+                child.with_url(view._get_relative_url(child.template_path), graph)
+                for child in self.children
+            ],
+        )
+        return view
+
     def _template_url_to_path(self, template_url):
         # TODO: this code assumes a specific url schema, should rather attempt to
         #  resolve values from params/defaults
@@ -69,17 +462,9 @@ class Template:
                 template_path = template_url["Fn::Join"][1][-1]
         elif isinstance(template_url, str):
             template_path = "/".join(template_url.split("/")[-2:])
-        template_path = self.project_root / template_path
-        if template_path.is_file():
-            return template_path
-        LOG.warning(
-            "Failed to discover path for %s, path %s does not exist",
-            template_url,
-            template_path,
-        )
-        return ""
+        return self.project_root / template_path
 
-    def _get_relative_url(self, path: str) -> str:
+    def _get_relative_url(self, path: Union[str, Path]) -> str:
         if not self.url:
             return ""
         suffix = str(self.template_path).replace(str(self.project_root), "")
@@ -97,7 +482,7 @@ class Template:
         url_prefix = "/".join(self.url.split("/")[0:-suffix_length])
         return url_prefix
 
-    def _find_children(self) -> None:  # noqa: C901
+    def _child_paths(self) -> List[str]:
         children = set()
         if "Resources" not in self.template:
             raise TaskCatException(
@@ -107,16 +492,33 @@ class Template:
         for resource in self.template["Resources"].keys():
             resource = self.template["Resources"][resource]
             if resource["Type"] == "AWS::CloudFormation::Stack":
-                child_name = self._template_url_to_path(
+                child_path = self._template_url_to_path(
                     resource["Properties"]["TemplateURL"]
                 )
-                if child_name:
-                    children.add(child_name)
+                children.add(os.path.relpath(str(child_path), str(self.project_root)))
+        return sorted(children)
+
+    def _find_children(self) -> None:  # noqa: C901
+        child_paths = TEMPLATE_CACHE.children(self.template_path, self.project_root)
+        if child_paths is None:
+            child_paths = self._child_paths()
+            TEMPLATE_CACHE.set_children(
+                self.template_path, self.project_root, child_paths
+            )
+        children = []
+        for child_path in child_paths:
+            child = self.project_root / child_path
+            if child.is_file():
+                children.append(child)
+            else:
+                LOG.warning(
+                    "Failed to discover path for %s, path %s does not exist",
+                    child_path,
+                    child,
+                )
+        child_templates = []
         for child in children:
-            child_template_instance = None
-            for descendent in self.descendents:
-                if str(descendent.template_path) == str(child):
-                    child_template_instance = descendent
+            child_template_instance = self.graph.get(child)
             if not child_template_instance:
                 try:
                     child_template_instance = Template(
@@ -124,25 +526,19 @@ class Template:
                         self.project_root,
                         self._get_relative_url(child),
                         self._s3_key_prefix,
+                        self.graph,
                     )
                 except Exception:  # pylint: disable=broad-except
                     LOG.debug("Traceback:", exc_info=True)
                     LOG.error(f"Failed to add child template {child}")
+                    self.graph.discard(child)
             if isinstance(child_template_instance, Template):
-                self.children.append(child_template_instance)
+                child_templates.append(child_template_instance)
+        self.graph.set_children(self, child_templates)
 
     @property
     def descendents(self) -> List["Template"]:
-        desc_map = {}
-
-        def recurse(template):
-            for child in template.children:
-                desc_map[str(child.template_path)] = child
-                recurse(child)
-
-        recurse(self)
-
-        return list(desc_map.values())
+        return self.graph.descendants(self)
 
     def parameters(
         self,
@@ -2,10 +2,13 @@ import logging
 import uuid
 from functools import partial
 from multiprocessing.dummy import Pool as ThreadPool
-from typing import Dict, List
+from threading import Event
+from time import monotonic, sleep
+from typing import Dict, List, Optional
 
 import boto3
 
+from taskcat._cfn.poller import StackPoller
 from taskcat._cfn.stack import Stack, Stacks, StackStatus, Tag
 from taskcat._client_factory import Boto3Cache
 from taskcat._common_utils import merge_dicts
@@ -28,6 +31,8 @@ def fan_out(func, partial_kwargs, payload, threads):
 class Stacker:
 
     NULL_UUID = uuid.UUID(int=0)
+    # how often a waiter checks that the pollers it waits on are still running
+    WAIT_SLICE = 5.0
 
     def __init__(
         self,
@@ -43,6 +48,54 @@ class Stacker:
         self.tags = tags if tags else []
         self.uid = uuid.uuid4() if uid == Stacker.NULL_UUID else uid
         self.stacks: Stacks = Stacks()
+        self._refreshed = Event()
+
+    def _pollers(self) -> List[StackPoller]:
+        pollers: Dict[int, StackPoller] = {}
+        for stack in self.stacks:
+            poller = StackPoller.for_region(stack.region)
+            pollers[id(poller)] = poller
+        return list(pollers.values())
+
+    def _on_refresh(self, _stacks: List[Stack]) -> None:
+        self._refreshed.set()
+
+    def wait_for_refresh(self, timeout: Optional[float] = None) -> bool:
+        """blocks until the pollers for this stacker's regions have refreshed stack
+        properties, returns False if nothing is being polled or timeout expired"""
+        pollers = [p for p in self._pollers() if p.active]
+        if not pollers:
+            return False
+        self._refreshed.clear()
+        for poller in pollers:
+            poller.subscribe(self._on_refresh)
+        deadline = None if timeout is None else monotonic() + timeout
+        try:
+            while any(poller.active for poller in pollers):
+                wait = self.WAIT_SLICE
+                if deadline is not None:
+                    wait = min(wait, deadline - monotonic())
+                    if wait <= 0:
+                        return False
+                if self._refreshed.wait(wait):
+                    return True
+            return self._refreshed.is_set()
+        finally:
+            for poller in pollers:
+                poller.unsubscribe(self._on_refresh)
+
+    def wait_for_progress(self, timeout: Optional[float] = None, interval: float = 5):
+        """waits for the next refresh of stack properties. If nothing is being
+        polled, the in progress stacks are refreshed directly after sleeping for
+        interval, so that callers looping on status() do not spin"""
+        if self.wait_for_refresh(timeout):
+            return
+        if any(poller.active for poller in self._pollers()):
+            return
+        sleep(interval)
+        for stack in self.stacks:
+            if stack.status in StackStatus.IN_PROGRESS:
+                stack.refresh()
 
     @staticmethod
     def _tests_to_list(tests: Dict[str, TestObj]):
@@ -0,0 +1,397 @@
+import hashlib
+import json
+import logging
+import os
+import stat
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from dulwich.errors import NotGitRepository
+from dulwich.objects import S_ISGITLINK, Blob, Tree
+from dulwich.objectspec import parse_commit
+from dulwich.repo import Repo
+from taskcat._cfn.template import Template
+from taskcat._config import Config
+from taskcat._lambda_build import LambdaBuild
+from taskcat._s3_sync import S3Sync
+from taskcat._stage_closure import reference_key
+from taskcat.exceptions import TaskCatException
+
+LOG = logging.getLogger(__name__)
+
+
+class ChangeImpact:
+    """maps each test to the closure of project files it depends on, and selects the
+    tests with changes in their closure since a git ref, or since a manifest was
+    written.
+
+    A test's closure is its template and nested templates, the lambda sources and
+    staged files referenced by those templates, and any staged file that no template
+    references (as it may be used by any test). Files deleted since a git ref affect
+    the tests whose closure they would be in."""
+
+    MANIFEST_VERSION = 1
+
+    def __init__(
+        self,
+        config: Config,
+        templates: Dict[str, Template],
+        project_root: Path,
+        shared_files: Iterable[Path] = (),
+    ):
+        self.project_root = Path(project_root).expanduser().resolve()
+        self._nested = {
+            test_name: [template] + template.descendents
+            for test_name, template in templates.items()
+        }
+        self._rel_zip = Path(config.config.project.lambda_zip_path).as_posix()
+        self._lambda_roots: Set[Path] = set()
+        self._packages: Set[Path] = set()
+        self._matcher = S3Sync._exclude_matcher(  # pylint: disable=protected-access
+            self.project_root
+        )
+        self.closures: Dict[str, Set[Path]] = self._closures(config, shared_files)
+        self._hashes: Dict[Path, str] = {}
+
+    @staticmethod
+    def manifest_path(project_root: Path, since: str) -> Optional[Path]:
+        """returns the path of the manifest if since refers to one rather than a git
+        ref"""
+        path = Path(project_root).expanduser().resolve() / since
+        if path.suffix == ".json" or path.is_file():
+            return path
+        return None
+
+    def affected(self, since: str) -> List[str]:
+        """returns the names of tests with changes in their closure since a git ref,
+        or since the manifest at this path was written"""
+        manifest_path = self.manifest_path(self.project_root, since)
+        if manifest_path:
+            return self._affected_since_manifest(manifest_path)
+        return self._affected_since_ref(since)
+
+    def write_manifest(self, manifest_path: Path, tests: Iterable[str]) -> None:
+        """records the current state of the given tests' closures, keeping any other
+        tests already in the manifest"""
+        manifest = self._read_manifest(manifest_path) or {}
+        for test_name in tests:
+            manifest[test_name] = self._closure_hashes(test_name)
+        manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(manifest_path), "w") as file_handle:
+            json.dump(
+                {"version": self.MANIFEST_VERSION, "tests": manifest},
+                file_handle,
+                indent=2,
+                sort_keys=True,
+            )
+
+    def _affected_since_manifest(self, manifest_path: Path) -> List[str]:
+        manifest = self._read_manifest(manifest_path)
+        if manifest is None:
+            LOG.info(f"no usable manifest at {manifest_path}, running all tests")
+            return list(self.closures)
+        return [
+            test_name
+            for test_name in self.closures
+            if manifest.get(test_name) != self._closure_hashes(test_name)
+        ]
+
+    def _affected_since_ref(self, ref: str) -> List[str]:
+        try:
+            repo = Repo.discover(str(self.project_root))
+        except NotGitRepository:
+            raise TaskCatException(
+                f"cannot compare with {ref}, {self.project_root} is not in a git "
+                f"repository"
+            )
+        submodules: Dict[Tuple[Path, bytes], Optional[Tuple[Repo, Tree]]] = {}
+        try:
+            try:
+                tree = repo[parse_commit(repo, ref.encode()).tree]
+            except KeyError:
+                raise TaskCatException(f"git ref {ref} not found")
+            repo_root = Path(repo.path).resolve()
+            changed = {
+                path
+                for path in set().union(*self.closures.values())
+                if self._changed_in_tree(repo, tree, repo_root, path, submodules)
+            }
+            affected = {
+                test_name
+                for path in self._deleted(repo, tree, repo_root, submodules)
+                for test_name in self._tests_for_deleted(path)
+            }
+        finally:
+            for submodule in submodules.values():
+                if submodule:
+                    submodule[0].close()
+            repo.close()
+        return [
+            test_name
+            for test_name, closure in self.closures.items()
+            if closure & changed or test_name in affected
+        ]
+
+    def _deleted(
+        self,
+        repo: Repo,
+        tree: Tree,
+        repo_root: Path,
+        submodules: Dict[Tuple[Path, bytes], Optional[Tuple[Repo, Tree]]],
+    ) -> Set[Path]:
+        """returns the files in the tree, under the lambda source directories and the
+        directories of the closures, that are missing from the working tree"""
+        directories = self._lambda_roots.union(
+            path.parent for closure in self.closures.values() for path in closure
+        )
+        deleted: Set[Path] = set()
+        for directory in directories:
+            # directories within another are walked with it
+            if directories.intersection(directory.parents):
+                continue
+            subtree = self._subtree(repo, tree, repo_root, directory, submodules)
+            if subtree:
+                deleted.update(self._deleted_in_tree(*subtree, directory, submodules))
+        return deleted
+
+    @classmethod
+    def _subtree(
+        cls,
+        repo: Repo,
+        tree: Tree,
+        repo_root: Path,
+        directory: Path,
+        submodules: Dict[Tuple[Path, bytes], Optional[Tuple[Repo, Tree]]],
+    ) -> Optional[Tuple[Repo, Tree]]:
+        """returns the repo and tree of a directory in a git tree, following
+        submodules, or None if it is not in the tree"""
+        try:
+            parts = directory.relative_to(repo_root).parts
+        except ValueError:
+            return None
+        obj = tree
+        for index, part in enumerate(parts):
+            try:
+                mode, sha = obj[part.encode()]
+            except KeyError:
+                return None
+            if S_ISGITLINK(mode):
+                submodule_root = repo_root.joinpath(*parts[: index + 1])
+                submodule = cls._submodule(submodule_root, sha, submodules)
+                if not submodule:
+                    return None
+                return cls._subtree(*submodule, submodule_root, directory, submodules)
+            obj = repo.object_store[sha]
+            if not isinstance(obj, Tree):
+                return None
+        return repo, obj
+
+    @classmethod
+    def _deleted_in_tree(
+        cls,
+        repo: Repo,
+        tree: Tree,
+        directory: Path,
+        submodules: Dict[Tuple[Path, bytes], Optional[Tuple[Repo, Tree]]],
+    ) -> Iterable[Path]:
+        for name, mode, sha in tree.iteritems():
+            path = directory / name.decode()
+            if S_ISGITLINK(mode):
+                submodule = cls._submodule(path, sha, submodules)
+                if submodule:
+                    yield from cls._deleted_in_tree(*submodule, path, submodules)
+                continue
+            obj = repo.object_store[sha] if stat.S_ISDIR(mode) else None
+            if isinstance(obj, Tree):
+                yield from cls._deleted_in_tree(repo, obj, path, submodules)
+            elif not os.path.lexists(str(path)):
+                yield path
+
+    def _tests_for_deleted(self, path: Path) -> List[str]:
+        """returns the tests whose closure a deleted file would be in"""
+        key = self._deleted_key(path)
+        if key is None:
+            return []
+        return self._referenced_by(key) or list(self.closures)
+
+    def _deleted_key(self, path: Path) -> Optional[str]:
+        for lambda_root in self._lambda_roots:
+            if lambda_root in path.parents:
+                return self._lambda_key(path.relative_to(lambda_root).parts[0])
+        if self._packages.intersection(path.parents) or not self._staged(path):
+            return None
+        return self._reference_key(path)
+
+    def _staged(self, path: Path) -> bool:
+        """whether a file would be staged, if it existed"""
+        try:
+            parts = path.relative_to(self.project_root).parts
+        except ValueError:
+            return False
+        for index in range(1, len(parts)):
+            if self._matcher.match("/".join(parts[:index]), is_dir=True):
+                return False
+        return not self._matcher.match("/".join(parts))
+
+    @classmethod
+    def _changed_in_tree(
+        cls,
+        repo: Repo,
+        tree: Tree,
+        repo_root: Path,
+        path: Path,
+        submodules: Dict[Tuple[Path, bytes], Optional[Tuple[Repo, Tree]]],
+    ) -> bool:
+        """compares a file with its blob in a git tree. Files in a submodule are
+        compared with the submodule's commit recorded in the tree"""
+        try:
+            parts = path.relative_to(repo_root).parts
+        except ValueError:
+            return True
+        obj = tree
+        for index, part in enumerate(parts):
+            try:
+                mode, sha = obj[part.encode()]
+            except KeyError:
+                return True
+            if S_ISGITLINK(mode):
+                submodule_root = repo_root.joinpath(*parts[: index + 1])
+                return cls._changed_in_submodule(submodule_root, sha, path, submodules)
+            if index < len(parts) - 1:
+                obj = repo.object_store[sha]
+                if not isinstance(obj, Tree):
+                    return True
+        with open(str(path), "rb") as file_handle:
+            return Blob.from_string(file_handle.read()).id != sha
+
+    @classmethod
+    def _changed_in_submodule(
+        cls,
+        submodule_root: Path,
+        commit_sha: bytes,
+        path: Path,
+        submodules: Dict[Tuple[Path, bytes], Optional[Tuple[Repo, Tree]]],
+    ) -> bool:
+        submodule = cls._submodule(submodule_root, commit_sha, submodules)
+        if not submodule:
+            return True
+        return cls._changed_in_tree(*submodule, submodule_root, path, submodules)
+
+    @classmethod
+    def _submodule(
+        cls,
+        submodule_root: Path,
+        commit_sha: bytes,
+        submodules: Dict[Tuple[Path, bytes], Optional[Tuple[Repo, Tree]]],
+    ) -> Optional[Tuple[Repo, Tree]]:
+        key = (submodule_root, commit_sha)
+        if key not in submodules:
+            submodules[key] = cls._open_submodule(submodule_root, commit_sha)
+        return submodules[key]
+
+    @staticmethod
+    def _open_submodule(
+        submodule_root: Path, commit_sha: bytes
+    ) -> Optional[Tuple[Repo, Tree]]:
+        """returns the submodule's repo and its tree at the recorded commit, or None
+        if it is not checked out or does not have the commit"""
+        try:
+            repo = Repo(str(submodule_root))
+        except NotGitRepository:
+            return None
+        try:
+            return repo, repo[repo[commit_sha].tree]
+        except KeyError:
+            repo.close()
+            return None
+
+    def _read_manifest(self, manifest_path: Path) -> Optional[Dict[str, dict]]:
+        if not manifest_path.is_file():
+            return None
+        try:
+            with open(str(manifest_path), "r") as file_handle:
+                manifest = json.load(file_handle)
+        except ValueError:
+            LOG.warning(f"ignoring invalid manifest {manifest_path}")
+            return None
+        if manifest.get("version") != self.MANIFEST_VERSION:
+            return None
+        return manifest["tests"]
+
+    def _closure_hashes(self, test_name: str) -> Dict[str, str]:
+        hashes = {}
+        for path in self.closures[test_name]:
+            if path not in self._hashes:
+                with open(str(path), "rb") as file_handle:
+                    self._hashes[path] = hashlib.sha256(file_handle.read()).hexdigest()
+            relpath = Path(os.path.relpath(str(path), str(self.project_root)))
+            hashes[relpath.as_posix()] = self._hashes[path]
+        return hashes
+
+    def _reference_key(self, path: Path) -> str:
+        return reference_key(path.relative_to(self.project_root).as_posix())
+
+    def _lambda_key(self, name: str) -> str:
+        return f"{self._rel_zip}/{name}/"
+
+    def _referenced_by(self, key: str) -> List[str]:
+        return [
+            test_name
+            for test_name, test_templates in self._nested.items()
+            if any(key in t.raw_template for t in test_templates)
+        ]
+
+    def _lambda_references(self, config: Config) -> Dict[str, Set[Path]]:
+        """lambda packages are rebuilt from source, so changes are tracked on the
+        source files, which templates refer to by package path"""
+        references: Dict[str, Set[Path]] = {}
+        for source_path, output_path in LambdaBuild.source_paths(
+            config, self.project_root
+        ):
+            if not source_path.is_dir():
+                continue
+            self._lambda_roots.add(source_path)
+            for lambda_path in source_path.iterdir():
+                if not lambda_path.is_dir():
+                    continue
+                self._packages.add(output_path / lambda_path.name)
+                key = self._lambda_key(lambda_path.name)
+                for root, _, files in os.walk(str(lambda_path)):
+                    references.setdefault(key, set()).update(
+                        Path(root) / file for file in files
+                    )
+        return references
+
+    def _staged_references(self, references: Dict[str, Set[Path]]) -> None:
+        """adds the staged files, other than templates and lambda packages, to
+        references by the key templates refer to them with"""
+        template_paths = {t.template_path for ts in self._nested.values() for t in ts}
+        # pylint: disable=protected-access
+        local_files = S3Sync._get_local_file_list(
+            self.project_root, include_checksums=False
+        )
+        for full_path, _ in local_files.values():
+            path = Path(full_path).resolve()
+            if path in template_paths or self._packages.intersection(path.parents):
+                continue
+            references.setdefault(self._reference_key(path), set()).add(path)
+
+    def _closures(
+        self, config: Config, shared_files: Iterable[Path]
+    ) -> Dict[str, Set[Path]]:
+        references = self._lambda_references(config)
+        self._staged_references(references)
+        closures = {
+            test_name: {t.template_path for t in test_templates}
+            for test_name, test_templates in self._nested.items()
+        }
+        shared = {Path(path).expanduser().resolve() for path in shared_files}
+        for key, paths in references.items():
+            referenced_by = self._referenced_by(key)
+            if not referenced_by:
+                shared.update(paths)
+            for test_name in referenced_by:
+                closures[test_name].update(paths)
+        for closure in closures.values():
+            closure.update(path for path in shared if path.is_file())
+        return closures
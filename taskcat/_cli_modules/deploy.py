@@ -2,16 +2,16 @@
 import logging
 from io import BytesIO
 from pathlib import Path
-from time import sleep
 
 from dulwich import porcelain
 from dulwich.config import ConfigFile, parse_submodules
 from taskcat._cfn.stack import Tag
+from taskcat._cfn.template import CACHE_DIR, TEMPLATE_CACHE
 from taskcat._cfn.threaded import Stacker
 from taskcat._client_factory import Boto3Cache
 from taskcat._config import Config
 from taskcat._name_generator import generate_name
-from taskcat._s3_stage import stage_in_s3
+from taskcat._s3_stage import load_sync_plan, save_sync_plan, stage_in_s3
 from taskcat.exceptions import TaskCatException
 
 LOG = logging.getLogger(__name__)
@@ -31,6 +31,8 @@ class Deploy:
         parameters="",
         name="",
         wait=False,
+        sync_plan="",
+        use_sync_plan="",
     ):
         """
         :param package: name of package to install can be a path to a local package,
@@ -44,6 +46,10 @@ class Deploy:
         :param name: stack name to use, if not specified one will be automatically
         generated
         :param wait: if enabled, taskcat will wait for stack to complete before exiting
+        :param sync_plan: write the files that staging would upload and delete to this
+        path, and exit without changing the bucket or installing the stack
+        :param use_sync_plan: stage using a plan written by sync_plan, without
+        hashing or listing the package again
         """
         LOG.warning("deploy is in alpha feature, use with caution")
         boto3_cache = Boto3Cache()
@@ -72,27 +78,14 @@ class Deploy:
             LOG.info(f"fetching git repo {url}")
             self._git_clone(url, path)
             self._recurse_submodules(path, url)
-        config = Config.create(
-            args={"project": {"regions": [region]}},
-            project_config_path=(path / ".taskcat.yml"),
-            project_root=path,
-        )
-        # only use one region
-        for test_name in config.config.tests:
-            config.config.tests[test_name].regions = config.config.project.regions
-        # if there's no test called default, take the 1st in the list
-        if "default" not in config.config.tests:
-            config.config.tests["default"] = config.config.tests[
-                list(config.config.tests.keys())[0]
-            ]
-        # until install offers a way to run different "plans" we only need one test
-        for test_name in list(config.config.tests.keys()):
-            if test_name != "default":
-                del config.config.tests[test_name]
+        TEMPLATE_CACHE.persist(path / CACHE_DIR)
+        config = self._load_config(path, region)
         buckets = config.get_buckets(boto3_cache)
-        stage_in_s3(buckets, config.config.project.name, path)
-        regions = config.get_regions(boto3_cache)
         templates = config.get_templates(project_root=path)
+        _stage(config, buckets, path, templates, sync_plan, use_sync_plan)
+        if sync_plan:
+            return
+        regions = config.get_regions(boto3_cache)
         parameters = config.get_rendered_parameters(buckets, regions, templates)
         tests = config.get_tests(path, templates, regions, buckets, parameters)
         tags = [Tag({"Key": "taskcat-installer", "Value": name})]
@@ -109,13 +102,34 @@ class Deploy:
                 f"{stacks.stacks[0].region_name}"
             )
             while stacks.status()["IN_PROGRESS"]:
-                sleep(5)
+                stacks.wait_for_progress()
         if stacks.status()["FAILED"]:
             LOG.error("Install failed:")
             for error in stacks.stacks[0].error_events():
                 LOG.error(f"{error.logical_id}: {error.status_reason}")
             raise TaskCatException("Stack creation failed")
 
+    @staticmethod
+    def _load_config(path, region):
+        config = Config.create(
+            args={"project": {"regions": [region]}},
+            project_config_path=(path / ".taskcat.yml"),
+            project_root=path,
+        )
+        # only use one region
+        for test_name in config.config.tests:
+            config.config.tests[test_name].regions = config.config.project.regions
+        # if there's no test called default, take the 1st in the list
+        if "default" not in config.config.tests:
+            config.config.tests["default"] = config.config.tests[
+                list(config.config.tests.keys())[0]
+            ]
+        # until install offers a way to run different "plans" we only need one test
+        for test_name in list(config.config.tests.keys()):
+            if test_name != "default":
+                del config.config.tests[test_name]
+        return config
+
     @staticmethod
     def _git_clone(url, path):
         outp = BytesIO()
@@ -169,3 +183,26 @@ class Deploy:
                 )
                 LOG.debug(outp.getvalue().decode("utf-8"))
             self._recurse_submodules((path / sub_path), url)
+
+
+def _stage(config, buckets, path, templates, sync_plan, use_sync_plan):
+    """stages the package, or only writes a sync plan if sync_plan is set"""
+    # pylint: disable=too-many-arguments
+    plan = stage_in_s3(
+        buckets,
+        config.config.project.name,
+        path,
+        server_side_copy=bool(config.config.project.s3_server_side_copy),
+        transfer_config=config.get_transfer_config(),
+        dry_run=bool(sync_plan),
+        plan=load_sync_plan(Path(use_sync_plan).expanduser().resolve())
+        if use_sync_plan
+        else None,
+        templates=templates if config.config.project.s3_referenced_files_only else None,
+    )
+    if not sync_plan:
+        return
+    save_sync_plan(plan, Path(sync_plan).expanduser().resolve())
+    # an auto-generated bucket was only created to be planned for
+    for bucket in buckets["default"].values():
+        bucket.delete()
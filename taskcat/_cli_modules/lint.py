@@ -1,6 +1,7 @@
 import logging
 from pathlib import Path
 
+from taskcat._cfn.template import CACHE_DIR, TEMPLATE_CACHE
 from taskcat._cfn_lint import Lint as TaskCatLint
 from taskcat._config import Config
 from taskcat.exceptions import TaskCatException
@@ -25,6 +26,7 @@ class Lint:
 
         project_root_path: Path = Path(project_root).expanduser().resolve()
         input_file_path: Path = project_root_path / input_file
+        TEMPLATE_CACHE.persist(project_root_path / CACHE_DIR)
         config = Config.create(
             project_root=project_root_path, project_config_path=input_file_path
         )
@@ -17,6 +17,7 @@ class Package:
         source_folder: str = "lambda_functions/source",
         zip_folder: str = "lambda_functions/packages",
         config_file: str = ".taskcat.yml",
+        force: bool = False,
     ):
         """
         :param project_root: base path for project
@@ -24,6 +25,7 @@ class Package:
         project_root
         :param zip_folder: folder to output zip files, relative to the project root
         :param config_file: path to taskcat project config file
+        :param force: rebuild all packages, even if their sources have not changed
         """
         project_root_path: Path = Path(project_root).expanduser().resolve()
         project_config: Path = project_root_path / config_file
@@ -37,4 +39,4 @@ class Package:
                 }
             },
         )
-        LambdaBuild(config, project_root_path)
+        LambdaBuild(config, project_root_path, force=force)
@@ -1,19 +1,27 @@
 # pylint: disable=duplicate-code
 # noqa: B950,F841
 import logging
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
 from typing import List as ListType
 
 import boto3
 
 from taskcat._cfn._log_stack_events import _CfnLogTools
+from taskcat._cfn.template import CACHE_DIR, TEMPLATE_CACHE
 from taskcat._cfn.threaded import Stacker
 from taskcat._cfn_lint import Lint as TaskCatLint
+from taskcat._change_impact import ChangeImpact
 from taskcat._client_factory import Boto3Cache
 from taskcat._config import Config
 from taskcat._generate_reports import ReportBuilder
 from taskcat._lambda_build import LambdaBuild
-from taskcat._s3_stage import stage_in_s3
+from taskcat._s3_stage import (
+    delete_buckets,
+    load_sync_plan,
+    save_sync_plan,
+    stage_in_s3,
+)
 from taskcat._tui import TerminalPrinter
 from taskcat.exceptions import TaskCatException
 
@@ -37,6 +45,10 @@ class Test:
         lint_disable: bool = False,
         enable_sig_v2: bool = False,
         keep_failed: bool = False,
+        changed_since: str = "",
+        sync_plan: str = "",
+        use_sync_plan: str = "",
+        force_build: bool = False,
     ):
         """tests whether CloudFormation templates are able to successfully launch
 
@@ -47,9 +59,19 @@ class Test:
         :param lint_disable: disable cfn-lint checks
         :param enable_sig_v2: enable legacy sigv2 requests for auto-created buckets
         :param keep_failed: do not delete failed stacks
+        :param changed_since: only run tests affected by changes since this git ref, or
+        since the manifest at this path (relative to project_root) was written. The
+        manifest is updated when all tests pass
+        :param sync_plan: write the files that staging would upload and delete in each
+        bucket to this path, and exit without changing any buckets or launching stacks
+        :param use_sync_plan: stage using a plan written by sync_plan, without
+        hashing or listing the project again
+        :param force_build: rebuild all lambda packages, even if their sources have not
+        changed
         """
         project_root_path: Path = Path(project_root).expanduser().resolve()
         input_file_path: Path = project_root_path / input_file
+        TEMPLATE_CACHE.persist(project_root_path / CACHE_DIR)
         config = Config.create(
             project_root=project_root_path,
             # TODO: detect if input file is taskcat config or CloudFormation template
@@ -58,6 +80,14 @@ class Test:
         )
         boto3_cache = Boto3Cache()
         templates = config.get_templates(project_root_path)
+        # 0. select tests affected by changes
+        impact = None
+        if changed_since:
+            impact = _select_affected(
+                config, templates, project_root_path, input_file_path, changed_since
+            )
+            if not config.config.tests:
+                return
         # 1. lint
         if not lint_disable:
             lint = TaskCatLint(config, templates)
@@ -66,10 +96,12 @@ class Test:
             if errors or not lint.passed:
                 raise TaskCatException("Lint failed with errors")
         # 2. build lambdas
-        LambdaBuild(config, project_root_path)
+        LambdaBuild(config, project_root_path, force=force_build)
         # 3. s3 sync
         buckets = config.get_buckets(boto3_cache)
-        stage_in_s3(buckets, config.config.project.name, project_root_path)
+        _stage(config, buckets, project_root_path, templates, sync_plan, use_sync_plan)
+        if sync_plan:
+            return
         # 4. launch stacks
         regions = config.get_regions(boto3_cache)
         parameters = config.get_rendered_parameters(buckets, regions, templates)
@@ -88,28 +120,17 @@ class Test:
         cfn_logs = _CfnLogTools()
         cfn_logs.createcfnlogs(test_definition, report_path)
         ReportBuilder(test_definition, report_path / "index.html").generate_report()
-        # 7. delete stacks
-        if no_delete:
-            LOG.info("Skipping delete due to cli argument")
-        elif keep_failed:
-            if len(status["COMPLETE"]) > 0:
-                LOG.info("deleting successful stacks")
-                test_definition.delete_stacks({"status": "CREATE_COMPLETE"})
-                terminal_printer.report_test_progress(stacker=test_definition)
-        else:
-            test_definition.delete_stacks()
-            terminal_printer.report_test_progress(stacker=test_definition)
+        # 7. delete stacks, and 8. delete buckets while the stack deletes are monitored
+        _teardown(
+            test_definition, buckets, status, no_delete, keep_failed, terminal_printer
+        )
         # TODO: summarise stack statusses (did they complete/delete ok) and print any
         #  error events
-        # 8. delete buckets
-        if not no_delete or (keep_failed is True and len(status["FAILED"]) == 0):
-            deleted: ListType[str] = []
-            for test in buckets.values():
-                for bucket in test.values():
-                    if bucket.name not in deleted:
-                        bucket.delete(delete_objects=True)
-                        deleted.append(bucket.name)
         # 9. raise if something failed
+        if impact and len(status["FAILED"]) == 0:
+            manifest_path = ChangeImpact.manifest_path(project_root_path, changed_since)
+            if manifest_path:
+                impact.write_manifest(manifest_path, config.config.tests)
         if len(status["FAILED"]) > 0:
             raise TaskCatException(
                 f'One or more stacks failed tests: {status["FAILED"]}'
@@ -153,3 +174,74 @@ class Test:
         Delete(
             package=project, aws_profile=aws_profile, region=regions, _stack_type="test"
         )
+
+
+def _select_affected(
+    config, templates, project_root_path, input_file_path, changed_since
+):
+    """removes the tests that are not affected by changes since changed_since from
+    the config and templates, and returns the ChangeImpact used to select them"""
+    # pylint: disable=too-many-arguments
+    impact = ChangeImpact(config, templates, project_root_path, [input_file_path])
+    affected = impact.affected(changed_since)
+    for test_name in list(config.config.tests.keys()):
+        if test_name not in affected:
+            LOG.info(f"skipping {test_name}, unchanged since {changed_since}")
+            del config.config.tests[test_name]
+            del templates[test_name]
+    if not affected:
+        LOG.info(f"no tests affected by changes since {changed_since}")
+    return impact
+
+
+def _stage(config, buckets, project_root_path, templates, sync_plan, use_sync_plan):
+    """stages the project, or only writes a sync plan if sync_plan is set"""
+    # pylint: disable=too-many-arguments
+    plan = stage_in_s3(
+        buckets,
+        config.config.project.name,
+        project_root_path,
+        server_side_copy=bool(config.config.project.s3_server_side_copy),
+        transfer_config=config.get_transfer_config(),
+        dry_run=bool(sync_plan),
+        plan=load_sync_plan(Path(use_sync_plan).expanduser().resolve())
+        if use_sync_plan
+        else None,
+        templates=templates if config.config.project.s3_referenced_files_only else None,
+    )
+    if not sync_plan:
+        return
+    save_sync_plan(plan, Path(sync_plan).expanduser().resolve())
+    # auto-generated buckets were only created to be planned for
+    planned: ListType[str] = []
+    for test in buckets.values():
+        for bucket in test.values():
+            if bucket.name not in planned:
+                bucket.delete()
+                planned.append(bucket.name)
+
+
+def _teardown(stacker, buckets, status, no_delete, keep_failed, terminal_printer):
+    """deletes the stacks, and deletes the buckets in the background while the stack
+    deletes are monitored"""
+    # pylint: disable=too-many-arguments
+    deleting = False
+    if no_delete:
+        LOG.info("Skipping delete due to cli argument")
+    elif keep_failed:
+        if len(status["COMPLETE"]) > 0:
+            LOG.info("deleting successful stacks")
+            stacker.delete_stacks({"status": "CREATE_COMPLETE"})
+            deleting = True
+    else:
+        stacker.delete_stacks()
+        deleting = True
+    teardown = None
+    if not no_delete or (keep_failed is True and len(status["FAILED"]) == 0):
+        pool = ThreadPool(1)
+        teardown = pool.apply_async(delete_buckets, (buckets,))
+        pool.close()
+    if deleting:
+        terminal_printer.report_test_progress(stacker=stacker)
+    if teardown:
+        teardown.get()
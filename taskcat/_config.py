@@ -6,11 +6,12 @@ from typing import Dict, Optional, Union
 
 import yaml
 
-from taskcat._cfn.template import Template
+from taskcat._cfn.template import Template, TemplateGraph
 from taskcat._client_factory import Boto3Cache
 from taskcat._common_utils import generate_bucket_name
 from taskcat._dataclasses import BaseConfig, RegionObj, S3BucketObj, TestObj, TestRegion
 from taskcat._legacy_config import legacy_overrides, parse_legacy_config
+from taskcat._s3_sync import create_transfer_config
 from taskcat._template_params import ParamGen
 from taskcat.exceptions import TaskCatException
 
@@ -236,6 +237,15 @@ class Config:
                 bucket_mappings[test_name][region_name] = bucket_obj
         return bucket_mappings
 
+    def get_transfer_config(self):
+        project = self.config.project
+        return create_transfer_config(
+            concurrency=project.s3_transfer_concurrency,
+            multipart_threshold=project.s3_multipart_threshold,
+            multipart_chunksize=project.s3_multipart_chunksize,
+            max_bandwidth=project.s3_max_bandwidth,
+        )
+
     def _create_bucket_obj(self, bucket_objects, region, test):
         new = False
         object_acl = (
@@ -305,12 +315,20 @@ class Config:
 
     def get_templates(self, project_root: Path):
         templates = {}
+        # all templates in the project share one graph, so a template used by several
+        # tests (or nested by several parents) is a single Template instance
+        graph = TemplateGraph()
         for test_name, test in self.config.tests.items():
-            templates[test_name] = Template(
-                template_path=project_root / test.template,
-                project_root=project_root,
-                s3_key_prefix=f"{self.config.project.name}/",
-            )
+            template_path = project_root / test.template
+            template = graph.get(template_path)
+            if not template:
+                template = Template(
+                    template_path=template_path,
+                    project_root=project_root,
+                    s3_key_prefix=f"{self.config.project.name}/",
+                    graph=graph,
+                )
+            templates[test_name] = template
         return templates
 
     def get_tests(self, project_root, templates, regions, buckets, parameters):
@@ -2,7 +2,9 @@ import json
 import logging
 import uuid
 from dataclasses import dataclass, field
+from multiprocessing.pool import ThreadPool
 from pathlib import Path
+from threading import BoundedSemaphore
 from typing import Any, Dict, List, NewType, Optional, Union
 
 import boto3
@@ -42,6 +44,18 @@ METADATA = {
         "description": "Path relative to the project root containing Lambda zip "
         "files, default is 'lambda_functions/source'"
     },
+    "lambda_build_concurrency": {
+        "description": "Maximum number of lambda packages to build concurrently, "
+        "defaults to 8"
+    },
+    "lambda_compression_level": {
+        "description": "Zlib compression level (0-9) of lambda zip packages that are "
+        "not built with docker, defaults to 6"
+    },
+    "lambda_docker_concurrency": {
+        "description": "Maximum number of lambda packages to build concurrently "
+        "with docker, defaults to 2"
+    },
     "s3_bucket": {
         "description": "Name of S3 bucket to upload project to, if left out "
         "a bucket will be auto-generated"
@@ -65,6 +79,31 @@ METADATA = {
     "s3_object_acl": {
         "description": "ACL for uploaded s3 objects, defaults to 'private'"
     },
+    "s3_server_side_copy": {
+        "description": "Upload the project once per partition, and copy it to the "
+        "other buckets within S3, falling back to uploading to buckets that cannot "
+        "read the first one"
+    },
+    "s3_referenced_files_only": {
+        "description": "Only stage the tested templates and the files they refer to, "
+        "rather than the whole project"
+    },
+    "s3_transfer_concurrency": {
+        "description": "Maximum number of concurrent requests when uploading to each "
+        "S3 bucket, defaults to 16"
+    },
+    "s3_multipart_threshold": {
+        "description": "Size in bytes from which files are uploaded to S3 in parts, "
+        "defaults to 8MiB"
+    },
+    "s3_multipart_chunksize": {
+        "description": "Size in bytes of the parts of S3 multipart uploads, between "
+        "5MiB and 5GiB, defaults to 8MiB"
+    },
+    "s3_max_bandwidth": {
+        "description": "Maximum upload throughput to each S3 bucket in bytes per "
+        "second, unlimited by default"
+    },
 }
 
 # types
@@ -172,6 +211,8 @@ class S3BucketObj:
     object_acl: str
     taskcat_id: uuid.UUID
 
+    EMPTY_CONCURRENCY = 8
+
     @property
     def sigv4_policy(self):
         policy = {
@@ -221,30 +262,68 @@ class S3BucketObj:
             raise error
 
     def empty(self):
+        """deletes every object version and delete marker in the bucket. Pages of
+        versions are deleted as they are listed, by a bounded pool of threads, so
+        memory use does not grow with the size of the bucket"""
         if not self.auto_generated:
             LOG.error(f"Will not empty bucket created outside of taskcat {self.name}")
             return
-        objects_to_delete = []
-        pages = self.s3_client.get_paginator("list_objects_v2").paginate(
-            Bucket=self.name
+        pool = ThreadPool(self.EMPTY_CONCURRENCY)
+        # limits the pages listed ahead of the deletes
+        slots = BoundedSemaphore(self.EMPTY_CONCURRENCY * 2)
+        errors: List[Exception] = []
+        deleted = [0]
+
+        def done(count):
+            deleted[0] += count
+            slots.release()
+
+        def failed(error):
+            errors.append(error)
+            slots.release()
+
+        try:
+            for objects in self._version_pages():
+                slots.acquire()
+                if errors:
+                    slots.release()
+                    break
+                pool.apply_async(
+                    self._delete_objects,
+                    (objects,),
+                    callback=done,
+                    error_callback=failed,
+                )
+        finally:
+            pool.close()
+            pool.join()
+        if errors:
+            raise errors[0]
+        LOG.debug(f"deleted {deleted[0]} object versions from {self.name}")
+
+    def _version_pages(self):
+        pages = self.s3_client.get_paginator("list_object_versions").paginate(
+            Bucket=self.name, PaginationConfig={"PageSize": 1000}
         )
         for page in pages:
-            objects = []
-            for obj in page.get("Contents", []):
-                del_obj = {"Key": obj["Key"]}
-                if obj.get("VersionId"):
-                    del_obj["VersionId"] = obj["VersionId"]
-                objects.append(del_obj)
-            objects_to_delete += objects
-        batched_objects = [
-            objects_to_delete[i : i + 1000]
-            for i in range(0, len(objects_to_delete), 1000)
-        ]
-        for objects in batched_objects:
-            if objects:
-                self.s3_client.delete_objects(
-                    Bucket=self.name, Delete={"Objects": objects}
-                )
+            objects = [
+                {"Key": obj["Key"], "VersionId": obj["VersionId"]}
+                for obj in page.get("Versions", []) + page.get("DeleteMarkers", [])
+            ]
+            for i in range(0, len(objects), 1000):
+                yield objects[i : i + 1000]
+
+    def _delete_objects(self, objects):
+        response = self.s3_client.delete_objects(
+            Bucket=self.name, Delete={"Objects": objects, "Quiet": True}
+        )
+        if response.get("Errors"):
+            error = response["Errors"][0]
+            raise TaskCatException(
+                f"failed to delete {len(response['Errors'])} objects from "
+                f"{self.name}, {error['Key']}: {error['Message']}"
+            )
+        return len(objects)
 
     def delete(self, delete_objects=False):
         if not self.auto_generated:
@@ -365,6 +444,15 @@ class ProjectConfig(JsonSchemaMixin, allow_additional_props=False):  # type: ign
     lambda_source_path: Optional[str] = field(
         default=None, metadata=METADATA["lambda_source_path"]
     )
+    lambda_build_concurrency: Optional[int] = field(
+        default=None, metadata=METADATA["lambda_build_concurrency"]
+    )
+    lambda_compression_level: Optional[int] = field(
+        default=None, metadata=METADATA["lambda_compression_level"]
+    )
+    lambda_docker_concurrency: Optional[int] = field(
+        default=None, metadata=METADATA["lambda_docker_concurrency"]
+    )
     s3_bucket: Optional[S3BucketName] = field(
         default=None, metadata=METADATA["s3_bucket"]
     )
@@ -384,6 +472,24 @@ class ProjectConfig(JsonSchemaMixin, allow_additional_props=False):  # type: ign
     s3_object_acl: Optional[str] = field(
         default=None, metadata=METADATA["s3_object_acl"]
     )
+    s3_server_side_copy: Optional[bool] = field(
+        default=None, metadata=METADATA["s3_server_side_copy"]
+    )
+    s3_referenced_files_only: Optional[bool] = field(
+        default=None, metadata=METADATA["s3_referenced_files_only"]
+    )
+    s3_transfer_concurrency: Optional[int] = field(
+        default=None, metadata=METADATA["s3_transfer_concurrency"]
+    )
+    s3_multipart_threshold: Optional[int] = field(
+        default=None, metadata=METADATA["s3_multipart_threshold"]
+    )
+    s3_multipart_chunksize: Optional[int] = field(
+        default=None, metadata=METADATA["s3_multipart_chunksize"]
+    )
+    s3_max_bandwidth: Optional[int] = field(
+        default=None, metadata=METADATA["s3_max_bandwidth"]
+    )
 
 
 PROPAGATE_KEYS = ["tags", "parameters", "auth"]
@@ -1,9 +1,20 @@
+import hashlib
+import json
 import logging
+import os
+import re
 import shutil
+import stat
+import sys
 import tempfile
+import time
+from multiprocessing.pool import AsyncResult, ThreadPool
 from pathlib import Path
 from subprocess import PIPE, CalledProcessError, run as subprocess_run  # nosec
+from threading import BoundedSemaphore, Event, Lock
+from typing import Callable, Dict, List, Optional, Tuple
 from uuid import UUID, uuid5
+from zipfile import ZIP_DEFLATED, ZipFile, ZipInfo
 
 import docker
 
@@ -12,109 +23,469 @@ from .exceptions import TaskCatException
 
 LOG = logging.getLogger(__name__)
 
+BUILD_MANIFEST_PATH = Path(".taskcat/lambda_build.json")
+WHEEL_CACHE_PATH = Path(".taskcat/wheels")
+BUILD_CONCURRENCY = 8
+DOCKER_CONCURRENCY = 2
+ZIP_COMPRESSION_LEVEL = 6
+# the earliest time a zip can hold, so that packages don't depend on file mtimes. It
+# is also the time ZipFile gives the entries it creates itself
+ZIP_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+FROM_LINE = re.compile(r"^\s*FROM\s+(?:--\S+\s+)*(\S+)", re.IGNORECASE | re.MULTILINE)
+
 
 class LambdaBuild:
+    """builds a zip package for each lambda source directory. Packages are only
+    rebuilt when the fingerprint of their source directory (file contents, the pip
+    version or docker base images used to build it) differs from the one recorded
+    in the build manifest when the existing package was built, or when forced.
+
+    Packages are built concurrently, with fewer docker builds at once than pip
+    builds. After the first failure no more builds are started, and all failures
+    are raised together once the running builds have finished"""
+
     NULL_UUID = UUID("{00000000-0000-0000-0000-000000000000}")
+    MANIFEST_VERSION = 1
 
-    def __init__(self, config: Config, project_root: Path):
+    def __init__(self, config: Config, project_root: Path, force: bool = False):
         self._docker = docker.from_env()
         self._config = config
         self._project_root = Path(project_root).expanduser().resolve()
+        self._force = force
+        self._manifest: Dict[str, dict] = {} if force else self._load_manifest()
+        self._pip_version: Optional[str] = None
+        project = config.config.project
+        self._scheduler = _BuildScheduler(
+            project.lambda_build_concurrency or BUILD_CONCURRENCY,
+            project.lambda_docker_concurrency or DOCKER_CONCURRENCY,
+        )
+        self._compression_level = (
+            ZIP_COMPRESSION_LEVEL
+            if project.lambda_compression_level is None
+            else project.lambda_compression_level
+        )
         self._lambda_source_path = (
             self._project_root / config.config.project.lambda_source_path
         ).resolve()
         self._lambda_zip_path = (
             self._project_root / config.config.project.lambda_zip_path
         ).resolve()
-        self._build_lambdas(self._lambda_source_path, self._lambda_zip_path)
-        self._build_submodules()
+        try:
+            self._build_lambdas(self._lambda_source_path, self._lambda_zip_path)
+            self._build_submodules()
+        finally:
+            self._scheduler.join()
+            if self._scheduler.builds:
+                self._save_manifest()
+        self._scheduler.report()
+
+    @property
+    def _manifest_path(self) -> Path:
+        return self._project_root / BUILD_MANIFEST_PATH
+
+    @property
+    def _wheel_path(self) -> Path:
+        return self._project_root / WHEEL_CACHE_PATH
+
+    @staticmethod
+    def source_paths(config: Config, project_root: Path) -> List[Tuple[Path, Path]]:
+        """returns (lambda source, package output) directory pairs for the project,
+        and for its submodules if build_submodules is enabled"""
+        project_root = Path(project_root).expanduser().resolve()
+        source = (project_root / config.config.project.lambda_source_path).resolve()
+        output = (project_root / config.config.project.lambda_zip_path).resolve()
+        paths = [(source, output)]
+        if config.config.project.build_submodules:
+            paths += LambdaBuild._recurse(
+                project_root,
+                source.relative_to(project_root),
+                output.relative_to(project_root),
+            )
+        return paths
 
     def _build_submodules(self):
         if not self._config.config.project.build_submodules:
             return
         rel_source = self._lambda_source_path.relative_to(self._project_root)
         rel_zip = self._lambda_zip_path.relative_to(self._project_root)
-        self._recurse(self._project_root, rel_source, rel_zip)
+        for source_path, output_path in self._recurse(
+            self._project_root, rel_source, rel_zip
+        ):
+            self._build_lambdas(source_path, output_path)
 
-    def _recurse(self, base_path, rel_source, rel_zip):
+    @staticmethod
+    def _recurse(base_path, rel_source, rel_zip) -> List[Tuple[Path, Path]]:
+        paths: List[Tuple[Path, Path]] = []
         submodules_path = Path(base_path) / "submodules"
         if not submodules_path.is_dir():
-            return
+            return paths
         for submodule in submodules_path.iterdir():
             source_path = submodule / rel_source
             if not source_path.is_dir():
                 continue
-            output_path = submodule / rel_zip
-            self._build_lambdas(source_path, output_path)
-            self._recurse(submodule, rel_source, rel_zip)
+            paths.append((source_path, submodule / rel_zip))
+            paths += LambdaBuild._recurse(submodule, rel_source, rel_zip)
+        return paths
 
     def _build_lambdas(self, parent_path: Path, output_path):
         if not parent_path.is_dir():
             return
-        for path in parent_path.iterdir():
-            if (path / "Dockerfile").is_file():
-                tag = f"taskcat-build-{uuid5(self.NULL_UUID, str(path)).hex}"
+        for path in sorted(parent_path.iterdir()):
+            self._scheduler.submit(path, self._build_lambda, output_path / path.stem)
+
+    def _build_lambda(self, path: Path, package_path: Path) -> Optional[float]:
+        """returns how long the build took, or None if it was not needed"""
+        if self._scheduler.failed.is_set():
+            return None
+        start = time.monotonic()
+        try:
+            fingerprint = self._fingerprint(path)
+            artifact = self._scheduler.artifact(fingerprint, path, package_path)
+            if artifact[0] != path:
+                self._reuse_package(artifact, path, package_path)
+                return None
+            try:
+                if not self._build(path, package_path, fingerprint):
+                    return None
+            finally:
+                artifact[2].set()
+        except Exception:
+            self._scheduler.failed.set()
+            raise
+        return time.monotonic() - start
+
+    def _build(self, path: Path, package_path: Path, fingerprint: str) -> bool:
+        if self._up_to_date(path, package_path, fingerprint):
+            LOG.info(f"Lambda package for {path} is up to date, not rebuilding")
+            return False
+        if (path / "Dockerfile").is_file():
+            tag = f"taskcat-build-{uuid5(self.NULL_UUID, str(path)).hex}"
+            with self._scheduler.docker_slots:
                 LOG.info(
                     f"Packaging lambda source from {path} using docker image {tag}"
                 )
                 self._docker_build(path, tag)
-                self._docker_extract(tag, output_path / path.stem)
-            elif (path / "requirements.txt").is_file():
-                LOG.info(f"Packaging python lambda source from {path} using pip")
-                self._pip_build(path, output_path / path.stem)
-            else:
-                LOG.info(
-                    f"Packaging lambda source from {path} without building "
-                    f"dependencies"
-                )
-                self._zip_dir(path, output_path / path.stem)
+                self._docker_extract(tag, package_path)
+        elif (path / "requirements.txt").is_file():
+            LOG.info(f"Packaging python lambda source from {path} using pip")
+            self._pip_build(path, package_path)
+        else:
+            LOG.info(
+                f"Packaging lambda source from {path} without building dependencies"
+            )
+            self._zip_dir(path, package_path, self._compression_level)
+        # fingerprinted after the build, so that any base image pulled by it is
+        # included
+        self._manifest[self._manifest_key(path)] = {
+            "fingerprint": self._fingerprint(path),
+            "package": self._hash_dir(package_path),
+        }
+        return True
+
+    def _reuse_package(
+        self, artifact: Tuple[Path, Path, Event], path: Path, package_path: Path
+    ):
+        """waits for the package of identical source (eg. a helper vendored by
+        several submodules) to be built, and links it into package_path"""
+        source_path, source_package_path, built = artifact
+        built.wait()
+        if self._scheduler.failed.is_set():
+            return
+        entry = self._manifest[self._manifest_key(source_path)]
+        current = self._hash_dir(package_path) if package_path.is_dir() else {}
+        if any(
+            current.get(name) != digest for name, digest in entry["package"].items()
+        ):
+            LOG.info(
+                f"Lambda source {path} is identical to {source_path}, using its "
+                f"package"
+            )
+            self._link_dir(source_package_path, package_path)
+        self._manifest[self._manifest_key(path)] = dict(entry)
+
+    @classmethod
+    def _link_dir(cls, source_path: Path, output_path: Path):
+        """hardlinks the files of a directory into another, or copies them if they
+        are on different filesystems, and removes any other files from it. Packages
+        are always replaced rather than written in place, so linked packages do not
+        change together"""
+        sources = set()
+        for source in cls._files(source_path):
+            sources.add(source.relative_to(source_path))
+            dest = output_path / source.relative_to(source_path)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            tmp_dest = dest.with_name(f".{dest.name}.tmp")
+            if tmp_dest.exists():
+                tmp_dest.unlink()
+            try:
+                os.link(str(source), str(tmp_dest))
+            except OSError:
+                shutil.copy2(str(source), str(tmp_dest))
+            os.replace(str(tmp_dest), str(dest))
+        for dest in cls._files(output_path):
+            if dest.relative_to(output_path) not in sources:
+                dest.unlink()
+
+    @classmethod
+    def _move_dir(cls, source_path: Path, output_path: Path):
+        """moves the files of a directory into another, replacing any existing files
+        rather than writing to them, so packages linked to them are unchanged"""
+        for source in cls._files(source_path):
+            dest = output_path / source.relative_to(source_path)
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            try:
+                os.replace(str(source), str(dest))
+            except OSError:
+                # eg. files written by root in a container, in directories the
+                # current user cannot rename out of
+                tmp_dest = dest.with_name(f".{dest.name}.tmp")
+                shutil.copy2(str(source), str(tmp_dest))
+                os.replace(str(tmp_dest), str(dest))
 
     @staticmethod
-    def _make_pip_command(base_path):
+    def _files(path: Path) -> List[Path]:
         return [
+            Path(root) / file for root, _, files in os.walk(str(path)) for file in files
+        ]
+
+    def _manifest_key(self, path: Path) -> str:
+        return Path(os.path.relpath(str(path), str(self._project_root))).as_posix()
+
+    def _up_to_date(self, path: Path, package_path: Path, fingerprint: str) -> bool:
+        entry = self._manifest.get(self._manifest_key(path))
+        if not entry or not package_path.is_dir():
+            return False
+        return entry["fingerprint"] == fingerprint and entry[
+            "package"
+        ] == self._hash_dir(package_path)
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        try:
+            with open(str(self._manifest_path), "r") as file_handle:
+                manifest = json.load(file_handle)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            LOG.debug(f"ignoring invalid build manifest {self._manifest_path}")
+            return {}
+        if manifest.get("version") != self.MANIFEST_VERSION:
+            return {}
+        return manifest["packages"]
+
+    def _save_manifest(self):
+        self._manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(str(self._manifest_path), "w") as file_handle:
+            json.dump(
+                {"version": self.MANIFEST_VERSION, "packages": self._manifest},
+                file_handle,
+                indent=2,
+                sort_keys=True,
+            )
+
+    @staticmethod
+    def _hash_dir(path: Path) -> Dict[str, str]:
+        hashes = {}
+        for root, _, files in os.walk(str(path)):
+            for file in files:
+                full_path = Path(root) / file
+                with open(str(full_path), "rb") as file_handle:
+                    digest = hashlib.sha256(file_handle.read()).hexdigest()
+                hashes[full_path.relative_to(path).as_posix()] = digest
+        return hashes
+
+    def _fingerprint(self, path: Path) -> str:
+        digest = hashlib.sha256()
+        for relpath, file_hash in sorted(self._hash_dir(path).items()):
+            digest.update(f"{relpath}\0{file_hash}\0".encode())
+        if (path / "Dockerfile").is_file():
+            with open(str(path / "Dockerfile"), "r") as file_handle:
+                images = FROM_LINE.findall(file_handle.read())
+            for image in images:
+                digest.update(f"{image}\0{self._image_id(image)}\0".encode())
+        else:
+            digest.update(f"zip\0{self._compression_level}\0".encode())
+            if (path / "requirements.txt").is_file():
+                digest.update(self._get_pip_version().encode())
+        return digest.hexdigest()
+
+    def _image_id(self, image: str) -> str:
+        try:
+            return self._docker.images.get(image).id
+        except Exception:  # pylint: disable=broad-except
+            # not pulled yet (or a build stage), docker build will pull it
+            return ""
+
+    def _get_pip_version(self) -> str:
+        if self._pip_version is None:
+            try:
+                self._pip_version = subprocess_run(  # nosec
+                    ["pip", "--version"], check=True, stdout=PIPE, stderr=PIPE
+                ).stdout.decode("utf-8")
+            except (FileNotFoundError, CalledProcessError):
+                self._pip_version = ""
+        return self._pip_version
+
+    @staticmethod
+    def _make_pip_command(base_path, wheel_path, offline=True):
+        command = [
             "pip",
             "install",
             "--no-cache-dir",
             "--no-color",
             "--disable-pip-version-check",
             "--upgrade",
+            "--find-links",
+            str(wheel_path),
             "--requirement",
             str(base_path / "requirements.txt"),
             "--target",
             str(base_path),
         ]
+        if offline:
+            command.insert(6, "--no-index")
+        return command
 
-    @classmethod
-    def _pip_build(cls, base_path, output_path):
+    @staticmethod
+    def _make_pip_wheel_command(base_path, wheel_path, wheel_dir):
+        return [
+            "pip",
+            "wheel",
+            "--no-color",
+            "--disable-pip-version-check",
+            "--find-links",
+            str(wheel_path),
+            "--wheel-dir",
+            str(wheel_dir),
+            "--requirement",
+            str(base_path / "requirements.txt"),
+        ]
+
+    def _pip_build(self, base_path, output_path):
+        """installs the requirements from the project's wheel cache. If they are not
+        all in the cache (or the build is forced), they are first resolved into
+        wheels, which are added to the cache, so that later builds sharing
+        dependencies don't download and build them again"""
         tmp_path = Path(tempfile.mkdtemp())
         try:
             build_path = tmp_path / "build"
             shutil.copytree(base_path, build_path)
-            command = cls._make_pip_command(build_path)
-            LOG.debug("command is '%s'", command)
-
             LOG.info("Starting pip build.")
-            try:
-                completed_proc = subprocess_run(  # nosec
-                    command, cwd=build_path, check=True, stdout=PIPE, stderr=PIPE
-                )
-            except (FileNotFoundError, CalledProcessError) as e:
-                raise TaskCatException("pip build failed") from e
-            LOG.debug("--- pip stdout:\n%s", completed_proc.stdout)
-            LOG.debug("--- pip stderr:\n%s", completed_proc.stderr)
-            cls._zip_dir(build_path, output_path)
+            installed = not self._force and self._run_pip(
+                self._make_pip_command(build_path, self._wheel_path),
+                build_path,
+                check=False,
+            )
+            if not installed:
+                wheel_dir = tmp_path / "wheels"
+                self._resolve_wheels(build_path, wheel_dir)
+                self._run_pip(self._make_pip_command(build_path, wheel_dir), build_path)
+            self._zip_dir(build_path, output_path, self._compression_level)
             shutil.rmtree(tmp_path, ignore_errors=True)
         except Exception as e:  # pylint: disable=broad-except
             shutil.rmtree(tmp_path, ignore_errors=True)
             raise e
 
+    def _resolve_wheels(self, build_path, wheel_dir):
+        """resolves the requirements into wheels in wheel_dir, reusing cached ones,
+        and adds the new ones to the cache. Each build resolves into its own
+        directory, and wheels are renamed into the cache, so concurrent builds
+        don't wait for each other or see partly written wheels"""
+        self._run_pip(
+            self._make_pip_wheel_command(build_path, self._wheel_path, wheel_dir),
+            build_path,
+        )
+        self._wheel_path.mkdir(parents=True, exist_ok=True)
+        for wheel in wheel_dir.glob("*.whl"):
+            if (self._wheel_path / wheel.name).exists():
+                continue
+            # not named *.whl, so pip ignores it until it is complete
+            handle, tmp_name = tempfile.mkstemp(
+                prefix=f".{wheel.name}.", dir=str(self._wheel_path)
+            )
+            os.close(handle)
+            shutil.copyfile(str(wheel), tmp_name)
+            os.replace(tmp_name, str(self._wheel_path / wheel.name))
+
     @staticmethod
-    def _zip_dir(build_path, output_path):
+    def _run_pip(command, cwd, check=True) -> bool:
+        """runs a pip command, returning False if it fails and check is False"""
+        LOG.debug("command is '%s'", command)
+        try:
+            completed_proc = subprocess_run(  # nosec
+                command, cwd=cwd, check=True, stdout=PIPE, stderr=PIPE
+            )
+        except (FileNotFoundError, CalledProcessError) as e:
+            if not check and isinstance(e, CalledProcessError):
+                LOG.debug("--- pip stderr:\n%s", e.stderr)
+                return False
+            raise TaskCatException("pip build failed") from e
+        LOG.debug("--- pip stdout:\n%s", completed_proc.stdout)
+        LOG.debug("--- pip stderr:\n%s", completed_proc.stderr)
+        return True
+
+    @classmethod
+    def _zip_dir(cls, build_path, output_path, compression_level=ZIP_COMPRESSION_LEVEL):
+        """zips a directory reproducibly: entries are sorted, and timestamps and
+        permissions normalised, so the same files always give the same zip. The zip
+        is written to a temporary file, and only replaces lambda.zip if it differs,
+        so an unchanged package keeps its mtime and ETag"""
         output_path.mkdir(parents=True, exist_ok=True)
         zip_path = output_path / "lambda.zip"
-        if zip_path.is_file():
-            zip_path.unlink()
-        shutil.make_archive(output_path / "lambda", "zip", build_path)
+        handle, tmp_name = tempfile.mkstemp(
+            prefix=".lambda.", suffix=".zip", dir=str(output_path)
+        )
+        tmp_path = Path(tmp_name)
+        # python 3.6 can only write zips at the default compression level
+        options = {}
+        if sys.version_info >= (3, 7):
+            options["compresslevel"] = compression_level
+        try:
+            with os.fdopen(handle, "wb") as file_handle:
+                with ZipFile(file_handle, "w", ZIP_DEFLATED, **options) as archive:
+                    for path in cls._zip_entries(Path(build_path)):
+                        cls._add_to_zip(archive, path, Path(build_path))
+            if zip_path.is_file() and cls._file_digest(zip_path) == cls._file_digest(
+                tmp_path
+            ):
+                LOG.debug(f"{zip_path} is unchanged")
+                tmp_path.unlink()
+            else:
+                os.replace(str(tmp_path), str(zip_path))
+        except Exception as e:  # pylint: disable=broad-except
+            if tmp_path.exists():
+                tmp_path.unlink()
+            raise e
+
+    @staticmethod
+    def _zip_entries(build_path: Path) -> List[Path]:
+        entries = []
+        for root, dirs, files in os.walk(str(build_path)):
+            entries += [Path(root) / name for name in dirs + files]
+        return sorted(entries, key=lambda path: path.relative_to(build_path).parts)
+
+    @staticmethod
+    def _add_to_zip(archive: ZipFile, path: Path, build_path: Path):
+        relpath = path.relative_to(build_path).as_posix()
+        if path.is_dir():
+            info = ZipInfo(relpath + "/", date_time=ZIP_DATE_TIME)
+            info.external_attr = ((stat.S_IFDIR | 0o755) << 16) | 0x10
+            archive.writestr(info, b"")
+            return
+        # opened by name, so the entry is compressed at the archive's level, and
+        # streamed, so large dependencies are not read into memory
+        with open(str(path), "rb") as source, archive.open(relpath, "w") as dest:
+            shutil.copyfileobj(source, dest, 1024 * 1024)
+        # permissions are only kept in the central directory, written on close
+        mode = 0o755 if path.stat().st_mode & stat.S_IXUSR else 0o644
+        archive.getinfo(relpath).external_attr = (stat.S_IFREG | mode) << 16
+
+    @staticmethod
+    def _file_digest(path: Path) -> str:
+        digest = hashlib.sha256()
+        with open(str(path), "rb") as file_handle:
+            for chunk in iter(lambda: file_handle.read(1024 * 1024), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
 
     @staticmethod
     def _clean_build_log(line):
@@ -134,6 +505,78 @@ class LambdaBuild:
         LOG.debug("docker build logs: \n{}".format("\n".join(build_logs)))
 
     def _docker_extract(self, tag, package_path):
-        volumes = {str(package_path): {"bind": "/output", "mode": "rw"}}
-        logs = self._docker.containers.run(image=tag, auto_remove=True, volumes=volumes)
-        LOG.debug("docker run logs: \n{}".format(logs.decode("utf-8").strip()))
+        """runs the build image with a temporary output directory, whose files then
+        replace those in package_path, since writing to them in place would also
+        change any packages linked to them"""
+        package_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = Path(
+            tempfile.mkdtemp(
+                prefix=f".{package_path.name}.", dir=str(package_path.parent)
+            )
+        )
+        try:
+            volumes = {str(tmp_path): {"bind": "/output", "mode": "rw"}}
+            logs = self._docker.containers.run(
+                image=tag, auto_remove=True, volumes=volumes
+            )
+            LOG.debug("docker run logs: \n{}".format(logs.decode("utf-8").strip()))
+            self._move_dir(tmp_path, package_path)
+        finally:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
+class _BuildScheduler:
+    """runs builds on a thread pool, with a limited number of docker builds at once.
+    Builds check failed, so that none start after the first failure"""
+
+    def __init__(self, concurrency: int, docker_concurrency: int):
+        self.pool = ThreadPool(concurrency)
+        self.docker_slots = BoundedSemaphore(docker_concurrency)
+        self.builds: List[Tuple[Path, AsyncResult]] = []
+        self.failed = Event()
+        # the first source directory with each fingerprint, and its package, which
+        # is reused for any identical source directories
+        self._artifacts: Dict[str, Tuple[Path, Path, Event]] = {}
+        self._artifacts_lock = Lock()
+
+    def submit(self, path: Path, func: Callable, *args) -> None:
+        self.builds.append((path, self.pool.apply_async(func, (path,) + args)))
+
+    def join(self) -> None:
+        self.pool.close()
+        self.pool.join()
+
+    def artifact(
+        self, fingerprint: str, path: Path, package_path: Path
+    ) -> Tuple[Path, Path, Event]:
+        """returns the source directory, package and built event of the first build
+        with this fingerprint, registering this build if it is the first"""
+        with self._artifacts_lock:
+            return self._artifacts.setdefault(
+                fingerprint, (path, package_path, Event())
+            )
+
+    def report(self):
+        """logs the slowest build, and raises the failures of all builds"""
+        errors: Dict[Path, Exception] = {}
+        timings: Dict[Path, float] = {}
+        for path, build in self.builds:
+            try:
+                elapsed = build.get()
+            except Exception as e:  # pylint: disable=broad-except
+                errors[path] = e
+                continue
+            if elapsed is not None:
+                timings[path] = elapsed
+                LOG.debug(f"building lambda package for {path} took {elapsed:.1f}s")
+        if timings:
+            slowest = max(timings, key=timings.__getitem__)
+            LOG.info(
+                f"built {len(timings)} lambda packages, slowest was {slowest} "
+                f"({timings[slowest]:.1f}s)"
+            )
+        if errors:
+            details = "\n".join(f"{path}: {error}" for path, error in errors.items())
+            raise TaskCatException(
+                f"failed to build {len(errors)} lambda packages:\n{details}"
+            )
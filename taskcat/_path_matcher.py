@@ -0,0 +1,123 @@
+import logging
+import re
+from pathlib import Path
+from typing import Iterable, List, Pattern, Tuple
+
+LOG = logging.getLogger(__name__)
+
+# appended to directory paths, so that directory-only patterns can be compiled
+# into the same regex as other patterns
+DIR_MARKER = "\0"
+
+
+class PathMatcher:
+    """matches paths against gitignore style patterns.
+
+    Supports `*`, `?`, `[...]`, `**`, negation with `!`, patterns anchored to the root
+    with a leading (or inner) `/` and directory-only patterns with a trailing `/`. As
+    with git, the last matching pattern wins. Paths are relative to the root, using
+    `/` as the separator.
+
+    Consecutive patterns of the same kind are compiled into a single regex, so
+    matching a path costs one regex search per change between excludes and
+    negations."""
+
+    def __init__(self, patterns: Iterable[str] = ()):
+        self.patterns: List[str] = []
+        self._rules: List[Tuple[bool, Pattern]] = []
+        self.add(patterns)
+
+    def __repr__(self):
+        return f"<PathMatcher {len(self.patterns)} patterns at {hex(id(self))}>"
+
+    def add(self, patterns: Iterable[str]) -> None:
+        for pattern in patterns:
+            pattern = self._strip(pattern)
+            if pattern:
+                self.patterns.append(pattern)
+        self._rules = self._compile(self.patterns)
+
+    def add_file(self, path: Path) -> None:
+        """adds the patterns from an ignore file, if it exists"""
+        if not path.is_file():
+            return
+        LOG.debug(f"loading exclude patterns from {path}")
+        with open(str(path), "r") as file_handle:
+            self.add(file_handle.read().splitlines())
+
+    def match(self, relpath: str, is_dir: bool = False) -> bool:
+        """returns True if the path is excluded. Only the path itself is checked, the
+        contents of excluded directories should be pruned by the caller"""
+        subject = relpath.strip("/") + (DIR_MARKER if is_dir else "")
+        for negate, regex in reversed(self._rules):
+            if regex.match(subject):
+                return not negate
+        return False
+
+    @staticmethod
+    def _strip(pattern: str) -> str:
+        if pattern.startswith("#"):
+            return ""
+        # trailing spaces are ignored, unless escaped
+        stripped = pattern.rstrip(" ")
+        if stripped.endswith("\\") and len(stripped) < len(pattern):
+            stripped += " "
+        return stripped
+
+    @classmethod
+    def _compile(cls, patterns: List[str]) -> List[Tuple[bool, Pattern]]:
+        groups: List[Tuple[bool, List[str]]] = []
+        for pattern in patterns:
+            negate = pattern.startswith("!")
+            regex = cls._translate(pattern[1:] if negate else pattern)
+            if groups and groups[-1][0] == negate:
+                groups[-1][1].append(regex)
+            else:
+                groups.append((negate, [regex]))
+        return [
+            (negate, re.compile("|".join(f"(?:{r})" for r in regexes)))
+            for negate, regexes in groups
+        ]
+
+    @staticmethod
+    def _translate(pattern: str) -> str:  # noqa: C901
+        dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        # patterns with a slash (other than at the end) are relative to the root,
+        # others match at any depth
+        anchored = "/" in pattern
+        pattern = pattern.lstrip("/")
+        regex = "" if anchored else "(?:.*/)?"
+        i = 0
+        while i < len(pattern):
+            char = pattern[i]
+            if pattern.startswith("**/", i) and (i == 0 or pattern[i - 1] == "/"):
+                regex += "(?:.*/)?"
+                i += 3
+                continue
+            if pattern.endswith("/**") and i == len(pattern) - 2:
+                regex += ".+"
+                i += 2
+                continue
+            if char == "*":
+                regex += "[^/]*"
+            elif char == "?":
+                regex += "[^/]"
+            elif char == "\\" and i + 1 < len(pattern):
+                i += 1
+                regex += re.escape(pattern[i])
+            elif char == "[":
+                end = pattern.find("]", i + 2)
+                if end == -1:
+                    regex += re.escape(char)
+                else:
+                    body = pattern[i + 1 : end]
+                    if body.startswith("!"):
+                        body = "^" + body[1:]
+                    regex += f"[{body.replace(chr(92), chr(92) * 2)}]"
+                    i = end
+            else:
+                regex += re.escape(char)
+            i += 1
+        marker = re.escape(DIR_MARKER)
+        return regex + (f"{marker}$" if dir_only else f"{marker}?$")
@@ -1,6 +1,16 @@
+import json
 import logging
+import time
+from pathlib import Path
 
-from taskcat._s3_sync import S3Sync
+from taskcat._cfn.threaded import fan_out
+from taskcat._s3_sync import (
+    HASH_CACHE_PATH,
+    FileHashCache,
+    S3Sync,
+    create_transfer_config,
+)
+from taskcat._stage_closure import StageClosure
 from taskcat.exceptions import TaskCatException
 
 LOG = logging.getLogger(__name__)
@@ -21,13 +31,180 @@ class S3BucketCreatorException(TaskCatException):
     pass
 
 
-def stage_in_s3(buckets, project_name, project_root):
-    distinct_buckets = {}
+def stage_in_s3(
+    buckets,
+    project_name,
+    project_root,
+    server_side_copy=False,
+    transfer_config=None,
+    dry_run=False,
+    plan=None,
+    templates=None,
+):  # pylint: disable=too-many-arguments,too-many-locals
+    """syncs the project to every distinct bucket concurrently, each with its own
+    transfer manager. The project is only walked and hashed once.
+
+    With server_side_copy, the project is uploaded to one bucket per partition, and
+    then copied from it within S3 to the other buckets in the partition.
+
+    With dry_run, no bucket is modified and the plan for each bucket is returned. A
+    plan can then be passed in to apply it, buckets that are not in the plan (eg.
+    auto-generated buckets of a previous run) are synced as usual.
+
+    If the tested templates are passed in, only they and the files they refer to
+    are staged, see StageClosure"""
+    distinct_buckets = _distinct_buckets(buckets)
+    if not distinct_buckets:
+        return {"version": S3Sync.PLAN_VERSION, "buckets": {}} if dry_run else None
+    planned = plan["buckets"] if plan else {}
+    if plan:
+        for name in sorted(distinct_buckets.keys() - planned.keys()):
+            LOG.warning(f"no sync plan for {name}, syncing it from {project_root}")
+    transfer_config = transfer_config or create_transfer_config()
+    hash_cache = FileHashCache(
+        Path(project_root).expanduser().resolve() / HASH_CACHE_PATH,
+        transfer_config.multipart_chunksize,
+        transfer_config.multipart_threshold,
+    )
+    kwargs = {
+        "project_name": project_name,
+        "project_root": project_root,
+        "file_list": None,
+        "hash_cache": hash_cache,
+        "transfer_config": transfer_config,
+        "dry_run": dry_run,
+        "plans": planned,
+    }
+    if not distinct_buckets.keys() <= planned.keys():
+        kwargs["file_list"] = _local_file_list(project_root, templates)
+    if not server_side_copy:
+        syncs = fan_out(
+            _sync_bucket, kwargs, distinct_buckets.values(), len(distinct_buckets)
+        )
+    else:
+        syncs = _sync_and_copy(distinct_buckets, kwargs)
+    # planned buckets are not hashed, so only save the cache if the project was
+    if kwargs["file_list"] is not None:
+        hash_cache.save()
+    if not dry_run:
+        return None
+    return {
+        "version": S3Sync.PLAN_VERSION,
+        "buckets": {sync.plan["bucket"]: sync.plan for sync in syncs},
+    }
+
 
+def _distinct_buckets(buckets):
+    distinct_buckets = {}
     for test in buckets.values():
         for bucket in test.values():
             distinct_buckets[bucket.name] = bucket
+    return distinct_buckets
+
+
+def _sync_and_copy(distinct_buckets, kwargs):
+    """syncs one bucket per partition, and copies it to the others"""
+    primaries = {}
     for bucket in distinct_buckets.values():
-        S3Sync(
-            bucket.s3_client, bucket.name, project_name, project_root, bucket.object_acl
+        primaries.setdefault(bucket.partition, bucket)
+    syncs = fan_out(_sync_bucket, kwargs, primaries.values(), len(primaries))
+    primary_names = {bucket.name for bucket in primaries.values()}
+    copies = [b for b in distinct_buckets.values() if b.name not in primary_names]
+    if copies:
+        syncs += fan_out(
+            _copy_bucket, {**kwargs, "primaries": primaries}, copies, len(copies)
         )
+    return syncs
+
+
+def _local_file_list(project_root, templates):
+    # pylint: disable=protected-access
+    file_list = S3Sync._get_local_file_list(project_root, include_checksums=False)
+    if templates is None:
+        return file_list
+    return StageClosure(templates, project_root).filter(file_list)
+
+
+def save_sync_plan(plan, path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(str(path), "w") as file_handle:
+        json.dump(plan, file_handle, indent=2, sort_keys=True)
+    LOG.info(f"sync plan written to {path}")
+
+
+def load_sync_plan(path):
+    try:
+        with open(str(path), "r") as file_handle:
+            plan = json.load(file_handle)
+    except (OSError, ValueError) as e:
+        raise TaskCatException(f"cannot read sync plan {path}: {e}")
+    if plan.get("version") != S3Sync.PLAN_VERSION:
+        raise TaskCatException(f"sync plan {path} is from an unsupported version")
+    return plan
+
+
+def delete_buckets(buckets, threads=16):
+    """empties and deletes every distinct bucket concurrently. Failures are
+    collected, and raised together once all the buckets have been attempted"""
+    distinct_buckets = _distinct_buckets(buckets)
+    if not distinct_buckets:
+        return
+    results = fan_out(
+        _delete_bucket,
+        None,
+        distinct_buckets.values(),
+        min(threads, len(distinct_buckets)),
+    )
+    failures = {name: error for name, error, _ in results if error}
+    slowest = max(results, key=lambda result: result[2])
+    LOG.info(
+        f"deleted {len(results) - len(failures)} of {len(results)} buckets, slowest "
+        f"was {slowest[0]} ({slowest[2]:.1f}s)"
+    )
+    if failures:
+        details = ", ".join(f"{name}: {error}" for name, error in failures.items())
+        raise TaskCatException(f"failed to delete {len(failures)} buckets: {details}")
+
+
+def _delete_bucket(bucket):
+    start = time.monotonic()
+    error = None
+    try:
+        bucket.delete(delete_objects=True)
+    except Exception as e:  # pylint: disable=broad-except
+        error = e
+        LOG.error(f"failed to delete bucket {bucket.name}: {e}")
+    elapsed = time.monotonic() - start
+    LOG.debug(f"deleting bucket {bucket.name} took {elapsed:.1f}s")
+    return bucket.name, error, elapsed
+
+
+def _sync_bucket(
+    bucket,
+    project_name,
+    project_root,
+    file_list,
+    hash_cache,
+    transfer_config,
+    dry_run,
+    plans,
+    copy_source=None,
+):  # pylint: disable=too-many-arguments
+    return S3Sync(
+        bucket.s3_client,
+        bucket.name,
+        project_name,
+        project_root,
+        bucket.object_acl,
+        hash_cache=hash_cache,
+        file_list=file_list,
+        transfer_config=transfer_config,
+        copy_source=copy_source,
+        dry_run=dry_run,
+        plan=plans.get(bucket.name),
+    )
+
+
+def _copy_bucket(bucket, primaries, **kwargs):
+    return _sync_bucket(bucket, copy_source=primaries[bucket.partition].name, **kwargs)
@@ -1,24 +1,82 @@
-import fnmatch
 import hashlib
+import json
 import logging
+import mmap
 import os
 import time
+from dataclasses import dataclass, field
 from functools import partial
 from multiprocessing.dummy import Pool as ThreadPool
-from typing import List
+from pathlib import Path
+from threading import Event, Lock, local
+from typing import Dict, List, Optional
 
-from boto3.exceptions import S3UploadFailedError
+from boto3.s3.transfer import TransferConfig
+from botocore.exceptions import ClientError
+from s3transfer.manager import TransferManager
+from s3transfer.subscribers import BaseSubscriber
 
 from taskcat._logger import PrintMsg
+from taskcat._path_matcher import PathMatcher
 from taskcat.exceptions import TaskCatException
 
 LOG = logging.getLogger(__name__)
 
+CHUNK_SIZE = 8 * 1024 * 1024
+MULTIPART_THRESHOLD = CHUNK_SIZE
+# S3's limits on multipart uploads, larger files are uploaded in larger parts
+MIN_CHUNK_SIZE = 5 * 1024 * 1024
+MAX_CHUNK_SIZE = 5 * 1024 * 1024 * 1024
+MAX_PARTS = 10000
+TRANSFER_CONCURRENCY = 16
+UPLOAD_RETRIES = 5
+HASH_CACHE_PATH = Path(".taskcat/s3_hash_cache.json")
+HASH_THREADS = min(8, os.cpu_count() or 1)
+
+
+def create_transfer_config(
+    concurrency=None,
+    multipart_threshold=None,
+    multipart_chunksize=None,
+    max_bandwidth=None,
+) -> TransferConfig:
+    """returns the settings for S3Sync's transfer manager. concurrency is the total
+    number of concurrent requests for a sync, and max_bandwidth an optional cap on
+    upload throughput in bytes per second"""
+    chunk_size = multipart_chunksize or CHUNK_SIZE
+    # etags are calculated using the chunk size, so it must not need adjusting
+    if not MIN_CHUNK_SIZE <= chunk_size <= MAX_CHUNK_SIZE:
+        raise TaskCatException(
+            f"multipart chunk size must be between {MIN_CHUNK_SIZE} and "
+            f"{MAX_CHUNK_SIZE} bytes"
+        )
+    kwargs = {"max_bandwidth": max_bandwidth} if max_bandwidth else {}
+    return TransferConfig(
+        max_concurrency=concurrency or TRANSFER_CONCURRENCY,
+        multipart_threshold=multipart_threshold or MULTIPART_THRESHOLD,
+        multipart_chunksize=chunk_size,
+        **kwargs,
+    )
+
+
+@dataclass
+class SyncStats:
+    """what a sync transferred, reported once it completes"""
+
+    uploaded: int = 0
+    uploaded_bytes: int = 0
+    copied: int = 0
+    deleted: int = 0
+    retries: int = 0
+    latencies: List[float] = field(default_factory=list)
+    elapsed: float = 0.0
+
 
 class S3Sync:
     """Syncronizes local project files with S3 based on checksums.
 
-    Excludes hidden files, unpackaged lambda source and taskcat /ci/ files.
+    Excludes hidden files, unpackaged lambda source and taskcat /ci/ files, along
+    with any gitignore style patterns in the project's .taskcatignore file.
     Uses the Etag as an md5 which introduces the following limitations
         * Uses undocumented etag algorithm for multipart uploads
         * Does not work wil files uploaded in the console that use SSE encryption
@@ -26,104 +84,338 @@ class S3Sync:
           https://docs.aws.amazon.com/AmazonS3/latest/API/RESTCommonResponseHeaders.html
           for more info
     Does not support buckets with versioning enabled
+
+    After each sync a manifest of the etag and size of every object under the prefix
+    is written to the bucket, so that later syncs can read it instead of listing the
+    whole prefix. The manifest is deleted before the prefix is modified, and is
+    checked against the first page of a listing before it is used.
     """
 
-    # TODO: better exclusions that support path wildcards, eg. "*/.git/*"
-    exclude_files = [".*", "*.md"]
-    exclude_path_prefixes = [
-        "lambda_functions/source/",
-        "functions/source/",
-        ".",
-        "venv/",
-        "taskcat_outputs/",
+    # gitignore style patterns, excluded directories are not walked
+    exclude_patterns = [
+        ".*",
+        "*.md",
+        "/lambda_functions/source/",
+        "/functions/source/",
+        "/venv/",
+        "/taskcat_outputs/",
     ]
+    ignore_file = ".taskcatignore"
 
     exclude_remote_path_prefixes: List[str] = []
 
-    def __init__(self, s3_client, bucket, prefix, path, acl="private"):
+    manifest_key = ".taskcat_manifest.json"
+    MANIFEST_VERSION = 1
+    PLAN_VERSION = 1
+
+    # pylint: disable=too-many-arguments
+    def __init__(
+        self,
+        s3_client,
+        bucket,
+        prefix,
+        path,
+        acl="private",
+        hash_cache=True,
+        file_list=None,
+        transfer_config=None,
+        copy_source=None,
+        dry_run=False,
+        plan=None,
+    ):  # pylint: disable=too-many-locals
         """Syncronizes local file system with an s3 bucket/prefix
 
+        If hash_cache is enabled, checksums are only calculated for files that have
+        changed size, mtime or inode since the last sync of this path. To sync the
+        same path to several buckets, a FileHashCache and the file_list from
+        _get_local_file_list can be passed in, so that the path is only walked and
+        hashed once. The FileHashCache must use the same chunk size and threshold
+        as the transfer_config.
+
+        Uploads and copies share a single transfer manager, so transfer_config bounds
+        the total number of concurrent requests.
+
+        If copy_source is the name of a bucket that has already been synced with the
+        same path and prefix, changed files are copied from it within S3 rather than
+        uploaded. If the copy is not allowed (eg. the bucket's credentials cannot
+        read the source bucket) the remaining files are uploaded instead.
+
+        With dry_run, the bucket is not modified, and the changes a sync would make
+        are stored in self.plan. A plan can be applied later by passing it in as
+        plan, which uploads and deletes the planned files without walking, hashing or
+        listing again. As the plan does not include unchanged objects, the manifest
+        is removed rather than rewritten, and the next sync lists the prefix
         """
         if prefix != "" and not prefix.endswith("/"):
             prefix = prefix + "/"
         self.s3_client = s3_client
-        file_list = self._get_local_file_list(path)
-        s3_file_list = self._get_s3_file_list(bucket, prefix)
-        self._sync(file_list, s3_file_list, bucket, prefix, acl=acl)
+        self.transfer_config = transfer_config or create_transfer_config()
+        self.copy_source = copy_source
+        self.stats = SyncStats()
+        self._manifest_exists = False
+        self._manifest_stale = False
+        self.plan = None
+        start = time.time()
+        if plan is not None:
+            self._apply_plan(plan, bucket, prefix, acl)
+            self.stats.elapsed = time.time() - start
+            self._log_summary(bucket, prefix)
+            return
+        cache = hash_cache
+        if hash_cache is True:
+            cache = FileHashCache(
+                Path(path).expanduser().resolve() / HASH_CACHE_PATH,
+                self.transfer_config.multipart_chunksize,
+                self.transfer_config.multipart_threshold,
+            )
+        # checksums are calculated while syncing, so that uploads start as soon as
+        # the first changed file is found
+        if file_list is None:
+            file_list = self._get_local_file_list(path, include_checksums=False)
+        else:
+            file_list = {relpath: list(item) for relpath, item in file_list.items()}
+        s3_objects = self._get_remote_objects(bucket, prefix)
+        s3_file_list = {relpath: obj[0] for relpath, obj in s3_objects.items()}
+        if dry_run:
+            self.plan = self._plan(
+                file_list, s3_file_list, bucket, prefix, acl, hash_cache=cache or None
+            )
+        else:
+            self._sync(
+                file_list,
+                s3_file_list,
+                bucket,
+                prefix,
+                acl=acl,
+                hash_cache=cache or None,
+            )
+            if self._manifest_stale:
+                self._put_manifest(bucket, prefix, file_list, s3_objects)
+        if hash_cache is True:
+            cache.save()
+        self.stats.elapsed = time.time() - start
+        if dry_run:
+            self._log_plan(bucket, prefix)
+        else:
+            self._log_summary(bucket, prefix)
 
-    @staticmethod
-    def _hash_file(file_path, chunk_size=8 * 1024 * 1024):
+    def _log_plan(self, bucket, prefix):
+        LOG.info(
+            f"s3://{bucket}/{prefix} planned in {self.stats.elapsed:.1f}s, upload "
+            f"{len(self.plan['upload'])} files "
+            f"({self.plan['upload_bytes'] / 1024 / 1024:.1f} MiB), delete "
+            f"{len(self.plan['delete'])}, unchanged {self.plan['unchanged']} files "
+            f"({self.plan['unchanged_bytes'] / 1024 / 1024:.1f} MiB)"
+        )
+
+    def _log_summary(self, bucket, prefix):
+        stats = self.stats
+        mib = stats.uploaded_bytes / 1024 / 1024
+        rate = mib / max(stats.elapsed, 0.001)
+        summary = (
+            f"s3://{bucket}/{prefix} synced in {stats.elapsed:.1f}s, uploaded "
+            f"{stats.uploaded} files ({mib:.1f} MiB, {rate:.1f} MiB/s), "
+            f"copied {stats.copied}, deleted {stats.deleted}, "
+            f"retried {stats.retries} times"
+        )
+        if stats.latencies:
+            latencies = sorted(stats.latencies)
+            summary += (
+                f", latency per file {latencies[len(latencies) // 2]:.2f}s median "
+                f"{latencies[-1]:.2f}s max"
+            )
+        LOG.info(summary)
+
+    _buffers = local()
+
+    @classmethod
+    def _hash_file(cls, file_path, chunk_size=CHUNK_SIZE, threshold=None):
         # This is a bit funky because of the way multipart upload etags are done, they
         # are a md5 of the md5's from each part with the number of parts appended
         # credit to hyperknot https://github.com/aws/aws-cli/issues/2585#issue-226758933
-        md5s = []
-
-        with open(file_path, "rb") as file_handle:
-            while True:
-                data = file_handle.read(chunk_size)
-                if not data:
-                    break
-                md5s.append(hashlib.md5(data))  # nosec
+        # files of at least the threshold are uploaded in parts, as in s3transfer
+        with open(file_path, "rb", buffering=0) as file_handle:
+            size = os.fstat(file_handle.fileno()).st_size
+            multipart = size >= (threshold or chunk_size)
+            if size > chunk_size:
+                part_size = cls._part_size(chunk_size, size) if multipart else size
+                md5s = cls._hash_mapped(file_handle, part_size)
+            else:
+                md5s = cls._hash_buffered(file_handle, chunk_size)
 
-        if len(md5s) == 1:
+        if not multipart:
             return '"{}"'.format(md5s[0].hexdigest())
 
         digests = b"".join(m.digest() for m in md5s)
         digests_md5 = hashlib.md5(digests)  # nosec
         return '"{}-{}"'.format(digests_md5.hexdigest(), len(md5s))
 
+    @staticmethod
+    def _part_size(chunk_size, size):
+        while size > chunk_size * MAX_PARTS:
+            chunk_size *= 2
+        return chunk_size
+
+    @staticmethod
+    def _hash_mapped(file_handle, chunk_size):
+        # large files are hashed from a memory map, so chunks are never copied
+        md5s = []
+        with mmap.mmap(file_handle.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            view = memoryview(mapped)
+            try:
+                for offset in range(0, len(mapped), chunk_size):
+                    md5s.append(
+                        hashlib.md5(view[offset : offset + chunk_size])
+                    )  # nosec
+            finally:
+                view.release()
+        return md5s
+
+    @classmethod
+    def _hash_buffered(cls, file_handle, chunk_size):
+        # small files are read into a buffer re-used by each thread
+        buffer = getattr(cls._buffers, "buffer", None)
+        if buffer is None or len(buffer) != chunk_size:
+            buffer = cls._buffers.buffer = bytearray(chunk_size)
+        view = memoryview(buffer)
+        size = 0
+        while size < chunk_size:
+            read = file_handle.readinto(view[size:])
+            if not read:
+                break
+            size += read
+        return [hashlib.md5(view[:size])]  # nosec
+
     # TODO: refactor
+    @classmethod
     def _get_local_file_list(
-        self, path, include_checksums=True
+        cls, path, include_checksums=True, hash_cache=None
     ):  # pylint: disable=too-many-locals
         file_list = {}
         # get absolute local path
         path = os.path.abspath(os.path.expanduser(path))
+        matcher = cls._exclude_matcher(path)
         # recurse through directories
-        for root, _, files in os.walk(path):
+        for root, dirs, files in os.walk(path):
             relpath = os.path.relpath(root, path) + "/"
-            exclude_path = False
             # relative path should be blank if there are no sub directories
             if relpath == "./":
                 relpath = ""
-            # exclude defined paths
-            for prefix in S3Sync.exclude_path_prefixes:
-                if relpath.startswith(prefix):
-                    exclude_path = True
-                    break
-            if not exclude_path:
-                file_list.update(
-                    self._iterate_files(files, root, include_checksums, relpath)
-                )
+            # prune excluded directories, so that they are not walked
+            dirs[:] = [d for d in dirs if not matcher.match(relpath + d, is_dir=True)]
+            files = [f for f in files if not matcher.match(relpath + f)]
+            file_list.update(
+                cls._iterate_files(files, root, include_checksums, relpath, hash_cache)
+            )
         return file_list
 
-    def _iterate_files(self, files, root, include_checksums, relpath):
+    @classmethod
+    def _exclude_matcher(cls, path) -> PathMatcher:
+        matcher = PathMatcher(cls.exclude_patterns)
+        matcher.add_file(Path(path) / cls.ignore_file)
+        return matcher
+
+    @classmethod
+    def _iterate_files(
+        cls, files, root, include_checksums, relpath, hash_cache=None
+    ):  # pylint: disable=too-many-arguments
         file_list = {}
         for file in files:
-            exclude = False
-            # exclude defined filename patterns
-            for pattern in S3Sync.exclude_files:
-                if fnmatch.fnmatch(file, pattern):
-                    exclude = True
-                    break
-            if not exclude:
-                full_path = root + "/" + file
-                if include_checksums:
-                    # get checksum
-                    checksum = self._hash_file(full_path)
-                else:
-                    checksum = ""
-                file_list[relpath + file] = [full_path, checksum]
+            full_path = root + "/" + file
+            if include_checksums and hash_cache:
+                checksum = hash_cache.etag(full_path)
+            elif include_checksums:
+                # get checksum
+                checksum = cls._hash_file(full_path)
+            else:
+                checksum = ""
+            file_list[relpath + file] = [full_path, checksum]
         return file_list
 
-    def _get_s3_file_list(self, bucket, prefix):
+    def _get_remote_objects(self, bucket, prefix):
+        """returns the etag and size of each object under the prefix, from the
+        manifest if the first page of the listing matches it, otherwise from a full
+        listing"""
+        manifest = self._get_manifest(bucket, prefix)
+        first_page = None
+        if manifest is not None:
+            self._manifest_exists = True
+            first_page = self.s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
+            if self._manifest_consistent(manifest, first_page, prefix):
+                return manifest
+            LOG.debug(f"s3://{bucket}/{prefix}{self.manifest_key} is stale")
+        self._manifest_stale = True
+        return self._get_s3_file_list(bucket, prefix, first_page)
+
+    def _get_manifest(self, bucket, prefix):
+        try:
+            resp = self.s3_client.get_object(
+                Bucket=bucket, Key=prefix + self.manifest_key
+            )
+            manifest = json.loads(resp["Body"].read())
+        except ClientError as e:
+            LOG.debug(f"no manifest in s3://{bucket}/{prefix} {e}")
+            return None
+        except ValueError:
+            LOG.debug(f"ignoring invalid manifest in s3://{bucket}/{prefix}")
+            return None
+        if manifest.get("version") != self.MANIFEST_VERSION:
+            return None
+        return manifest["files"]
+
+    def _manifest_consistent(self, manifest, page, prefix):
+        # keys are listed in order, so the manifest should match the listing up to
+        # the last key on the page
+        listed = self._page_objects(page, prefix)
+        if "NextContinuationToken" in page and listed:
+            last = max(listed)
+            manifest = {k: v for k, v in manifest.items() if k <= last}
+        return listed == manifest
+
+    def _invalidate_manifest(self, bucket, prefix):
+        """deletes the manifest before the prefix is modified, so that it is never
+        used if the sync fails"""
+        self._manifest_stale = True
+        if self._manifest_exists:
+            self._manifest_exists = False
+            self.s3_client.delete_object(Bucket=bucket, Key=prefix + self.manifest_key)
+
+    def _put_manifest(self, bucket, prefix, local_list, s3_objects):
+        files = {
+            relpath: obj
+            for relpath, obj in s3_objects.items()
+            if relpath not in local_list and self._exclude_remote(relpath)
+        }
+        for relpath, (full_path, checksum) in local_list.items():
+            files[relpath] = [checksum, os.path.getsize(full_path)]
+        manifest = {"version": self.MANIFEST_VERSION, "files": files}
+        self.s3_client.put_object(
+            Bucket=bucket,
+            Key=prefix + self.manifest_key,
+            Body=json.dumps(manifest, separators=(",", ":")).encode(),
+            ContentType="application/json",
+        )
+
+    def _page_objects(self, resp, prefix):
+        objects = {}
+        for file in resp.get("Contents", []):
+            if file["Key"] == prefix + self.manifest_key:
+                continue
+            # strip the prefix from the path
+            objects[file["Key"][len(prefix) :]] = [file["ETag"], file["Size"]]
+        return objects
+
+    def _get_s3_file_list(self, bucket, prefix, first_page=None):
         objects = {}
         is_paginated = True
         continuation_token = None
         # While there are more results, fetch them from S3
         while is_paginated:
+            # the first page may already have been fetched to check the manifest
+            if first_page is not None:
+                resp, first_page = first_page, None
             # if there's no token, this is the initial list_objects call
-            if not continuation_token:
+            elif not continuation_token:
                 resp = self.s3_client.list_objects_v2(Bucket=bucket, Prefix=prefix)
             # this is a query to get additional pages, add continuation token to get
             # next page
@@ -131,11 +423,7 @@ class S3Sync:
                 resp = self.s3_client.list_objects_v2(
                     Bucket=bucket, Prefix=prefix, ContinuationToken=continuation_token
                 )
-            if "Contents" in resp:
-                for file in resp["Contents"]:
-                    # strip the prefix from the path
-                    relpath = file["Key"][len(prefix) :]
-                    objects[relpath] = file["ETag"]
+            objects.update(self._page_objects(resp, prefix))
             if "NextContinuationToken" in resp.keys():
                 continuation_token = resp["NextContinuationToken"]
             # If there's no toke in the response we've fetched all the objects
@@ -154,17 +442,120 @@ class S3Sync:
 
     # TODO: refactor
     def _sync(
-        self, local_list, s3_list, bucket, prefix, acl, threads=16
-    ):  # pylint: disable=too-many-locals
+        self, local_list, s3_list, bucket, prefix, acl, hash_cache=None
+    ):  # pylint: disable=too-many-arguments
+        self._delete(self._removed(local_list, s3_list), bucket, prefix)
+        hash_pool = ThreadPool(HASH_THREADS)
+        transfers = []
+        try:
+            with TransferManager(self.s3_client, self.transfer_config) as manager:
+                for local_file in self._changed(
+                    local_list, s3_list, hash_pool, hash_cache
+                ):
+                    if not transfers:
+                        self._invalidate_manifest(bucket, prefix)
+                    transfer = _Transfer(
+                        [local_list[local_file][0], bucket, local_file],
+                        copy=bool(self.copy_source),
+                    )
+                    self._submit(manager, transfer, prefix, acl)
+                    transfers.append(transfer)
+                for transfer in transfers:
+                    self._wait(manager, transfer, prefix, acl)
+        finally:
+            hash_pool.close()
+            hash_pool.join()
+
+    def _plan(
+        self, local_list, s3_list, bucket, prefix, acl, hash_cache=None
+    ):  # pylint: disable=too-many-arguments
+        """returns the changes _sync would make, without modifying the bucket"""
+        hash_pool = ThreadPool(HASH_THREADS)
+        try:
+            changed = set(self._changed(local_list, s3_list, hash_pool, hash_cache))
+        finally:
+            hash_pool.close()
+            hash_pool.join()
+        upload, unchanged, unchanged_bytes = self._compare(local_list, changed)
+        return {
+            "version": self.PLAN_VERSION,
+            "bucket": bucket,
+            "prefix": prefix,
+            "acl": acl,
+            "copy_source": self.copy_source,
+            "upload": upload,
+            "upload_bytes": sum(item[2] for item in upload.values()),
+            "delete": self._removed(local_list, s3_list),
+            "unchanged": unchanged,
+            "unchanged_bytes": unchanged_bytes,
+        }
+
+    @staticmethod
+    def _compare(local_list, changed):
+        """returns the changed files to upload, with their sizes, and the number and
+        total size of the unchanged ones"""
+        upload = {}
+        unchanged = unchanged_bytes = 0
+        for relpath, (full_path, checksum) in local_list.items():
+            size = os.path.getsize(full_path)
+            if relpath in changed:
+                upload[relpath] = [full_path, checksum, size]
+            else:
+                unchanged += 1
+                unchanged_bytes += size
+        return upload, unchanged, unchanged_bytes
+
+    def _apply_plan(self, plan, bucket, prefix, acl):
+        if (
+            plan.get("version") != self.PLAN_VERSION
+            or plan["bucket"] != bucket
+            or plan["prefix"] != prefix
+        ):
+            raise TaskCatException(f"sync plan is not for s3://{bucket}/{prefix}")
+        if plan["upload"] or plan["delete"]:
+            # a manifest may exist, and can't be rewritten from the plan
+            self._manifest_exists = True
+            self._invalidate_manifest(bucket, prefix)
+        self._delete(plan["delete"], bucket, prefix)
+        uploads = {
+            relpath: [full_path, checksum]
+            for relpath, (full_path, checksum, _) in plan["upload"].items()
+        }
+        self._sync(uploads, {}, bucket, prefix, acl)
+
+    def _changed(self, local_list, s3_list, hash_pool, hash_cache=None):
+        """hashes files in parallel, yielding each as soon as it's found to differ"""
+        hash_func = partial(
+            self._checksum,
+            hash_cache=hash_cache,
+            chunk_size=self.transfer_config.multipart_chunksize,
+            threshold=self.transfer_config.multipart_threshold,
+        )
+        for local_file, checksum in hash_pool.imap_unordered(
+            hash_func, local_list.items()
+        ):
+            local_list[local_file][1] = checksum
+            # If file is not present in S3, or checksum is different
+            if s3_list.get(local_file) != checksum:
+                yield local_file
+
+    def _removed(self, local_list, s3_list):
         # determine which files to remove from S3
-        remove_from_s3 = []
-        for s3_file in s3_list.keys():
-            if s3_file not in local_list.keys() and not self._exclude_remote(s3_file):
-                LOG.info(
-                    f"s3://{bucket}/{prefix + prefix + s3_file}",
-                    extra={"nametag": PrintMsg.S3DELETE},
-                )
-                remove_from_s3.append({"Key": prefix + s3_file})
+        return [
+            s3_file
+            for s3_file in s3_list.keys()
+            if s3_file not in local_list.keys() and not self._exclude_remote(s3_file)
+        ]
+
+    def _delete(self, removed, bucket, prefix):
+        for s3_file in removed:
+            LOG.info(
+                f"s3://{bucket}/{prefix + prefix + s3_file}",
+                extra={"nametag": PrintMsg.S3DELETE},
+            )
+        remove_from_s3 = [{"Key": prefix + s3_file} for s3_file in removed]
+        if remove_from_s3:
+            self._invalidate_manifest(bucket, prefix)
         # deleting objects, max 1k objects per s3 delete_objects call
         for objects in [
             remove_from_s3[i : i + 1000] for i in range(0, len(remove_from_s3), 1000)
@@ -176,50 +567,189 @@ class S3Sync:
                 for error in response["Errors"]:
                     LOG.error("S3 delete error: %s" % str(error))
                 raise TaskCatException("Failed to delete one or more files from S3")
-        # build list of files to upload
-        upload_to_s3 = []
-        for local_file in local_list:
-            upload = False
-            # If file is not present in S3
-            if local_file not in s3_list.keys():
-                upload = True
-            # If checksum is different
-            elif local_list[local_file][1] != s3_list[local_file]:
-                upload = True
-            if upload:
-                absolute_path = local_list[local_file][0]
-                s3_path = local_file
-                upload_to_s3.append([absolute_path, bucket, s3_path])
-        # multithread the uploading of files
-        pool = ThreadPool(threads)
-        func = partial(
-            self._s3_upload_file, prefix=prefix, s3_client=self.s3_client, acl=acl
-        )
-        pool.map(func, upload_to_s3)
-        pool.close()
-        pool.join()
+            self.stats.deleted += len(objects)
 
-    @staticmethod
-    def _s3_upload_file(paths, prefix, s3_client, acl):
-        local_filename, bucket, s3_path = paths
-        retry = 0
-        # backoff and retry
-        while retry < 5:
+    @classmethod
+    def _checksum(cls, item, hash_cache=None, chunk_size=CHUNK_SIZE, threshold=None):
+        local_file, (full_path, checksum) = item
+        if not checksum:
+            if hash_cache:
+                checksum = hash_cache.etag(full_path)
+            else:
+                checksum = cls._hash_file(full_path, chunk_size, threshold)
+        return local_file, checksum
+
+    def _submit(self, manager, transfer, prefix, acl):
+        local_filename, bucket, s3_path = transfer.paths
+        key = prefix + s3_path
+        if transfer.copy:
             LOG.info(
-                f"s3://{bucket}/{prefix + s3_path}", extra={"nametag": PrintMsg.S3}
+                f"s3://{self.copy_source}/{key} -> s3://{bucket}/{key}",
+                extra={"nametag": PrintMsg.S3},
+            )
+            # copies use the same part size as uploads, so that etags remain
+            # comparable with local checksums
+            transfer.future = manager.copy(
+                {"Bucket": self.copy_source, "Key": key},
+                bucket,
+                key,
+                extra_args={"ACL": acl},
+                subscribers=[transfer],
+            )
+        else:
+            LOG.info(f"s3://{bucket}/{key}", extra={"nametag": PrintMsg.S3})
+            transfer.future = manager.upload(
+                local_filename,
+                bucket,
+                key,
+                extra_args={"ACL": acl},
+                subscribers=[transfer],
             )
+
+    def _wait(self, manager, transfer, prefix, acl):
+        """waits for a transfer, falling back to uploading if a copy fails and
+        retrying failed uploads with backoff"""
+        while True:
             try:
-                s3_client.upload_file(
-                    local_filename, bucket, prefix + s3_path, ExtraArgs={"ACL": acl}
-                )
+                transfer.future.result()
                 break
             except Exception as e:  # pylint: disable=broad-except
-                retry += 1
-                LOG.error("S3 upload error: %s" % e)
-                # give up if we've exhausted retries, or if the error is not-retryable
-                # ie. AccessDenied
-                if retry == 5 or (
-                    isinstance(e, S3UploadFailedError) and "(AccessDenied)" in str(e)
-                ):
-                    raise TaskCatException("Failed to upload to S3")
-                time.sleep(retry * 2)
+                if transfer.copy:
+                    transfer.copy = False
+                    if self.copy_source:
+                        self.copy_source = None
+                        LOG.warning(
+                            f"cannot copy to s3://{transfer.paths[1]}, uploading "
+                            f"local files instead: {e}"
+                        )
+                else:
+                    transfer.retries += 1
+                    self.stats.retries += 1
+                    LOG.error("S3 upload error: %s" % e)
+                    # give up if we've exhausted retries, or if the error is
+                    # not-retryable ie. AccessDenied
+                    access_denied = (
+                        isinstance(e, ClientError)
+                        and getattr(e, "response", {}).get("Error", {}).get("Code")
+                        == "AccessDenied"
+                    )
+                    if transfer.retries == UPLOAD_RETRIES or access_denied:
+                        raise TaskCatException("Failed to upload to S3")
+                    time.sleep(transfer.retries * 2)
+                self._submit(manager, transfer, prefix, acl)
+        self.stats.latencies.append(transfer.latency)
+        if transfer.copy:
+            self.stats.copied += 1
+        else:
+            self.stats.uploaded += 1
+            self.stats.uploaded_bytes += os.path.getsize(transfer.paths[0])
+
+
+class _Transfer(BaseSubscriber):
+    """a file's upload or copy, through any retries"""
+
+    def __init__(self, paths, copy):
+        self.paths = paths
+        self.copy = copy
+        self.retries = 0
+        self.future = None
+        self.started = time.time()
+        self.latency = 0.0
+
+    def on_done(self, future, **kwargs):
+        self.latency = time.time() - self.started
+
+
+class FileHashCache:
+    """persists the checksums calculated by S3Sync, keyed by path, size, mtime and
+    inode, so that unchanged files are not re-read on every sync. Entries are kept
+    per chunk size and multipart threshold, as they change the etag"""
+
+    VERSION = 2
+    # files modified this recently may be modified again without their mtime
+    # changing, so are not cached
+    RACY_SECONDS = 2
+
+    def __init__(
+        self,
+        cache_path: Path,
+        chunk_size: int = CHUNK_SIZE,
+        threshold: Optional[int] = None,
+    ):
+        self.cache_path = cache_path
+        self.chunk_size = chunk_size
+        self.threshold = threshold or chunk_size
+        self._lock = Lock()
+        self._entries: Dict[str, list] = self._load()
+        self._seen: Dict[str, list] = {}
+        self._computed: Dict[str, list] = {}
+        self._pending: Dict[str, Event] = {}
+        self._changed = False
+
+    def _load(self) -> Dict[str, list]:
+        try:
+            with open(str(self.cache_path), "r") as file_handle:
+                cached = json.load(file_handle)
+        except FileNotFoundError:
+            return {}
+        except ValueError:
+            LOG.debug(f"ignoring invalid hash cache {self.cache_path}")
+            return {}
+        if cached.get("version") != self.VERSION:
+            return {}
+        return cached["files"].get(self._settings_key, {})
+
+    @property
+    def _settings_key(self):
+        return f"{self.chunk_size}:{self.threshold}"
+
+    def etag(self, file_path: str) -> str:
+        """returns the etag of a file, if several threads (eg. syncing different
+        buckets) ask for the same file at once, it is only hashed once"""
+        stat = os.stat(file_path)
+        key = [stat.st_size, stat.st_mtime_ns, stat.st_ino]
+        with self._lock:
+            entry = self._computed.get(file_path) or self._entries.get(file_path)
+            hit = bool(entry) and entry[:3] == key
+            pending = None if hit else self._pending.get(file_path)
+            if not hit and not pending:
+                self._pending[file_path] = Event()
+        if pending:
+            pending.wait()
+            return self.etag(file_path)
+        if hit:
+            etag = entry[3]
+        else:
+            try:
+                etag = S3Sync._hash_file(  # pylint: disable=protected-access
+                    file_path, self.chunk_size, self.threshold
+                )
+                with self._lock:
+                    self._computed[file_path] = key + [etag]
+            finally:
+                with self._lock:
+                    self._pending.pop(file_path).set()
+        with self._lock:
+            self._changed = self._changed or not hit
+            if time.time() - stat.st_mtime > self.RACY_SECONDS:
+                self._seen[file_path] = key + [etag]
+        return etag
+
+    def save(self) -> None:
+        """writes the entries used by this sync, dropping any for files that no
+        longer exist or were not synced"""
+        with self._lock:
+            if not self._changed and len(self._seen) == len(self._entries):
+                return
+            cached = {
+                "version": self.VERSION,
+                "files": {self._settings_key: self._seen},
+            }
+        tmp_path = self.cache_path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            self.cache_path.parent.mkdir(parents=True, exist_ok=True)
+            with open(str(tmp_path), "w") as file_handle:
+                json.dump(cached, file_handle)
+            os.replace(str(tmp_path), str(self.cache_path))
+        except OSError as e:
+            LOG.debug(f"failed to write hash cache {self.cache_path} {e}")
@@ -0,0 +1,121 @@
+import logging
+import os
+import re
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Pattern, Set, Tuple
+
+from taskcat._cfn.template import Template
+
+LOG = logging.getLogger(__name__)
+
+VARIABLE = re.compile(r"\$\{[^}]*\}")
+URL_PREFIX = re.compile(r"^[a-zA-Z][a-zA-Z0-9+.-]*://[^/]*/")
+
+
+def reference_key(relpath: str) -> str:
+    """the key templates use to refer to a file, relative to the root of the project
+    or submodule containing it"""
+    parts = relpath.split("/")
+    while len(parts) > 2 and parts[0] == "submodules":
+        parts = parts[2:]
+    return "/".join(parts)
+
+
+class StageClosure:
+    """the files of a project that the tests' templates refer to, so that only those
+    need to be staged.
+
+    A template refers to a file if any of its strings ends with the file's key, eg.
+    a `TemplateURL`, a lambda `Code.S3Key` or a script URL in `UserData`. In
+    `Fn::Sub` strings, variables may stand for any part of the key (eg. the key
+    prefix or a lambda function's name), so `${KeyPrefix}functions/packages/${Name}/`
+    refers to every file under `functions/packages`. All nested templates are
+    included."""
+
+    def __init__(self, templates: Dict[str, Template], project_root: Path):
+        self.project_root = Path(project_root).expanduser().resolve()
+        nested = {
+            t
+            for template in templates.values()
+            for t in [template] + template.descendents
+        }
+        self.templates: Set[str] = {
+            Path(
+                os.path.relpath(str(t.template_path), str(self.project_root))
+            ).as_posix()
+            for t in nested
+        }
+        self._keys: Set[str] = set()
+        patterns: Set[str] = set()
+        for template in nested:
+            for string in self._strings(template.template):
+                keys, key_patterns = self._key_patterns(string)
+                self._keys.update(keys)
+                patterns.update(key_patterns)
+        # most references have no variables, so are looked up rather than matched
+        self._regex: Optional[Pattern] = (
+            re.compile("|".join(sorted(patterns))) if patterns else None
+        )
+
+    def filter(self, file_list: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """returns the files from an S3Sync file list that are in the closure"""
+        closure = {
+            relpath: item
+            for relpath, item in file_list.items()
+            if self.referenced(relpath)
+        }
+        LOG.info(
+            f"staging {len(closure)} of {len(file_list)} files referenced by the "
+            f"tested templates"
+        )
+        return closure
+
+    def referenced(self, relpath: str) -> bool:
+        if relpath in self.templates:
+            return True
+        for key in {relpath, reference_key(relpath)}:
+            if key in self._keys:
+                return True
+            if self._regex and self._regex.fullmatch(key):
+                return True
+        return False
+
+    @classmethod
+    def _strings(cls, node) -> Iterator[str]:
+        if isinstance(node, str):
+            yield node
+        elif isinstance(node, dict):
+            for value in node.values():
+                yield from cls._strings(value)
+        elif isinstance(node, list):
+            for value in node:
+                yield from cls._strings(value)
+
+    @staticmethod
+    def _key_patterns(string: str) -> Tuple[Set[str], Set[str]]:
+        """the keys, and regexes for keys with variables, that a string may end with,
+        starting at the beginning of the string (after any URL scheme and host) or
+        after any "/" """
+        keys: Set[str] = set()
+        patterns: Set[str] = set()
+        if "/" not in string and "." not in string:
+            return keys, patterns
+        literals = VARIABLE.split(URL_PREFIX.sub("", string))
+        for index, literal in enumerate(literals):
+            starts = [0] if index == 0 else []
+            starts += [i + 1 for i, char in enumerate(literal) if char == "/"]
+            for start in starts:
+                rest = [literal[start:]] + literals[index + 1 :]
+                # a suffix of only variables and slashes would match any key
+                if not "".join(rest).strip("/"):
+                    continue
+                if not any("/" in part or "." in part for part in rest):
+                    continue
+                # a prefix refers to everything under it
+                prefix = rest[-1].endswith("/")
+                if len(rest) == 1 and not prefix:
+                    keys.add(rest[0])
+                    continue
+                pattern = ".*".join(re.escape(part) for part in rest)
+                patterns.add(pattern + ".*" if prefix else pattern)
+        return keys, patterns
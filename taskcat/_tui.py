@@ -1,5 +1,4 @@
 import logging
-import time
 
 from reprint import output
 from taskcat._cfn.threaded import Stacker as TaskcatStacker
@@ -17,12 +16,12 @@ class TerminalPrinter:
         with output(output_type=self._buffer_type) as output_buffer:
             return output_buffer
 
-    def report_test_progress(self, stacker: TaskcatStacker, poll_interval=10):
+    def report_test_progress(self, stacker: TaskcatStacker, poll_interval=None):
         _status_dict = stacker.status()
         while self._is_test_in_progress(_status_dict):
             for stack in stacker.stacks:
                 self._print_stack_tree(stack, buffer=self.buffer)
-            time.sleep(poll_interval)
+            stacker.wait_for_progress(timeout=poll_interval)
             self.buffer.clear()
             _status_dict = stacker.status()
 
@@ -0,0 +1,108 @@
+import unittest
+from datetime import timedelta
+
+import mock
+from taskcat._cfn.poller import StackPoller
+
+STACK_ID = (
+    "arn:aws:cloudformation:us-east-1:123456789012:stack/"
+    "SampleStack/e722ae60-fe62-11e8-9a0e-0ae8cc519968"
+)
+DELETED_STACK_ID = (
+    "arn:aws:cloudformation:us-east-1:123456789012:stack/"
+    "Deleted/e722ae60-fe62-11e8-9a0e-0ae8cc519969"
+)
+
+
+def make_paging(stacks):
+    class Paging:
+        @staticmethod
+        def paginate(**kwargs):
+            return [{"Stacks": stacks}]
+
+    return Paging()
+
+
+def make_stack(stack_id):
+    stack = mock.Mock()
+    stack.id = stack_id
+    return stack
+
+
+class TestStackPoller(unittest.TestCase):
+    def test_for_region(self):
+        region = mock.Mock()
+        region.profile = "test_profile"
+        region.name = "us-east-1"
+        poller = StackPoller.for_region(region)
+        self.assertIs(poller, StackPoller.for_region(region))
+        region.client.assert_called_once_with("cloudformation")
+        other = mock.Mock()
+        other.profile = "test_profile"
+        other.name = "us-west-2"
+        self.assertIsNot(poller, StackPoller.for_region(other))
+
+    @mock.patch("taskcat._cfn.poller.Thread")
+    def test_register(self, m_thread):
+        poller = StackPoller(mock.Mock())
+        self.assertEqual(poller.active, False)
+        stack = make_stack(STACK_ID)
+        poller.register(stack)
+        poller.register(stack)
+        self.assertEqual(poller.active, True)
+        m_thread.assert_called_once()
+        m_thread.return_value.start.assert_called_once()
+        poller.unregister(stack)
+        self.assertEqual(poller.active, False)
+
+    @mock.patch("taskcat._cfn.poller.Thread")
+    def test_poll(self, _):
+        client = mock.Mock()
+        stack_props = {"StackId": STACK_ID, "StackStatus": "CREATE_COMPLETE"}
+        client.get_paginator.return_value = make_paging(
+            [stack_props, {"StackId": "not-registered"}]
+        )
+        poller = StackPoller(client)
+        stack = make_stack(STACK_ID)
+        deleted = make_stack(DELETED_STACK_ID)
+        poller.register(stack)
+        poller.register(deleted)
+        subscriber = mock.Mock()
+        poller.subscribe(subscriber)
+        refreshed = poller.poll()
+        client.get_paginator.assert_called_once_with("describe_stacks")
+        stack.set_stack_properties.assert_called_once_with(stack_props)
+        deleted.set_stack_properties.assert_called_once_with()
+        subscriber.assert_called_once_with(refreshed)
+        self.assertEqual(2, len(refreshed))
+
+        subscriber.reset_mock()
+        poller.unsubscribe(subscriber)
+        poller.poll()
+        subscriber.assert_not_called()
+
+    def test_poll_no_stacks(self):
+        client = mock.Mock()
+        poller = StackPoller(client)
+        subscriber = mock.Mock()
+        poller.subscribe(subscriber)
+        self.assertEqual([], poller.poll())
+        client.get_paginator.assert_not_called()
+        subscriber.assert_called_once_with([])
+
+    @mock.patch("taskcat._cfn.poller.sleep")
+    def test_run_stops_when_idle(self, m_sleep):
+        client = mock.Mock()
+        client.get_paginator.return_value = make_paging([])
+        poller = StackPoller(client, interval=timedelta(seconds=1))
+        stack = make_stack(STACK_ID)
+        stack.set_stack_properties.side_effect = lambda *a: poller.unregister(stack)
+        poller._stacks[stack.id] = stack
+        subscriber = mock.Mock()
+        poller.subscribe(subscriber)
+        poller._run()
+        self.assertEqual(poller.active, False)
+        self.assertIsNone(poller._thread)
+        self.assertEqual(m_sleep.call_count, 2)
+        # subscribers are notified when polling stops, so waiters don't block
+        self.assertEqual(mock.call([]), subscriber.call_args_list[-1])
@@ -1,11 +1,12 @@
+import json
 import unittest
 import uuid
 from datetime import datetime
 from pathlib import Path
-from threading import Timer
 
 import mock
 from taskcat import Config
+from taskcat._cfn.poller import StackPoller
 from taskcat._cfn.stack import (
     Event,
     Events,
@@ -69,6 +70,7 @@ class TestEvent(unittest.TestCase):
         event_dict["ResourceStatusReason"] = "test_reason"
         event_dict["ResourceProperties"] = '{"test_prop_key": "test_value"}'
         event = Event(event_dict)
+        self.assertIsNone(event._properties)
         self.assertEqual(event.physical_id, "test_id")
         self.assertEqual(event.properties, {"test_prop_key": "test_value"})
         self.assertEqual(event.status_reason, "test_reason")
@@ -79,6 +81,23 @@ class TestEvent(unittest.TestCase):
         expected = "<Event object {} at {}>".format("test_event_id", hex(id(event)))
         self.assertEqual(expected, event.__repr__())
 
+    def test_compact(self):
+        first = Event(json.loads(json.dumps(event_template)))
+        second = Event(json.loads(json.dumps(event_template)))
+        self.assertFalse(hasattr(first, "__dict__"))
+        self.assertIs(first.status, second.status)
+        self.assertIs(first.type, second.type)
+        self.assertIs(first.stack_name, second.stack_name)
+        for obj in [
+            Resource("test_stack_id", resource_template),
+            Parameter({"ParameterKey": "test_key"}),
+            Output({"OutputKey": "test_key", "OutputValue": "test_value"}),
+            Tag({"Key": "my_key", "Value": "my_value"}),
+        ]:
+            self.assertFalse(hasattr(obj, "__dict__"))
+            with self.assertRaises(AttributeError):
+                obj.not_a_property = True
+
 
 class TestResource(unittest.TestCase):
     def test_resource(self):
@@ -166,57 +185,95 @@ class TestFilterableList(unittest.TestCase):
         filtered = tags.filter(key="my_key", value="my_value")
         self.assertEqual(filtered, tags)
 
+    def test_set_criteria(self):
+        tags = Tags([Tag({"Key": k, "Value": "v"}) for k in ["a", "b", "c", "b"]])
+        filtered = tags.filter(key={"b", "c"})
+        self.assertEqual(["b", "c", "b"], [t.key for t in filtered])
+        self.assertIsInstance(filtered, Tags)
+        filtered = tags.filter(value=frozenset(["v"]), key="a")
+        self.assertEqual(["a"], [t.key for t in filtered])
+        with self.assertRaises(ValueError):
+            tags.filter(invalid={"a"})
+
+    def test_indexes(self):
+        events = Events()
+        for status in ["CREATE_FAILED", "CREATE_COMPLETE", "DELETE_FAILED"]:
+            event = event_template.copy()
+            event["ResourceStatus"] = status
+            events.append(Event(event))
+        filtered = events.filter(status={"CREATE_FAILED", "DELETE_FAILED"})
+        self.assertEqual([events[0], events[2]], filtered)
+        self.assertIn("status", events._indexes)
+
+        # modifying the list discards stale indexes
+        event = event_template.copy()
+        event["ResourceStatus"] = "CREATE_FAILED"
+        events.insert(0, Event(event))
+        self.assertNotIn("_indexes", events.__dict__)
+        self.assertEqual(2, len(events.filter(status="CREATE_FAILED")))
+        events += [Event(event)]
+        self.assertEqual(3, len(events.filter(status="CREATE_FAILED")))
+        del events[0]
+        self.assertEqual(2, len(events.filter(status="CREATE_FAILED")))
+
+
+PARENT_ID = (
+    "arn:aws:cloudformation:us-east-1:123456789012:stack/"
+    "SampleStack/e722ae60-fe62-11e8-9a0e-0ae8cc519968"
+)
+CHILD_ID = (
+    "arn:aws:cloudformation:us-east-1:123456789012:stack/"
+    "Child/e722ae60-fe62-11e8-9a0e-0ae8cc519969"
+)
+GRANDCHILD_ID = (
+    "arn:aws:cloudformation:us-east-1:123456789012:stack/"
+    "GrandChild/e722ae60-fe62-11e8-9a0e-0ae8cc519970"
+)
+NESTED_STACKS = {PARENT_ID: CHILD_ID, CHILD_ID: GRANDCHILD_ID}
+
 
 def mock_client_method(*args, **kwargs):
     m_client = mock.Mock()
     if args[0] == "cloudformation":
-        m_client.create_stack.return_value = {
-            "StackId": "arn:aws:cloudformation:us-east-1:123456789012:stack/"
-            "SampleStack/e722ae60-fe62-11e8-9a0e-0ae8cc519968"
-        }
-        m_client.describe_stacks.return_value = {
-            "Stacks": [
-                {
-                    "Tags": [{"Key": "tag_key", "Value": "tag_value"}],
-                    "Parameters": [
-                        {"ParameterKey": "MyParam", "ParameterValue": "MyVal"}
-                    ],
-                    "Outputs": [
-                        {"OutputKey": "MyOutput", "OutputValue": "MyOutputValue"}
-                    ],
-                    "StackStatus": "CREATE_IN_PROGRESS",
-                }
-            ]
-        }
+        m_client.create_stack.return_value = {"StackId": PARENT_ID}
+
+        def describe_stacks(**kwargs):
+            stack = {
+                "Tags": [{"Key": "tag_key", "Value": "tag_value"}],
+                "Parameters": [{"ParameterKey": "MyParam", "ParameterValue": "MyVal"}],
+                "Outputs": [{"OutputKey": "MyOutput", "OutputValue": "MyOutputValue"}],
+                "StackStatus": "CREATE_IN_PROGRESS",
+            }
+            if "StackName" in kwargs:
+                stack["StackId"] = kwargs["StackName"]
+            return {"Stacks": [stack]}
+
+        m_client.describe_stacks.side_effect = describe_stacks
 
         class Paging:
             def __init__(self, api):
                 self._api = api
 
             def paginate(self, **kwargs):
-                if self._api == "describe_stacks":
-                    return [
+                if self._api == "list_stack_resources":
+                    resources = [
                         {
-                            "Stacks": [
-                                {
-                                    "StackId": "arn:aws:cloudformation:us-east-1:"
-                                    "123456789012:stack/Child/e722ae60-fe62-11e8-"
-                                    "9a0e-0ae8cc519969",
-                                    "ParentId": "arn:aws:cloudformation:us-east-1:"
-                                    "123456789012:stack/SampleStack/e722ae60-fe62-"
-                                    "11e8-9a0e-0ae8cc519968",
-                                },
-                                {
-                                    "StackId": "arn:aws:cloudformation:us-east-1:"
-                                    "123456789012:stack/GrandChild/e722ae60-fe62-11e8-"
-                                    "9a0e-0ae8cc519970",
-                                    "ParentId": "arn:aws:cloudformation:us-east-1:"
-                                    "123456789012:stack/Child/e722ae60-fe62-11e8-"
-                                    "9a0e-0ae8cc519969",
-                                },
-                            ]
+                            "LogicalResourceId": "MyBucket",
+                            "ResourceType": "AWS::S3::Bucket",
+                            "ResourceStatus": "CREATE_COMPLETE",
                         }
                     ]
+                    child_id = NESTED_STACKS.get(kwargs["StackName"])
+                    if child_id:
+                        resources.append(
+                            {
+                                "LogicalResourceId": "MyStack",
+                                "PhysicalResourceId": child_id,
+                                "ResourceType": "AWS::CloudFormation::Stack",
+                                "ResourceStatus": "CREATE_IN_PROGRESS",
+                            }
+                        )
+                    return [{"StackResourceSummaries": resources}]
                 raise NotImplementedError(self._api)
 
         m_client.get_paginator = Paging
@@ -272,13 +329,15 @@ class TestStack(unittest.TestCase):
         region = make_test_region_obj("us-west-2")
         template = make_test_template()
         stack = Stack.create(region, "stack_name", template)
-        self.assertIsInstance(stack._timer, Timer)
-        # disabled due to a concurrency issue with the tests
-        # self.assertEqual(stack._timer.is_alive(), True)
-        stack._timer.cancel()
+        self.assertIsInstance(stack._poller, StackPoller)
         m_s3_url_maker.assert_called_once()
         self.assertNotEquals(template, stack.template)
-        mock_template.assert_called_once()
+        # the region specific template is a view, not a re-parsed template
+        template.with_url.assert_called_once_with(
+            "https://test.s3.amazonaws.com/prefix/object"
+        )
+        self.assertEqual(template.with_url.return_value, stack.template)
+        mock_template.assert_not_called()
 
     @mock.patch(
         "taskcat._cfn.stack.s3_url_maker",
@@ -290,13 +349,11 @@ class TestStack(unittest.TestCase):
         region.client = mock_client_method
         m_template = make_test_template()
         stack = Stack.create(region, "stack_name", m_template)
-        stack._timer.cancel()
         no_outp = len(stack.outputs)
         no_params = len(stack.parameters)
         no_tags = len(stack.tags)
-        # re-invoke timer function manually to check for idempotence
+        # re-invoke poller callback manually to check for idempotence
         stack.set_stack_properties()
-        stack._timer.cancel()
         self.assertEqual(len(stack.outputs), no_outp)
         self.assertEqual(len(stack.parameters), no_params)
         self.assertEqual(len(stack.tags), no_tags)
@@ -319,7 +376,6 @@ class TestStack(unittest.TestCase):
             "test_test",
             mock.Mock(),
         )
-        stack._timer.cancel()
         self.assertEqual(stack.name, "SampleStack")
 
     @mock.patch(
@@ -335,7 +391,6 @@ class TestStack(unittest.TestCase):
         region = make_test_region_obj("us-west-2")
         m_template = make_test_template()
         stack = Stack.create(region, "stack_name", m_template)
-        stack._timer.cancel()
 
         m_prop.reset_mock()
         stack.refresh()
@@ -375,7 +430,6 @@ class TestStack(unittest.TestCase):
         region = make_test_region_obj("us-west-2")
         m_template = make_test_template()
         stack = Stack.create(region, "stack_name", m_template)
-        stack._timer.cancel()
         generic_evnt = event_template.copy()
         not_generic_evnt = event_template.copy()
         generic_evnt["ResourceStatusReason"] = "Resource creation cancelled"
@@ -402,7 +456,6 @@ class TestStack(unittest.TestCase):
         region = make_test_region_obj("us-west-2")
         m_template = make_test_template()
         stack = Stack.create(region, "stack_name", m_template)
-        stack._timer.cancel()
         stack.client = mock.Mock()
 
         class Paging:
@@ -425,6 +478,59 @@ class TestStack(unittest.TestCase):
         stack.client.get_paginator.assert_called_once()
         self.assertEqual(len(stack._events), 1)
 
+    @mock.patch(
+        "taskcat._cfn.stack.s3_url_maker",
+        return_value="https://test.s3.amazonaws.com/prefix/object",
+    )
+    @mock.patch("taskcat._cfn.stack.Template", return_value=make_test_template())
+    def test_fetch_stack_events_incremental(self, mock_template, _):
+        region = make_test_region_obj("us-west-2")
+        m_template = make_test_template()
+        stack = Stack.create(region, "stack_name", m_template)
+        stack.client = mock.Mock()
+        pages = []
+        requested = []
+
+        def make_event(event_id):
+            event = event_template.copy()
+            event["EventId"] = event_id
+            return event
+
+        class Paging:
+            @staticmethod
+            def paginate(**kwargs):
+                for page in pages:
+                    requested.append(page)
+                    yield page
+
+        stack.client.get_paginator.return_value = Paging()
+        pages[:] = [
+            {"StackEvents": [make_event("3"), make_event("2")]},
+            {"StackEvents": [make_event("1")]},
+        ]
+        stack._fetch_stack_events()
+        self.assertEqual(2, len(requested))
+        self.assertEqual(["3", "2", "1"], [e.event_id for e in stack._events])
+        self.assertEqual("3", stack.event_cursor)
+
+        old_events = list(stack._events)
+        requested.clear()
+        pages[:] = [
+            {"StackEvents": [make_event("5"), make_event("4"), make_event("3")]},
+            {"StackEvents": [make_event("2"), make_event("1")]},
+        ]
+        stack._fetch_stack_events()
+        self.assertEqual(["5", "4", "3", "2", "1"], [e.event_id for e in stack._events])
+        self.assertEqual(old_events, stack._events[2:])
+        # pages after the cursor should never be requested
+        self.assertEqual(1, len(requested))
+
+        stack._last_event_refresh = datetime.now()
+        since = stack.events(since="3")
+        self.assertEqual(["5", "4"], [e.event_id for e in since])
+        self.assertEqual([], stack.events(since="5"))
+        self.assertEqual(5, len(stack.events(since="unknown")))
+
     @mock.patch(
         "taskcat._cfn.stack.s3_url_maker",
         return_value="https://test.s3.amazonaws.com/prefix/object",
@@ -435,7 +541,6 @@ class TestStack(unittest.TestCase):
         region = make_test_region_obj("us-west-2")
         m_template = make_test_template()
         stack = Stack.create(region, "stack_name", m_template)
-        stack._timer.cancel()
         stack._resources = Resources([Resource("test_stack_id", resource_template)])
 
         stack.resources()
@@ -459,7 +564,6 @@ class TestStack(unittest.TestCase):
         region = make_test_region_obj("us-west-2")
         m_template = make_test_template()
         stack = Stack.create(region, "stack_name", m_template)
-        stack._timer.cancel()
         stack.client = mock.Mock()
 
         class Paging:
@@ -492,7 +596,6 @@ class TestStack(unittest.TestCase):
         region = make_test_region_obj("us-west-2")
         m_template = make_test_template()
         stack = Stack.create(region, "stack_name", m_template)
-        stack._timer.cancel()
         stack.client = mock.Mock()
 
         stack.refresh.reset_mock()
@@ -513,7 +616,6 @@ class TestStack(unittest.TestCase):
         )
         templates = c.get_templates(project_root=test_proj)
         stack = Stack.create(region, "stack_name", templates["taskcat-json"])
-        stack._timer.cancel()
 
         child = event_template.copy()
         grandchild = event_template.copy()
@@ -537,3 +639,20 @@ class TestStack(unittest.TestCase):
 
         desc = stack.descendants()
         self.assertEqual(len(desc), 2)
+        self.assertEqual(desc[0].id, CHILD_ID)
+        self.assertEqual(desc[1].id, GRANDCHILD_ID)
+        stack.client.describe_stacks.assert_any_call(StackName=CHILD_ID)
+
+        # known children are not described again when the tree is refreshed
+        describe_calls = stack.client.describe_stacks.call_count
+        desc = stack.descendants(refresh=True)
+        self.assertEqual(len(desc), 2)
+        self.assertEqual(describe_calls, stack.client.describe_stacks.call_count)
+
+        # children of settled stacks are not re-fetched
+        stack.status = "CREATE_COMPLETE"
+        stack.children(refresh=True)
+        with mock.patch.object(stack, "_fetch_children") as m_fetch:
+            stack._last_child_refresh = datetime.fromtimestamp(1)
+            stack.children()
+            m_fetch.assert_not_called()
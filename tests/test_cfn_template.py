@@ -1,7 +1,36 @@
+import os
 import unittest
 from pathlib import Path
+from shutil import copytree
+from tempfile import mkdtemp
 
+import cfnlint
+import cfnlint.core
+import mock
 from taskcat import Config
+from taskcat._cfn.template import (
+    Template,
+    TemplateCache,
+    TemplateGraph,
+    _decode,
+    _encode,
+)
+
+LINT_TEMPLATE = """AWSTemplateFormatVersion: 2010-09-09
+Resources:
+  Topic:
+    Type: AWS::SNS::Topic
+    Properties:
+      TopicName: !Sub "plainname"
+"""
+
+
+def node_types(value):
+    if isinstance(value, dict):
+        return [type(value), [(node_types(k), node_types(v)) for k, v in value.items()]]
+    if isinstance(value, list):
+        return [type(value), [node_types(v) for v in value]]
+    return type(value)
 
 
 class TestCfnTemplate(unittest.TestCase):
@@ -14,3 +43,148 @@ class TestCfnTemplate(unittest.TestCase):
         template = templates["taskcat-json"]
         self.assertEqual(1, len(template.children))
         self.assertEqual(4, len(template.descendents))
+
+    def test_parse_cache(self):
+        tmp = Path(mkdtemp())
+        copytree(Path(__file__).parent / "./data/nested-fail", tmp / "proj")
+        path = tmp / "proj" / "templates" / "test.template.yaml"
+        cache = TemplateCache()
+        with mock.patch(
+            "taskcat._cfn.template.cfnlint.decode.cfn_yaml.loads",
+            wraps=cfnlint.decode.cfn_yaml.loads,
+        ) as m_loads:
+            raw, template = cache.load(path)
+            self.assertEqual((raw, template), cache.load(path))
+            self.assertEqual(1, m_loads.call_count)
+            # content unchanged, only the mtime differs
+            os.utime(str(path), ns=(0, 0))
+            self.assertIs(template, cache.load(path)[1])
+            self.assertEqual(1, m_loads.call_count)
+            path.write_text(raw + "\n")
+            self.assertIsNot(template, cache.load(path)[1])
+            self.assertEqual(2, m_loads.call_count)
+
+    def test_disk_cache(self):
+        tmp = Path(mkdtemp())
+        copytree(Path(__file__).parent / "./data/nested-fail", tmp / "proj")
+        path = tmp / "proj" / "templates" / "test.template.yaml"
+        cold = TemplateCache()
+        cold.persist(tmp / "cache")
+        raw, template = cold.load(path)
+        cold.set_children(path, tmp / "proj", ["templates/child.yaml"])
+        cache_files = list((tmp / "cache").glob("*/*.json"))
+        self.assertEqual(1, len(cache_files))
+
+        warm = TemplateCache()
+        warm.persist(tmp / "cache")
+        with mock.patch("taskcat._cfn.template.cfnlint.decode.cfn_yaml.loads") as m:
+            self.assertEqual((raw, template), warm.load(path))
+            m.assert_not_called()
+        cached = warm.load(path)[1]
+        resource = cached["Resources"]["ChildStack"]
+        original = template["Resources"]["ChildStack"]
+        self.assertEqual(original.start_mark.line, resource.start_mark.line)
+        self.assertEqual(original.end_mark.column, resource.end_mark.column)
+        self.assertEqual(["templates/child.yaml"], warm.children(path, tmp / "proj"))
+        self.assertIsNone(warm.children(path, tmp))
+
+        # least recently used entries are evicted once over max_size
+        other = tmp / "proj" / "templates" / "test.template_middle.yaml"
+        os.utime(str(cache_files[0]), ns=(0, 0))
+        warm.persist(tmp / "cache", max_size=cache_files[0].stat().st_size)
+        warm.load(other)
+        remaining = list((tmp / "cache").glob("*/*.json"))
+        self.assertEqual(1, len(remaining))
+        self.assertNotEqual(cache_files, remaining)
+
+    def test_disk_cache_lint(self):
+        tmp = Path(mkdtemp())
+        path = tmp / "template.yaml"
+        path.write_text(LINT_TEMPLATE)
+        rules = cfnlint.core.get_rules([], [], [])
+        results = []
+        for _ in range(2):
+            cache = TemplateCache()
+            cache.persist(tmp / "cache")
+            template = cache.load(path)[1]
+            matches = cfnlint.core.run_checks(str(path), template, rules, ["us-east-1"])
+            results.append(
+                (node_types(template), sorted(str(match) for match in matches))
+            )
+        self.assertEqual(1, len(list((tmp / "cache").glob("*/*.json"))))
+        self.assertIn("W1020", "".join(results[0][1]))
+        self.assertEqual(results[0], results[1])
+
+    def test_encode_node_subclasses(self):
+        # eg. the sub_node of intrinsic functions in newer cfn-lint versions
+        template = cfnlint.decode.cfn_yaml.loads(LINT_TEMPLATE, "t.yaml")
+        decoded = _decode(_encode(template), "t.yaml")
+        topic_name = template["Resources"]["Topic"]["Properties"]["TopicName"]
+        name = decoded["Resources"]["Topic"]["Properties"]["TopicName"]
+        self.assertIs(type(topic_name), type(name))
+        self.assertEqual(topic_name.start_mark.line, name.start_mark.line)
+        self.assertEqual(node_types(template), node_types(decoded))
+
+    def test_graph(self):
+        tmp = Path(mkdtemp())
+        copytree(Path(__file__).parent / "./data/nested-fail", tmp / "proj")
+        templates = tmp / "proj" / "templates"
+        graph = TemplateGraph()
+        root = Template(templates / "test.template.yaml", tmp / "proj", graph=graph)
+        middle2 = graph.get(templates / "test.template_middle2.yaml")
+        self.assertEqual(5, len(graph))
+        self.assertIs(graph, middle2.graph)
+        # middle and middle3 both nest inner, which is a single shared node
+        inner = graph.get(templates / "test.template_inner.yaml")
+        self.assertEqual(2, len(graph.parents(inner)))
+        self.assertEqual(
+            [
+                "test.template_middle.yaml",
+                "test.template_inner.yaml",
+                "test.template_middle2.yaml",
+                "test.template_middle3.yaml",
+            ],
+            [t.template_path.name for t in root.descendents],
+        )
+        order = [t.template_path.name for t in graph.topological(root)]
+        self.assertEqual("test.template.yaml", order[-1])
+        self.assertLess(
+            order.index("test.template_inner.yaml"),
+            order.index("test.template_middle3.yaml"),
+        )
+        # adding another root re-uses the existing nodes
+        middle = Template(templates / "test.template_middle.yaml", graph=graph)
+        self.assertIs(inner, graph.get(templates / "test.template_inner.yaml"))
+        self.assertEqual(3, len(middle.descendents))
+        # writing a template updates the graph, and the cached queries
+        middle2.raw_template = middle2.raw_template.replace(
+            "AWS::CloudFormation::Stack", "AWS::SNS::Topic"
+        )
+        middle2.write()
+        self.assertEqual([], middle2.children)
+        self.assertEqual(3, len(root.descendents))
+        self.assertEqual(2, len(middle.descendents))
+
+    def test_with_url(self):
+        test_proj = (Path(__file__).parent / "./data/nested-fail").resolve()
+        template = Template(
+            test_proj / "templates" / "test.template.yaml",
+            project_root=test_proj,
+            s3_key_prefix="nested-fail/",
+        )
+        url = "https://bucket.s3.amazonaws.com/nested-fail/templates/test.template.yaml"
+        with mock.patch("taskcat._cfn.template.Template._find_children") as m_find:
+            view = template.with_url(url)
+            m_find.assert_not_called()
+        self.assertEqual("", template.url)
+        self.assertEqual(url, view.url)
+        self.assertIs(template.template, view.template)
+        self.assertEqual(template.s3_key, view.s3_key)
+        child = view.children[0]
+        self.assertEqual(
+            "https://bucket.s3.amazonaws.com/nested-fail/templates/"
+            "test.template_middle.yaml",
+            child.url,
+        )
+        self.assertEqual(4, len(view.descendents))
+        self.assertEqual("", template.children[0].url)
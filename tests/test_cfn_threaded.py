@@ -183,3 +183,48 @@ class TestStacker(unittest.TestCase):
             clients, uuid.UUID(int=0), "nested-fail", {"taskcat-json": mock.Mock()}
         )
         self.assertEqual(1, len(s))
+
+    @mock.patch("taskcat._cfn.threaded.StackPoller.for_region")
+    def test_wait_for_refresh(self, m_for_region):
+        poller = mock.Mock()
+        m_for_region.return_value = poller
+        stacker = Stacker(project_name="test", tests={})
+        stacker.stacks = [mock.Mock(), mock.Mock()]
+
+        poller.active = False
+        self.assertEqual(stacker.wait_for_refresh(), False)
+        poller.subscribe.assert_not_called()
+
+        poller.active = True
+        poller.subscribe.side_effect = stacker._on_refresh
+        self.assertEqual(stacker.wait_for_refresh(), True)
+        poller.subscribe.assert_called_once()
+        poller.unsubscribe.assert_called_once()
+
+        # a poller that stops without notifying is noticed between wait slices
+        def stop(_callback):
+            poller.active = False
+
+        poller.subscribe.side_effect = stop
+        stacker.WAIT_SLICE = 0.01
+        self.assertEqual(stacker.wait_for_refresh(), False)
+        # and a timeout is honoured while the poller is still running
+        poller.active = True
+        poller.subscribe.side_effect = None
+        self.assertEqual(stacker.wait_for_refresh(timeout=0.05), False)
+
+    @mock.patch("taskcat._cfn.threaded.sleep")
+    @mock.patch("taskcat._cfn.threaded.StackPoller.for_region")
+    def test_wait_for_progress(self, m_for_region, m_sleep):
+        poller = mock.Mock()
+        poller.active = False
+        m_for_region.return_value = poller
+        stacker = Stacker(project_name="test", tests={})
+        in_progress = mock.Mock(status="CREATE_IN_PROGRESS")
+        complete = mock.Mock(status="CREATE_COMPLETE")
+        stacker.stacks = [in_progress, complete]
+        # without an active poller, sleeps and refreshes rather than spinning
+        stacker.wait_for_progress(interval=5)
+        m_sleep.assert_called_once_with(5)
+        in_progress.refresh.assert_called_once_with()
+        complete.refresh.assert_not_called()
@@ -0,0 +1,185 @@
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+
+from dulwich import porcelain
+from dulwich.index import commit_tree
+from dulwich.objects import Blob
+from dulwich.repo import Repo
+from taskcat._change_impact import ChangeImpact
+from taskcat._config import Config
+from taskcat.exceptions import TaskCatException
+
+CONFIG = """
+project:
+  name: impact
+  regions:
+    - us-east-1
+  lambda_source_path: functions/source
+  lambda_zip_path: functions/packages
+tests:
+  test-a:
+    template: templates/a.yaml
+  test-b:
+    template: templates/b.yaml
+"""
+
+TEMPLATE = """
+Parameters:
+  Bucket:
+    Type: String
+  KeyPrefix:
+    Type: String
+Resources:
+  {name}:
+    Type: {resource_type}
+    Properties:
+      {key}: !Sub 'https://${{Bucket}}.s3.amazonaws.com/${{KeyPrefix}}{reference}'
+"""
+
+FILES = {
+    ".taskcat.yml": CONFIG,
+    "templates/a.yaml": TEMPLATE.format(
+        name="Child",
+        resource_type="AWS::CloudFormation::Stack",
+        key="TemplateURL",
+        reference="templates/child.yaml",
+    ),
+    "templates/child.yaml": TEMPLATE.format(
+        name="Function",
+        resource_type="AWS::Lambda::Function",
+        key="Code",
+        reference="functions/packages/FuncA/lambda.zip",
+    ),
+    "templates/b.yaml": TEMPLATE.format(
+        name="Instance",
+        resource_type="AWS::EC2::Instance",
+        key="UserData",
+        reference="scripts/b.sh",
+    ),
+    "functions/source/FuncA/index.py": "def handler(event, context):\n    pass\n",
+    "functions/packages/FuncA/lambda.zip": "zip",
+    "scripts/b.sh": "#!/bin/bash\n",
+    "shared.txt": "used by anything\n",
+}
+
+
+class TestChangeImpact(unittest.TestCase):
+    def setUp(self):
+        self.root = Path(mkdtemp()).resolve()
+        for path, content in FILES.items():
+            (self.root / path).parent.mkdir(parents=True, exist_ok=True)
+            (self.root / path).write_text(content)
+
+    def impact(self):
+        config = Config.create(
+            project_config_path=self.root / ".taskcat.yml", project_root=self.root
+        )
+        templates = config.get_templates(self.root)
+        return ChangeImpact(config, templates, self.root, [self.root / ".taskcat.yml"])
+
+    def commit(self, extra_files=()):
+        repo = porcelain.init(str(self.root))
+        paths = list(FILES) + list(extra_files)
+        porcelain.add(repo, [str(self.root / path) for path in paths])
+        porcelain.commit(
+            repo, message=b"init", author=b"a <a@b.c>", committer=b"a <a@b.c>"
+        )
+        repo.close()
+
+    def test_closures(self):
+        closures = self.impact().closures
+        shared = {self.root / ".taskcat.yml", self.root / "shared.txt"}
+        self.assertEqual(
+            shared
+            | {
+                self.root / "templates/a.yaml",
+                self.root / "templates/child.yaml",
+                self.root / "functions/source/FuncA/index.py",
+            },
+            closures["test-a"],
+        )
+        self.assertEqual(
+            shared | {self.root / "templates/b.yaml", self.root / "scripts/b.sh"},
+            closures["test-b"],
+        )
+
+    def test_affected_since_ref(self):
+        with self.assertRaises(TaskCatException):
+            self.impact().affected("HEAD")
+        self.commit()
+        self.assertEqual([], self.impact().affected("HEAD"))
+        with self.assertRaises(TaskCatException):
+            self.impact().affected("no-such-branch")
+        (self.root / "functions/source/FuncA/index.py").write_text("changed")
+        # rebuilt packages are not compared, only their sources
+        (self.root / "functions/packages/FuncA/lambda.zip").write_text("rebuilt")
+        self.assertEqual(["test-a"], self.impact().affected("HEAD"))
+        (self.root / "scripts/b.sh").write_text("changed")
+        self.assertEqual(["test-a", "test-b"], sorted(self.impact().affected("HEAD")))
+
+    def test_affected_since_ref_deleted(self):
+        (self.root / "functions/source/FuncA/util.py").write_text("pass\n")
+        self.commit(["functions/source/FuncA/util.py"])
+        # deleted lambda sources and referenced files select the tests using them
+        (self.root / "functions/source/FuncA/util.py").unlink()
+        self.assertEqual(["test-a"], self.impact().affected("HEAD"))
+        (self.root / "scripts/b.sh").unlink()
+        self.assertEqual(["test-a", "test-b"], sorted(self.impact().affected("HEAD")))
+
+    def test_affected_since_ref_deleted_shared(self):
+        self.commit()
+        # deleted rebuilt packages are not compared
+        (self.root / "functions/packages/FuncA/lambda.zip").unlink()
+        self.assertEqual([], self.impact().affected("HEAD"))
+        # an unreferenced file may have been used by any test
+        (self.root / "shared.txt").unlink()
+        self.assertEqual(["test-a", "test-b"], sorted(self.impact().affected("HEAD")))
+
+    def test_affected_since_ref_with_submodule(self):
+        submodule = self.root / "submodules" / "helpers"
+        submodule.mkdir(parents=True)
+        (submodule / "helper.sh").write_text("#!/bin/bash\n")
+        sub_repo = porcelain.init(str(submodule))
+        porcelain.add(sub_repo, [str(submodule / "helper.sh")])
+        sub_commit = porcelain.commit(
+            sub_repo, message=b"init", author=b"a <a@b.c>", committer=b"a <a@b.c>"
+        )
+        sub_repo.close()
+        # the superproject records the submodule as a gitlink to its commit
+        repo = Repo.init(str(self.root))
+        entries = [(b"submodules/helpers", sub_commit, 0o160000)]
+        for path in FILES:
+            blob = Blob.from_string((self.root / path).read_bytes())
+            repo.object_store.add_object(blob)
+            entries.append((path.encode(), blob.id, 0o100644))
+        repo.do_commit(
+            b"init",
+            committer=b"a <a@b.c>",
+            author=b"a <a@b.c>",
+            tree=commit_tree(repo.object_store, entries),
+        )
+        repo.close()
+        self.assertEqual([], self.impact().affected("HEAD"))
+        # unreferenced files in submodules are shared by all tests
+        (submodule / "helper.sh").write_text("changed")
+        self.assertEqual(["test-a", "test-b"], sorted(self.impact().affected("HEAD")))
+
+    def test_affected_since_manifest(self):
+        manifest = self.root / ".taskcat" / "manifest.json"
+        impact = self.impact()
+        self.assertEqual(manifest, ChangeImpact.manifest_path(self.root, str(manifest)))
+        self.assertIsNone(ChangeImpact.manifest_path(self.root, "HEAD"))
+        self.assertEqual(["test-a", "test-b"], sorted(impact.affected(str(manifest))))
+        impact.write_manifest(manifest, ["test-a"])
+        self.assertEqual(["test-b"], self.impact().affected(str(manifest)))
+        impact.write_manifest(manifest, ["test-b"])
+        self.assertEqual([], self.impact().affected(str(manifest)))
+        (self.root / "templates/child.yaml").write_text(
+            FILES["templates/child.yaml"] + "\n"
+        )
+        self.assertEqual(["test-a"], self.impact().affected(str(manifest)))
+        (self.root / "shared.txt").write_text("changed")
+        self.assertEqual(
+            ["test-a", "test-b"], sorted(self.impact().affected(str(manifest)))
+        )
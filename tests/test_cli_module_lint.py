@@ -2,12 +2,16 @@ import os
 import unittest
 from pathlib import Path
 
+import mock
+from taskcat._cfn.template import CACHE_DIR
 from taskcat._cli_modules.lint import Lint
 
 
 class TestLintCli(unittest.TestCase):
-    def test_lint(self):
+    @mock.patch("taskcat._cli_modules.lint.TEMPLATE_CACHE", autospec=True)
+    def test_lint(self, mock_cache):
         base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
         base_path = Path(base_path + "data/nested-fail").resolve()
         Lint(project_root=base_path, input_file=base_path / ".taskcat.yml")
-        # nothing to assert, expected to return nothing and exit without error
+        # nothing else to assert, expected to return nothing and exit without error
+        mock_cache.persist.assert_called_once_with(base_path / CACHE_DIR)
@@ -3,14 +3,18 @@ import unittest
 from pathlib import Path
 
 import mock
+from taskcat._cfn.template import CACHE_DIR
 from taskcat._cli_modules.test import Test
 
 
 class TestTestCli(unittest.TestCase):
+    @mock.patch("taskcat._cli_modules.test.TEMPLATE_CACHE", autospec=True)
     @mock.patch("taskcat._cli_modules.test.Config", autospec=True)
     @mock.patch("taskcat._cli_modules.test.LambdaBuild", autospec=True)
     @mock.patch("taskcat._cli_modules.test.ReportBuilder", autospec=True)
-    def test_test_run(self, mock_report_builder, mock_lambda_build, mock_config):
+    def test_test_run(
+        self, mock_report_builder, mock_lambda_build, mock_config, mock_cache
+    ):
         base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
         base_path = Path(base_path + "data/nested-fail").resolve()
 
@@ -18,3 +22,64 @@ class TestTestCli(unittest.TestCase):
         mock_report_builder.assert_called()
         mock_lambda_build.assert_called()
         mock_config.create.assert_called()
+        mock_cache.persist.assert_called_once_with(base_path / CACHE_DIR)
+
+    @mock.patch("taskcat._cli_modules.test.TEMPLATE_CACHE", autospec=True)
+    @mock.patch("taskcat._cli_modules.test.ChangeImpact", autospec=True)
+    @mock.patch("taskcat._cli_modules.test.Config", autospec=True)
+    @mock.patch("taskcat._cli_modules.test.LambdaBuild", autospec=True)
+    def test_test_run_changed_since(
+        self, mock_lambda_build, mock_config, mock_impact, _
+    ):
+        base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
+        base_path = Path(base_path + "data/nested-fail").resolve()
+        config = mock_config.create.return_value
+        config.config.tests = {"test-a": mock.Mock(), "test-b": mock.Mock()}
+        templates = {"test-a": mock.Mock(), "test-b": mock.Mock()}
+        config.get_templates.return_value = templates
+        mock_impact.return_value.affected.return_value = []
+
+        Test.run(
+            project_root=base_path,
+            input_file=base_path / ".taskcat.yml",
+            changed_since="main",
+        )
+        mock_impact.assert_called_once_with(
+            config, templates, base_path, [base_path / ".taskcat.yml"]
+        )
+        mock_impact.return_value.affected.assert_called_once_with("main")
+        self.assertEqual({}, config.config.tests)
+        self.assertEqual({}, templates)
+        mock_lambda_build.assert_not_called()
+
+    @mock.patch("taskcat._cli_modules.test.TEMPLATE_CACHE", autospec=True)
+    @mock.patch("taskcat._cli_modules.test.Stacker", autospec=True)
+    @mock.patch("taskcat._cli_modules.test.save_sync_plan", autospec=True)
+    @mock.patch("taskcat._cli_modules.test.stage_in_s3", autospec=True)
+    @mock.patch("taskcat._cli_modules.test.Config", autospec=True)
+    @mock.patch("taskcat._cli_modules.test.LambdaBuild", autospec=True)
+    def test_test_run_sync_plan(
+        self, _, mock_config, mock_stage, mock_save, mock_stacker, __
+    ):
+        base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
+        base_path = Path(base_path + "data/nested-fail").resolve()
+        bucket = mock.Mock()
+        bucket.name = "bucket"
+        config = mock_config.create.return_value
+        config.get_buckets.return_value = {
+            "test-a": {"us-east-1": bucket, "us-west-2": bucket}
+        }
+
+        Test.run(
+            project_root=base_path,
+            input_file=base_path / ".taskcat.yml",
+            lint_disable=True,
+            sync_plan="plan.json",
+        )
+        self.assertTrue(mock_stage.call_args[1]["dry_run"])
+        mock_save.assert_called_once_with(
+            mock_stage.return_value, Path("plan.json").resolve()
+        )
+        # the plan is written without syncing or launching stacks
+        bucket.delete.assert_called_once_with()
+        mock_stacker.assert_not_called()
@@ -0,0 +1,66 @@
+import unittest
+import uuid
+
+import mock
+from taskcat._dataclasses import S3BucketObj
+from taskcat.exceptions import TaskCatException
+
+
+def bucket_obj(s3_client, auto_generated=True):
+    return S3BucketObj(
+        name="bucket",
+        region="us-east-1",
+        account_id="123456789012",
+        partition="aws",
+        s3_client=s3_client,
+        sigv4=True,
+        auto_generated=auto_generated,
+        object_acl="private",
+        taskcat_id=uuid.uuid4(),
+    )
+
+
+def version_pages(count, page_size=1000):
+    pages = []
+    for start in range(0, count, page_size):
+        versions = [
+            {"Key": f"key-{i}", "VersionId": f"v{i}"}
+            for i in range(start, min(start + page_size, count))
+        ]
+        pages.append({"Versions": versions[1:], "DeleteMarkers": versions[:1]})
+    return pages
+
+
+class TestS3BucketObj(unittest.TestCase):
+    def test_empty(self):
+        s3_client = mock.Mock()
+        s3_client.get_paginator.return_value.paginate.return_value = iter(
+            version_pages(2500)
+        )
+        s3_client.delete_objects.return_value = {}
+        bucket_obj(s3_client).empty()
+        s3_client.get_paginator.assert_called_once_with("list_object_versions")
+        self.assertEqual(3, s3_client.delete_objects.call_count)
+        deleted = [
+            obj
+            for call in s3_client.delete_objects.call_args_list
+            for obj in call[1]["Delete"]["Objects"]
+        ]
+        self.assertEqual(2500, len(deleted))
+        self.assertIn({"Key": "key-1000", "VersionId": "v1000"}, deleted)
+
+    def test_empty_not_auto_generated(self):
+        s3_client = mock.Mock()
+        bucket_obj(s3_client, auto_generated=False).empty()
+        s3_client.get_paginator.assert_not_called()
+
+    def test_empty_errors(self):
+        s3_client = mock.Mock()
+        s3_client.get_paginator.return_value.paginate.return_value = iter(
+            version_pages(10)
+        )
+        s3_client.delete_objects.return_value = {
+            "Errors": [{"Key": "key-1", "Message": "Access Denied"}]
+        }
+        with self.assertRaises(TaskCatException):
+            bucket_obj(s3_client).empty()
@@ -1,10 +1,15 @@
+import os
 import unittest
 from pathlib import Path
 from shutil import copytree
+from subprocess import CalledProcessError
 from tempfile import mkdtemp
+from zipfile import ZipFile
 
+import mock
 from taskcat._config import Config
-from taskcat._lambda_build import LambdaBuild
+from taskcat._lambda_build import BUILD_MANIFEST_PATH, WHEEL_CACHE_PATH, LambdaBuild
+from taskcat.exceptions import TaskCatException
 
 
 class TestLambdaPackage(unittest.TestCase):
@@ -35,3 +40,233 @@ class TestLambdaPackage(unittest.TestCase):
         path = path / "submodules" / "DeepSub"
         self.assertEqual((path / "lambda_functions" / "packages").is_dir(), True)
         self.assertEqual((path / zip_suffix).is_file(), True)
+
+    @mock.patch(
+        "taskcat._lambda_build.LambdaBuild._pip_build",
+        side_effect=LambdaBuild._zip_dir,
+    )
+    def test_build_cache(self, m_pip_build):
+        tmp = Path(mkdtemp())
+        test_proj = (
+            Path(__file__).parent / "./data/lambda_build_with_submodules"
+        ).resolve()
+        copytree(test_proj, tmp / "test")
+        path = (tmp / "test").resolve()
+        c = Config.create(
+            project_config_path=path / ".taskcat.yml",
+            project_root=path,
+            args={
+                "project": {
+                    "lambda_zip_path": "functions/packages",
+                    "lambda_source_path": "functions/source",
+                }
+            },
+        )
+        raw_zip = path / "functions/packages/TestFuncRaw/lambda.zip"
+        LambdaBuild(c, project_root=path)
+        self.assertEqual(1, m_pip_build.call_count)
+        self.assertTrue(raw_zip.is_file())
+        self.assertTrue((path / BUILD_MANIFEST_PATH).is_file())
+        mtime = raw_zip.stat().st_mtime_ns
+
+        LambdaBuild(c, project_root=path)
+        self.assertEqual(1, m_pip_build.call_count)
+        self.assertEqual(mtime, raw_zip.stat().st_mtime_ns)
+
+        (path / "functions/source/TestFuncPip/a_file").write_text("changed")
+        LambdaBuild(c, project_root=path)
+        self.assertEqual(2, m_pip_build.call_count)
+        self.assertEqual(mtime, raw_zip.stat().st_mtime_ns)
+
+        # a package changed since it was built is rebuilt
+        raw_zip.write_text("modified")
+        LambdaBuild(c, project_root=path)
+        self.assertNotEqual(b"modified", raw_zip.read_bytes()[:8])
+
+        LambdaBuild(c, project_root=path, force=True)
+        self.assertEqual(3, m_pip_build.call_count)
+
+    @mock.patch("taskcat._lambda_build.LambdaBuild._zip_dir")
+    def test_build_failures(self, m_zip_dir):
+        m_zip_dir.side_effect = Exception("disk full")
+        tmp = Path(mkdtemp())
+        test_proj = (
+            Path(__file__).parent / "./data/lambda_build_with_submodules"
+        ).resolve()
+        copytree(test_proj, tmp / "test")
+        path = (tmp / "test").resolve()
+        source = path / "functions/source"
+        (source / "TestFuncRaw2").mkdir()
+        (source / "TestFuncPip/requirements.txt").unlink()
+        c = Config.create(
+            project_config_path=path / ".taskcat.yml",
+            project_root=path,
+            args={
+                "project": {
+                    "lambda_zip_path": "functions/packages",
+                    "lambda_source_path": "functions/source",
+                    "lambda_build_concurrency": 1,
+                }
+            },
+        )
+        with self.assertRaises(TaskCatException) as context:
+            LambdaBuild(c, project_root=path)
+        self.assertIn(f"{source / 'TestFuncPip'}: disk full", str(context.exception))
+        # no more builds are started after the first failure
+        self.assertEqual(1, m_zip_dir.call_count)
+
+    def test_zip_dir(self):
+        source = Path(mkdtemp())
+        (source / "b").mkdir()
+        (source / "b" / "index.py").write_text("pass")
+        (source / "a.txt").write_text("a")
+        (source / "run.sh").write_text("#!/bin/sh")
+        (source / "run.sh").chmod(0o700)
+        output = Path(mkdtemp())
+        zip_path = output / "lambda.zip"
+        LambdaBuild._zip_dir(source, output)
+        content = zip_path.read_bytes()
+        mtime = zip_path.stat().st_mtime_ns
+        with ZipFile(str(zip_path)) as archive:
+            self.assertEqual(
+                ["a.txt", "b/", "b/index.py", "run.sh"], archive.namelist()
+            )
+            self.assertEqual(
+                0o755, archive.getinfo("run.sh").external_attr >> 16 & 0o777
+            )
+            self.assertEqual((1980, 1, 1, 0, 0, 0), archive.getinfo("a.txt").date_time)
+        # the same files give the same zip, which is left in place
+        os.utime(str(source / "a.txt"), (0, 0))
+        LambdaBuild._zip_dir(source, output)
+        self.assertEqual(content, zip_path.read_bytes())
+        self.assertEqual(mtime, zip_path.stat().st_mtime_ns)
+        self.assertEqual(["lambda.zip"], os.listdir(str(output)))
+        (source / "a.txt").write_text("changed")
+        LambdaBuild._zip_dir(source, output, compression_level=9)
+        self.assertNotEqual(content, zip_path.read_bytes())
+        # the compression level is applied to the entries
+        (source / "a.txt").write_text("a" * 100000)
+        sizes = []
+        for level in (0, 9):
+            LambdaBuild._zip_dir(source, output, compression_level=level)
+            with ZipFile(str(zip_path)) as archive:
+                sizes.append(archive.getinfo("a.txt").compress_size)
+        self.assertGreater(sizes[0], sizes[1])
+
+    @mock.patch("taskcat._lambda_build.subprocess_run")
+    def test_pip_wheel_cache(self, m_run):
+        commands = []
+
+        def run(command, **_):
+            commands.append(command[:2])
+            if command[1] == "wheel":
+                wheel_dir = Path(command[command.index("--wheel-dir") + 1])
+                wheel_dir.mkdir(parents=True, exist_ok=True)
+                (wheel_dir / "certifi-1.0-py3-none-any.whl").write_text("wheel")
+            elif command[1] == "install":
+                wheel_dir = Path(command[command.index("--find-links") + 1])
+                if not list(wheel_dir.glob("*.whl")):
+                    raise CalledProcessError(1, command, b"", b"no distribution")
+            return mock.Mock(stdout=b"", stderr=b"")
+
+        m_run.side_effect = run
+        tmp = Path(mkdtemp())
+        test_proj = (
+            Path(__file__).parent / "./data/lambda_build_with_submodules"
+        ).resolve()
+        copytree(test_proj, tmp / "test")
+        path = (tmp / "test").resolve()
+        c = Config.create(
+            project_config_path=path / ".taskcat.yml",
+            project_root=path,
+            args={
+                "project": {
+                    "lambda_zip_path": "functions/packages",
+                    "lambda_source_path": "functions/source",
+                }
+            },
+        )
+        LambdaBuild(c, project_root=path)
+        pip_commands = [command for command in commands if command[1] != "--version"]
+        self.assertEqual(
+            [["pip", "install"], ["pip", "wheel"], ["pip", "install"]], pip_commands
+        )
+        wheel_command = next(
+            call[0][0] for call in m_run.call_args_list if call[0][0][1] == "wheel"
+        )
+        self.assertIn(str(path / WHEEL_CACHE_PATH), wheel_command)
+        # each build resolves into its own directory, and the new wheels are
+        # added to the cache
+        wheel_dir = wheel_command[wheel_command.index("--wheel-dir") + 1]
+        self.assertNotEqual(str(path / WHEEL_CACHE_PATH), wheel_dir)
+        self.assertEqual(
+            ["certifi-1.0-py3-none-any.whl"], os.listdir(str(path / WHEEL_CACHE_PATH)),
+        )
+
+        # once the wheels are cached, the requirements are installed offline
+        commands.clear()
+        (path / "functions/source/TestFuncPip/a_file").write_text("changed")
+        LambdaBuild(c, project_root=path)
+        pip_commands = [command for command in commands if command[1] != "--version"]
+        self.assertEqual([["pip", "install"]], pip_commands)
+
+    @mock.patch(
+        "taskcat._lambda_build.LambdaBuild._pip_build",
+        side_effect=LambdaBuild._zip_dir,
+    )
+    def test_identical_sources_built_once(self, m_pip_build):
+        tmp = Path(mkdtemp())
+        test_proj = (
+            Path(__file__).parent / "./data/lambda_build_with_submodules"
+        ).resolve()
+        copytree(test_proj, tmp / "test")
+        path = (tmp / "test").resolve()
+        source = Path("functions/source/TestFuncPip")
+        for submodule in ["SomeSub", "SomeSub/submodules/DeepSub"]:
+            copytree(path / source, path / "submodules" / submodule / source)
+        c = Config.create(
+            project_config_path=path / ".taskcat.yml",
+            project_root=path,
+            args={
+                "project": {
+                    "lambda_zip_path": "functions/packages",
+                    "lambda_source_path": "functions/source",
+                }
+            },
+        )
+        LambdaBuild(c, project_root=path)
+        self.assertEqual(1, m_pip_build.call_count)
+        package = Path("functions/packages/TestFuncPip/lambda.zip")
+        for submodule in ["SomeSub", "SomeSub/submodules/DeepSub"]:
+            self.assertEqual(
+                (path / package).read_bytes(),
+                (path / "submodules" / submodule / package).read_bytes(),
+            )
+        (path / "submodules/SomeSub" / source / "a_file").write_text("changed")
+        LambdaBuild(c, project_root=path)
+        self.assertEqual(2, m_pip_build.call_count)
+
+    def test_rebuild_linked_package(self):
+        tmp = Path(mkdtemp())
+        first, second = tmp / "packages" / "First", tmp / "packages" / "Second"
+        first.mkdir(parents=True)
+        (first / "lambda.zip").write_text("original")
+        second.mkdir(parents=True)
+        (second / "stale.zip").write_text("stale")
+        LambdaBuild._link_dir(first, second)
+        self.assertEqual(["lambda.zip"], os.listdir(str(second)))
+
+        def run(volumes, **_):
+            output = Path(next(iter(volumes)))
+            (output / "lambda.zip").write_text("rebuilt")
+            return b""
+
+        # rebuilding one of the linked packages with docker leaves the other as it
+        # was
+        build = LambdaBuild.__new__(LambdaBuild)
+        build._docker = mock.Mock()
+        build._docker.containers.run.side_effect = run
+        build._docker_extract("tag", first)
+        self.assertEqual("rebuilt", (first / "lambda.zip").read_text())
+        self.assertEqual("original", (second / "lambda.zip").read_text())
+        self.assertEqual(["First", "Second"], sorted(os.listdir(str(tmp / "packages"))))
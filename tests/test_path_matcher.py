@@ -0,0 +1,63 @@
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+
+from taskcat._path_matcher import PathMatcher
+
+
+class TestPathMatcher(unittest.TestCase):
+    def test_match(self):
+        cases = [
+            # pattern, path, is_dir, excluded
+            ("*.md", "README.md", False, True),
+            ("*.md", "docs/README.md", False, True),
+            ("*.md", "README.mdx", False, False),
+            (".*", ".git", True, True),
+            (".*", "submodules/sub/.git", True, True),
+            ("/venv/", "venv", True, True),
+            ("/venv/", "venv", False, False),
+            ("/venv/", "sub/venv", True, False),
+            ("node_modules/", "a/b/node_modules", True, True),
+            ("docs/*.md", "docs/a.md", False, True),
+            ("docs/*.md", "docs/sub/a.md", False, False),
+            ("docs/*.md", "other/docs/a.md", False, False),
+            ("**/build", "build", True, True),
+            ("**/build", "a/b/build", False, True),
+            ("a/**/b", "a/b", False, True),
+            ("a/**/b", "a/x/y/b", False, True),
+            ("a/**/b", "a/x/yb", False, False),
+            ("logs/**", "logs/a/b.log", False, True),
+            ("logs/**", "logs", True, False),
+            ("file?.txt", "file1.txt", False, True),
+            ("file?.txt", "file/.txt", False, False),
+            ("file[0-9].txt", "file5.txt", False, True),
+            ("file[!0-9].txt", "file5.txt", False, False),
+            ("file[!0-9].txt", "filex.txt", False, True),
+            ("\\#hash", "#hash", False, True),
+            ("# comment", "# comment", False, False),
+            ("trailing  ", "trailing", False, True),
+        ]
+        for pattern, path, is_dir, excluded in cases:
+            with self.subTest(pattern=pattern, path=path):
+                self.assertEqual(excluded, PathMatcher([pattern]).match(path, is_dir))
+
+    def test_negation(self):
+        matcher = PathMatcher(["*.md", "!LICENSE.md", "docs/"])
+        self.assertTrue(matcher.match("README.md"))
+        self.assertFalse(matcher.match("LICENSE.md"))
+        self.assertFalse(matcher.match("sub/LICENSE.md"))
+        self.assertTrue(matcher.match("docs", is_dir=True))
+        matcher.add(["LICENSE.md"])
+        self.assertTrue(matcher.match("LICENSE.md"))
+        self.assertEqual(3, len(matcher._rules))
+
+    def test_add_file(self):
+        tmp = Path(mkdtemp())
+        matcher = PathMatcher(["*.md"])
+        matcher.add_file(tmp / ".taskcatignore")
+        self.assertEqual(["*.md"], matcher.patterns)
+        (tmp / ".taskcatignore").write_text("# scratch files\n\n*.tmp\n!README.md\n")
+        matcher.add_file(tmp / ".taskcatignore")
+        self.assertEqual(["*.md", "*.tmp", "!README.md"], matcher.patterns)
+        self.assertTrue(matcher.match("a.tmp"))
+        self.assertFalse(matcher.match("README.md"))
@@ -0,0 +1,155 @@
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+
+import mock
+from botocore.exceptions import ClientError
+from taskcat._s3_stage import (
+    delete_buckets,
+    load_sync_plan,
+    save_sync_plan,
+    stage_in_s3,
+)
+from taskcat._s3_sync import HASH_CACHE_PATH, S3Sync
+from taskcat.exceptions import TaskCatException
+
+
+def make_bucket(name, partition="aws"):
+    bucket = mock.Mock()
+    bucket.name = name
+    bucket.partition = partition
+    bucket.object_acl = "private"
+    bucket.s3_client.get_object.side_effect = ClientError(
+        {"Error": {"Code": "NoSuchKey"}}, "GetObject"
+    )
+    bucket.s3_client.list_objects_v2.return_value = {}
+    bucket.s3_client.head_object.return_value = {"ContentLength": 1}
+    return bucket
+
+
+def uploads(bucket):
+    return [
+        call
+        for call in bucket.s3_client.put_object.call_args_list
+        if not call[1]["Key"].endswith(S3Sync.manifest_key)
+    ]
+
+
+def make_project():
+    tmp = Path(mkdtemp())
+    for path in ["templates/a.yaml", "templates/b.yaml", "scripts/c.sh"]:
+        (tmp / path).parent.mkdir(parents=True, exist_ok=True)
+        (tmp / path).write_text(path)
+    return tmp
+
+
+class TestStageInS3(unittest.TestCase):
+    def test_stage_in_s3(self):
+        tmp = make_project()
+        bucket_a = make_bucket("bucket-a")
+        bucket_b = make_bucket("bucket-b")
+        buckets = {
+            "test-1": {"us-east-1": bucket_a, "us-west-2": bucket_a},
+            "test-2": {"us-east-1": bucket_b},
+        }
+        with mock.patch.object(
+            S3Sync, "_hash_file", wraps=S3Sync._hash_file
+        ) as m_hash, mock.patch.object(
+            S3Sync, "_get_local_file_list", wraps=S3Sync._get_local_file_list
+        ) as m_walk:
+            stage_in_s3(buckets, "project", tmp)
+        # the project is walked and hashed once, for both buckets
+        m_walk.assert_called_once()
+        self.assertEqual(3, m_hash.call_count)
+        for bucket in [bucket_a, bucket_b]:
+            self.assertEqual(3, len(uploads(bucket)))
+            bucket.s3_client.list_objects_v2.assert_called_once_with(
+                Bucket=bucket.name, Prefix="project/"
+            )
+        self.assertTrue((tmp / HASH_CACHE_PATH).is_file())
+
+    def test_stage_in_s3_no_buckets(self):
+        with mock.patch("taskcat._s3_stage.S3Sync") as m_sync:
+            stage_in_s3({}, "project", Path(mkdtemp()))
+            m_sync.assert_not_called()
+
+    def test_stage_in_s3_server_side_copy(self):
+        tmp = make_project()
+        primary = make_bucket("bucket-a")
+        copy = make_bucket("bucket-b")
+        other_partition = make_bucket("bucket-c", "aws-cn")
+        buckets = {
+            "test-1": {"us-east-1": primary, "us-west-2": copy},
+            "test-2": {"cn-north-1": other_partition},
+        }
+        stage_in_s3(buckets, "project", tmp, server_side_copy=True)
+        for bucket in [primary, other_partition]:
+            self.assertEqual(3, len(uploads(bucket)))
+            bucket.s3_client.copy_object.assert_not_called()
+        self.assertEqual([], uploads(copy))
+        self.assertEqual(3, copy.s3_client.copy_object.call_count)
+        copy.s3_client.copy_object.assert_any_call(
+            CopySource={"Bucket": "bucket-a", "Key": "project/scripts/c.sh"},
+            Bucket="bucket-b",
+            Key="project/scripts/c.sh",
+            ACL="private",
+        )
+
+    def test_stage_in_s3_server_side_copy_denied(self):
+        tmp = make_project()
+        primary = make_bucket("bucket-a")
+        denied = make_bucket("bucket-b")
+        denied.s3_client.copy_object.side_effect = ClientError(
+            {"Error": {"Code": "AccessDenied", "Message": "Access Denied"}},
+            "CopyObject",
+        )
+        buckets = {"test-1": {"us-east-1": primary, "us-west-2": denied}}
+        with self.assertLogs("taskcat._s3_sync", "WARNING") as logs:
+            stage_in_s3(buckets, "project", tmp, server_side_copy=True)
+        # files that could not be copied are uploaded from the local project
+        self.assertEqual(1, len(logs.output))
+        self.assertEqual(3, len(uploads(denied)))
+
+    def test_stage_in_s3_sync_plan(self):
+        tmp = make_project()
+        bucket_a = make_bucket("bucket-a")
+        bucket_b = make_bucket("bucket-b")
+        buckets = {"test-1": {"us-east-1": bucket_a}}
+        plan = stage_in_s3(buckets, "project", tmp, dry_run=True)
+        self.assertEqual(["bucket-a"], list(plan["buckets"]))
+        self.assertEqual(3, len(plan["buckets"]["bucket-a"]["upload"]))
+        self.assertEqual([], uploads(bucket_a))
+        plan_path = Path(mkdtemp()) / "plans" / "plan.json"
+        save_sync_plan(plan, plan_path)
+        plan = load_sync_plan(plan_path)
+
+        # buckets without a plan are synced as usual
+        bucket_a.s3_client.reset_mock()
+        buckets["test-2"] = {"us-east-1": bucket_b}
+        with mock.patch.object(
+            S3Sync, "_get_local_file_list", wraps=S3Sync._get_local_file_list
+        ) as m_walk:
+            self.assertIsNone(stage_in_s3(buckets, "project", tmp, plan=plan))
+        m_walk.assert_called_once()
+        bucket_a.s3_client.list_objects_v2.assert_not_called()
+        for bucket in [bucket_a, bucket_b]:
+            self.assertEqual(3, len(uploads(bucket)))
+
+
+class TestDeleteBuckets(unittest.TestCase):
+    def test_delete_buckets(self):
+        shared = make_bucket("shared")
+        failing = make_bucket("failing")
+        failing.delete.side_effect = Exception("BucketNotEmpty")
+        other = make_bucket("other")
+        buckets = {
+            "test-a": {"us-east-1": shared, "us-west-2": failing},
+            "test-b": {"us-east-1": shared, "us-west-2": other},
+        }
+        with self.assertRaises(TaskCatException) as context:
+            delete_buckets(buckets)
+        self.assertIn("failing: BucketNotEmpty", str(context.exception))
+        # a failure does not stop the other buckets being deleted
+        for bucket in [shared, failing, other]:
+            bucket.delete.assert_called_once_with(delete_objects=True)
+        delete_buckets({})
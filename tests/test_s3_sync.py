@@ -1,28 +1,348 @@
+import hashlib
+import io
+import json
 import os
 import unittest
 from pathlib import Path
+from shutil import copytree
+from tempfile import mkdtemp
+from threading import Event
 
 import mock
-from taskcat._s3_sync import S3Sync
+from botocore.exceptions import ClientError
+from taskcat._s3_sync import (
+    HASH_CACHE_PATH,
+    FileHashCache,
+    S3Sync,
+    SyncStats,
+    create_transfer_config,
+)
+from taskcat.exceptions import TaskCatException
+
+NO_SUCH_KEY = ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+
+
+def uploaded_keys(s3_client):
+    return [
+        call[1]["Key"]
+        for call in s3_client.put_object.call_args_list
+        if not call[1]["Key"].endswith(S3Sync.manifest_key)
+    ]
 
 
 class TestS3Sync(unittest.TestCase):
     def test_init(self):
         m_s3_client = mock.Mock()
+        m_s3_client.get_object.side_effect = NO_SUCH_KEY
         m_s3_client.list_objects_v2.return_value = {
-            "Contents": [{"Key": "test_prefix/test_object", "ETag": "test_etag"}]
+            "Contents": [
+                {"Key": "test_prefix/test_object", "ETag": "test_etag", "Size": 1}
+            ]
         }
         m_s3_client.delete_objects.return_value = {}
-        m_s3_client.upload_file.return_value = None
         prefix = "test_prefix"
         base_path = "./" if os.getcwd().endswith("/tests") else "./tests/"
         base_path = Path(base_path + "data/").resolve()
-        S3Sync(
-            m_s3_client,
-            "test_bucket",
-            prefix,
-            str(base_path / "lambda_build_with_submodules"),
-        )
+        tmp = Path(mkdtemp())
+        copytree(base_path / "lambda_build_with_submodules", tmp / "test")
+        S3Sync(m_s3_client, "test_bucket", prefix, str(tmp / "test"))
         m_s3_client.list_objects_v2.assert_called_once()
         m_s3_client.delete_objects.assert_called_once()
-        m_s3_client.upload_file.assert_called()
+        self.assertTrue(uploaded_keys(m_s3_client))
+        m_s3_client.put_object.assert_called_with(
+            Bucket="test_bucket",
+            Key="test_prefix/.taskcat_manifest.json",
+            Body=mock.ANY,
+            ContentType="application/json",
+        )
+        self.assertTrue((tmp / "test" / HASH_CACHE_PATH).is_file())
+
+    def test_manifest(self):
+        tmp = Path(mkdtemp())
+        (tmp / "a.yaml").write_text("a")
+        (tmp / "b.yaml").write_text("bb")
+        m_s3_client = mock.Mock()
+        m_s3_client.get_object.side_effect = NO_SUCH_KEY
+        m_s3_client.list_objects_v2.return_value = {}
+        # no manifest, so the prefix is listed and a manifest written
+        S3Sync(m_s3_client, "bucket", "prefix", str(tmp))
+        self.assertEqual(
+            ["prefix/a.yaml", "prefix/b.yaml"], sorted(uploaded_keys(m_s3_client))
+        )
+        put = m_s3_client.put_object.call_args[1]
+        self.assertEqual("prefix/.taskcat_manifest.json", put["Key"])
+        manifest = json.loads(put["Body"])
+        a_etag = S3Sync._hash_file(str(tmp / "a.yaml"))
+        self.assertEqual([a_etag, 1], manifest["files"]["a.yaml"])
+        self.assertEqual(2, manifest["files"]["b.yaml"][1])
+
+        def listing(*keys, truncated=False):
+            page = {
+                "Contents": [
+                    {
+                        "Key": "prefix/" + key,
+                        "ETag": manifest["files"][key][0],
+                        "Size": manifest["files"][key][1],
+                    }
+                    for key in keys
+                ]
+            }
+            page["Contents"].append(
+                {"Key": put["Key"], "ETag": '"manifest"', "Size": 1}
+            )
+            if truncated:
+                page["NextContinuationToken"] = "token"
+            return page
+
+        # the manifest matches the first page, nothing is changed
+        m_s3_client.reset_mock()
+        m_s3_client.get_object.side_effect = None
+        m_s3_client.get_object.return_value = {"Body": io.BytesIO(put["Body"])}
+        m_s3_client.list_objects_v2.return_value = listing("a.yaml", truncated=True)
+        S3Sync(m_s3_client, "bucket", "prefix", str(tmp))
+        m_s3_client.list_objects_v2.assert_called_once()
+        m_s3_client.put_object.assert_not_called()
+        m_s3_client.delete_object.assert_not_called()
+
+        # a changed file invalidates the manifest before it is uploaded
+        (tmp / "b.yaml").write_text("changed")
+        m_s3_client.reset_mock()
+        m_s3_client.get_object.return_value = {"Body": io.BytesIO(put["Body"])}
+        m_s3_client.list_objects_v2.return_value = listing("a.yaml", "b.yaml")
+        S3Sync(m_s3_client, "bucket", "prefix", str(tmp))
+        m_s3_client.delete_object.assert_called_once_with(
+            Bucket="bucket", Key=put["Key"]
+        )
+        self.assertEqual(["prefix/b.yaml"], uploaded_keys(m_s3_client))
+        self.assertEqual(put["Key"], m_s3_client.put_object.call_args[1]["Key"])
+
+        # an object missing from the first page makes the manifest stale, and the
+        # rest of the prefix is listed
+        m_s3_client.reset_mock()
+        m_s3_client.get_object.return_value = {"Body": io.BytesIO(put["Body"])}
+        m_s3_client.list_objects_v2.side_effect = [
+            listing("b.yaml", truncated=True),
+            listing("b.yaml"),
+        ]
+        S3Sync(m_s3_client, "bucket", "prefix", str(tmp))
+        self.assertEqual(2, m_s3_client.list_objects_v2.call_count)
+        m_s3_client.list_objects_v2.assert_called_with(
+            Bucket="bucket", Prefix="prefix/", ContinuationToken="token"
+        )
+        self.assertEqual(put["Key"], m_s3_client.put_object.call_args[1]["Key"])
+
+    def test_plan(self):
+        tmp = Path(mkdtemp())
+        (tmp / "changed.yaml").write_text("changed")
+        (tmp / "same.yaml").write_text("same")
+        same_etag = S3Sync._hash_file(str(tmp / "same.yaml"))
+        m_s3_client = mock.Mock()
+        m_s3_client.get_object.side_effect = NO_SUCH_KEY
+        m_s3_client.list_objects_v2.return_value = {
+            "Contents": [
+                {"Key": "prefix/changed.yaml", "ETag": '"old"', "Size": 3},
+                {"Key": "prefix/same.yaml", "ETag": same_etag, "Size": 4},
+                {"Key": "prefix/removed.yaml", "ETag": '"removed"', "Size": 7},
+            ]
+        }
+        plan = S3Sync(m_s3_client, "bucket", "prefix", str(tmp), dry_run=True).plan
+        # planning does not modify the bucket
+        m_s3_client.put_object.assert_not_called()
+        m_s3_client.delete_objects.assert_not_called()
+        m_s3_client.delete_object.assert_not_called()
+        changed_etag = S3Sync._hash_file(str(tmp / "changed.yaml"))
+        self.assertEqual(
+            {"changed.yaml": [str(tmp / "changed.yaml"), changed_etag, 7]},
+            plan["upload"],
+        )
+        self.assertEqual(7, plan["upload_bytes"])
+        self.assertEqual(["removed.yaml"], plan["delete"])
+        self.assertEqual((1, 4), (plan["unchanged"], plan["unchanged_bytes"]))
+
+        # the plan is applied without listing or hashing again
+        m_s3_client.reset_mock()
+        m_s3_client.delete_objects.return_value = {}
+        plan = json.loads(json.dumps(plan))
+        with mock.patch.object(S3Sync, "_hash_file") as m_hash:
+            sync = S3Sync(m_s3_client, "bucket", "prefix", str(tmp), plan=plan)
+        m_hash.assert_not_called()
+        m_s3_client.list_objects_v2.assert_not_called()
+        m_s3_client.delete_objects.assert_called_once_with(
+            Bucket="bucket", Delete={"Objects": [{"Key": "prefix/removed.yaml"}]}
+        )
+        m_s3_client.delete_object.assert_called_once_with(
+            Bucket="bucket", Key="prefix/.taskcat_manifest.json"
+        )
+        self.assertEqual(["prefix/changed.yaml"], uploaded_keys(m_s3_client))
+        self.assertEqual((1, 1), (sync.stats.uploaded, sync.stats.deleted))
+        with self.assertRaises(TaskCatException):
+            S3Sync(m_s3_client, "other-bucket", "prefix", str(tmp), plan=plan)
+
+    def test_get_local_file_list(self):
+        tmp = Path(mkdtemp())
+        for path in [
+            "templates/a.yaml",
+            "README.md",
+            ".taskcat.yml",
+            "venv/lib/site.py",
+            "functions/source/Func/index.py",
+            "functions/packages/Func/lambda.zip",
+            "submodules/sub/.git/config",
+            "scratch/notes.txt",
+            "scratch/keep.txt",
+        ]:
+            (tmp / path).parent.mkdir(parents=True, exist_ok=True)
+            (tmp / path).write_text(path)
+        (tmp / ".taskcatignore").write_text("scratch/*\n!scratch/keep.txt\n")
+        walked = []
+        real_walk = os.walk
+
+        def walk(path, *args):
+            for root, dirs, files in real_walk(path, *args):
+                walked.append(os.path.relpath(root, str(tmp)))
+                yield root, dirs, files
+
+        with mock.patch("taskcat._s3_sync.os.walk", walk):
+            file_list = S3Sync._get_local_file_list(str(tmp), include_checksums=False)
+        self.assertEqual(
+            [
+                "functions/packages/Func/lambda.zip",
+                "scratch/keep.txt",
+                "templates/a.yaml",
+            ],
+            sorted(file_list),
+        )
+        # excluded directories are never walked
+        self.assertNotIn("venv", walked)
+        self.assertNotIn("functions/source", walked)
+        self.assertNotIn("submodules/sub/.git", walked)
+
+    def test_hash_cache(self):
+        tmp = Path(mkdtemp())
+        path = tmp / "file"
+        path.write_bytes(b"a" * 10)
+        os.utime(str(path), (1, 1))
+        cache_path = tmp / "cache.json"
+        expected = S3Sync._hash_file(str(path), chunk_size=4)
+        cache = FileHashCache(cache_path, chunk_size=4)
+        self.assertEqual(expected, cache.etag(str(path)))
+        cache.save()
+
+        cache = FileHashCache(cache_path, chunk_size=4)
+        with mock.patch.object(S3Sync, "_hash_file") as m_hash:
+            self.assertEqual(expected, cache.etag(str(path)))
+            m_hash.assert_not_called()
+            # a different chunk size has a different etag
+            FileHashCache(cache_path).etag(str(path))
+            m_hash.assert_called_once()
+        # changed files are re-hashed, even if the mtime is unchanged
+        path.write_bytes(b"b" * 11)
+        os.utime(str(path), (1, 1))
+        self.assertEqual(
+            S3Sync._hash_file(str(path), chunk_size=4), cache.etag(str(path))
+        )
+
+    def test_hash_cache_racy(self):
+        tmp = Path(mkdtemp())
+        path = tmp / "file"
+        path.write_bytes(b"a")
+        cache = FileHashCache(tmp / "cache.json")
+        cache.etag(str(path))
+        cache.save()
+        # just modified files may change again within the mtime resolution
+        self.assertEqual({}, FileHashCache(tmp / "cache.json")._entries)
+
+    def test_hash_file(self):
+        tmp = Path(mkdtemp())
+        for size, threshold in [(0, 4), (3, 4), (4, 4), (5, 4), (13, 4), (12, 13)]:
+            data = os.urandom(size)
+            path = tmp / str(size)
+            path.write_bytes(data)
+            # as with s3transfer, files of at least the threshold are multipart
+            if size < threshold:
+                expected = '"{}"'.format(hashlib.md5(data).hexdigest())
+            else:
+                chunks = [data[i : i + 4] for i in range(0, size, 4)]
+                digests = b"".join(hashlib.md5(c).digest() for c in chunks)
+                expected = '"{}-{}"'.format(
+                    hashlib.md5(digests).hexdigest(), len(chunks)
+                )
+            self.assertEqual(
+                expected,
+                S3Sync._hash_file(str(path), chunk_size=4, threshold=threshold),
+            )
+        # parts are doubled in size to keep within S3's limit on the number of parts
+        with mock.patch("taskcat._s3_sync.MAX_PARTS", 2):
+            etag = S3Sync._hash_file(str(tmp / "13"), chunk_size=4)
+        self.assertTrue(etag.endswith('-2"'))
+
+    def test_create_transfer_config(self):
+        config = create_transfer_config(
+            concurrency=4, multipart_chunksize=16 * 1024 * 1024, max_bandwidth=1024
+        )
+        self.assertEqual(4, config.max_request_concurrency)
+        self.assertEqual(16 * 1024 * 1024, config.multipart_chunksize)
+        self.assertEqual(8 * 1024 * 1024, config.multipart_threshold)
+        self.assertEqual(1024, config.max_bandwidth)
+        # smaller parts would be resized by s3transfer, changing the etag
+        with self.assertRaises(TaskCatException):
+            create_transfer_config(multipart_chunksize=1024)
+
+    def test_sync_pipelined(self):
+        uploading = Event()
+        m_s3_client = mock.Mock()
+        m_s3_client.put_object.side_effect = lambda **kwargs: uploading.set()
+        m_cache = mock.Mock()
+
+        tmp = Path(mkdtemp())
+        first, second = str(tmp / "first"), str(tmp / "second")
+        Path(first).write_text("first")
+
+        def etag(path):
+            if path == second:
+                # only returns once the first file has started uploading
+                self.assertTrue(uploading.wait(5))
+            return "changed"
+
+        m_cache.etag.side_effect = etag
+        sync = self.sync(m_s3_client)
+        local_list = {"first": [first, ""], "second": [second, ""]}
+        s3_list = {"first": "unchanged", "second": "changed"}
+        with mock.patch("taskcat._s3_sync.HASH_THREADS", 1):
+            sync._sync(local_list, s3_list, "bucket", "", "private", hash_cache=m_cache)
+        m_s3_client.put_object.assert_called_once_with(
+            Bucket="bucket", Key="first", Body=mock.ANY, ACL="private"
+        )
+        self.assertEqual((1, 5), (sync.stats.uploaded, sync.stats.uploaded_bytes))
+        self.assertEqual(1, len(sync.stats.latencies))
+        self.assertEqual("changed", local_list["second"][1])
+
+    @staticmethod
+    def sync(s3_client, transfer_config=None):
+        sync = S3Sync.__new__(S3Sync)
+        sync.s3_client = s3_client
+        sync.transfer_config = transfer_config or create_transfer_config()
+        sync.copy_source = None
+        sync._manifest_exists = sync._manifest_stale = False
+        sync.stats = SyncStats()
+        return sync
+
+    def test_sync_retries(self):
+        tmp = Path(mkdtemp())
+        (tmp / "file").write_text("file")
+        local_list = {"file": [str(tmp / "file"), "etag"]}
+        m_s3_client = mock.Mock()
+        error = ClientError({"Error": {"Code": "InternalError"}}, "PutObject")
+        m_s3_client.put_object.side_effect = [error, None]
+        sync = self.sync(m_s3_client)
+        with mock.patch("taskcat._s3_sync.time.sleep") as m_sleep:
+            sync._sync(dict(local_list), {}, "bucket", "", "private")
+        m_sleep.assert_any_call(2)
+        self.assertEqual((1, 1), (sync.stats.uploaded, sync.stats.retries))
+        # access denied is not retried
+        error = ClientError({"Error": {"Code": "AccessDenied"}}, "PutObject")
+        m_s3_client.put_object.side_effect = [error, None]
+        sync = self.sync(m_s3_client)
+        with self.assertRaises(TaskCatException):
+            sync._sync(dict(local_list), {}, "bucket", "", "private")
+        self.assertEqual((0, 1), (sync.stats.uploaded, sync.stats.retries))
@@ -0,0 +1,101 @@
+import unittest
+from pathlib import Path
+from tempfile import mkdtemp
+
+from taskcat._config import Config
+from taskcat._s3_sync import S3Sync
+from taskcat._stage_closure import StageClosure, reference_key
+
+CONFIG = """
+project:
+  name: closure
+  regions:
+    - us-east-1
+tests:
+  default:
+    template: templates/main.yaml
+"""
+
+TEMPLATE = """
+Parameters:
+  KeyPrefix:
+    Type: String
+Resources:
+  Child:
+    Type: AWS::CloudFormation::Stack
+    Properties:
+      TemplateURL: !Sub 'https://${Bucket}.s3.amazonaws.com/${KeyPrefix}templates/child.yaml'
+"""
+
+CHILD = """
+Parameters:
+  KeyPrefix:
+    Type: String
+Resources:
+  Function:
+    Type: AWS::Lambda::Function
+    Properties:
+      Code:
+        S3Key: !Sub '${KeyPrefix}functions/packages/${Name}/lambda.zip'
+  Instance:
+    Type: AWS::EC2::Instance
+    Properties:
+      UserData: !Sub 'curl https://example.com/${KeyPrefix}scripts/'
+  Module:
+    Type: AWS::CloudFormation::Stack
+    Properties:
+      TemplateURL: 'https://example.com/prefix/templates/module.yaml'
+"""
+
+FILES = {
+    ".taskcat.yml": CONFIG,
+    "templates/main.yaml": TEMPLATE,
+    "templates/child.yaml": CHILD,
+    "templates/unused.yaml": "Resources: {}\n",
+    "functions/packages/FuncA/lambda.zip": "zip",
+    "functions/source/FuncA/index.py": "pass\n",
+    "scripts/setup.sh": "#!/bin/bash\n",
+    "submodules/module/templates/module.yaml": "Resources: {}\n",
+    "docs/guide.md": "# guide\n",
+}
+
+
+class TestStageClosure(unittest.TestCase):
+    def test_reference_key(self):
+        self.assertEqual("templates/a.yaml", reference_key("templates/a.yaml"))
+        self.assertEqual("a.yaml", reference_key("submodules/x/a.yaml"))
+        self.assertEqual(
+            "b/a.yaml", reference_key("submodules/x/submodules/y/b/a.yaml")
+        )
+        self.assertEqual("submodules/a.yaml", reference_key("submodules/a.yaml"))
+
+    def test_key_patterns(self):
+        # pylint: disable=protected-access
+        keys, patterns = StageClosure._key_patterns("https://host/a/b.zip")
+        self.assertEqual({"a/b.zip", "b.zip"}, keys)
+        self.assertEqual(set(), patterns)
+        self.assertEqual((set(), set()), StageClosure._key_patterns("String"))
+        _, patterns = StageClosure._key_patterns("${Prefix}a/${Name}/")
+        self.assertEqual({r".*a/.*/.*"}, patterns)
+
+    def test_filter(self):
+        root = Path(mkdtemp()).resolve()
+        for path, content in FILES.items():
+            (root / path).parent.mkdir(parents=True, exist_ok=True)
+            (root / path).write_text(content)
+        config = Config.create(
+            project_config_path=root / ".taskcat.yml", project_root=root
+        )
+        closure = StageClosure(config.get_templates(root), root)
+        # pylint: disable=protected-access
+        file_list = S3Sync._get_local_file_list(root, include_checksums=False)
+        self.assertEqual(
+            {
+                "templates/main.yaml",
+                "templates/child.yaml",
+                "functions/packages/FuncA/lambda.zip",
+                "scripts/setup.sh",
+                "submodules/module/templates/module.yaml",
+            },
+            set(closure.filter(file_list)),
+        )